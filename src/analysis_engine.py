@@ -1,57 +1,158 @@
 import datetime
+import hashlib
 import io
+import threading
 from typing import Dict, List, Optional, Tuple
 
-import joblib
 import numpy as np
 import torch
 
-try:
-    from fpdf import FPDF  # type: ignore
-except ImportError:  # pragma: no cover
-    FPDF = None
-
 from src import embeddings_utils
 from src import ingredient_lookup
-from src.preprocessing import join_ingredients_for_model, split_ingredients
-from src.safety_score import calculate_safety_score
-
-# Shared keyword lists for categorisation
-UNSAFE_KEYWORDS = [
-    "lauric acid",
-    "myristic acid",
-    "stearic acid",
-    "oleic acid",
-    "isopropyl myristate",
-    "cetyl alcohol",
-    "cetearyl alcohol",
-    "glyceryl stearate",
-    "polysorbate",
-    "sorbitan",
+from src import pdf_report
+from src.compiled_model import CompiledTfidfModel, compile_pipeline, load_model, model_source
+from src.preprocessing import ParsedIngredients, parse_ingredients, parse_many
+from src.result_cache import AnalysisResultCache, file_identity, result_key
+from src.safety_score import SAFETY_MATCHER, calculate_safety_score
+from src.shared_memory import SharedMemory
+
+# Texts used to check the compiled scorer agrees with the sklearn pipeline.
+SCORER_PROBE_TEXTS = [
+    "aqua, glycerin, niacinamide, panthenol",
+    "isopropyl myristate, cetyl alcohol, polysorbate 80, fragrance",
 ]
 
-NEUTRAL_RISK = [
-    "dimethicone",
-    "caprylic/capric triglyceride",
-    "fragrance",
-]
+
+def _utc_timestamp() -> str:
+    return datetime.datetime.utcnow().isoformat() + "Z"
 
 
 class AnalysisEngine:
-    def __init__(self, model_path: str = "models/tfidf_multiclass_model.joblib"):
+    # "auto" keeps exact search for small memories and switches to IVF at
+    # embeddings_utils.ANN_MIN_ROWS rows; "exact" / "ivf" force a backend;
+    # "float16" / "int8" hold the matrices quantised in the indexes and keep
+    # float32 rows only in their memory maps (MappedRows) for re-ranking.
+    index_backend = "auto"
+    product_index = None
+    flat_index = None
+    scorer = None
+    result_cache = None
+    model_identity = ""
+    memory_version = ""
+    _warmed = False
+    _model = None
+    _sentence_model = None
+    use_compiled_scorer = False
+    # True until refresh_memory() has run; components load on first use.
+    _memory_pending = False
+    _model_lock = threading.Lock()
+    _sentence_lock = threading.Lock()
+    _memory_lock = threading.Lock()
+    # Set to share the memory matrices with other worker processes.
+    shared_memory: Optional[SharedMemory] = None
+    _shared_generation = None
+    _shared_version = None
+    _keys_offset = 0
+
+    def __init__(
+        self,
+        model_path: str = "models/tfidf_multiclass_model.joblib",
+        use_compiled_scorer: bool = True,
+        result_cache: Optional[AnalysisResultCache] = None,
+        shared_memory: Optional[SharedMemory] = None,
+        index_backend: str = "auto",
+    ):
+        """
+        Cheap: nothing is loaded here. The classifier, the sentence encoder
+        and the product memory load on first use, or ahead of time through
+        warm_in_background(). With ``shared_memory`` the embedding matrices
+        are memory-mapped from files shared with other workers instead of
+        held privately.
+        """
         self.model_path = model_path
-        self.model = self._load_model()
-        self.sentence_model = embeddings_utils.load_sentence_model()
+        self.shared_memory = shared_memory
+        self.index_backend = index_backend
+        self.result_cache = result_cache
+        self.use_compiled_scorer = use_compiled_scorer
+        # Identifies the model in result cache keys without loading it.
+        self.model_identity = self._model_identity()
         self.product_names: List[str] = []
         self.ingredient_lists: List[str] = []
         self.embeddings: torch.Tensor = torch.empty((0, 0))
         self.flat_ingredients: List[str] = []
         self.flat_embeddings: torch.Tensor = torch.empty((0, 0))
         self.user_entries: List[Dict] = []
-        self.refresh_memory()
+        self._memory_pending = True
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    model = self._load_model()
+                    # A compact artefact exported since __init__ is what got loaded.
+                    self.model_identity = self._model_identity()
+                    # NumPy scorer extracted from the pipeline; None falls back to sklearn.
+                    if isinstance(model, CompiledTfidfModel):
+                        self.scorer = model  # the compact artefact is already one
+                    elif self.use_compiled_scorer:
+                        self.scorer = compile_pipeline(model, SCORER_PROBE_TEXTS)
+                    self._model = model
+        return self._model
+
+    @model.setter
+    def model(self, value):
+        self._model = value
+
+    @property
+    def sentence_model(self):
+        if self._sentence_model is None:
+            with self._sentence_lock:
+                if self._sentence_model is None:
+                    self._sentence_model = embeddings_utils.load_sentence_model()
+        return self._sentence_model
+
+    @sentence_model.setter
+    def sentence_model(self, value):
+        self._sentence_model = value
+
+    @property
+    def _sync_lock(self) -> threading.Lock:
+        # Per engine, unlike the class-level load locks. dict.setdefault is
+        # atomic, so engines built without __init__ also get exactly one.
+        return self.__dict__.setdefault("_engine_sync_lock", threading.Lock())
+
+    def _ensure_memory(self) -> None:
+        if self._memory_pending:
+            with self._memory_lock:
+                if self._memory_pending:
+                    self.refresh_memory()
+
+    def warm_in_background(self) -> threading.Thread:
+        """
+        Load every component on a daemon thread so the first request finds
+        them ready. Requests arriving earlier wait on the same locks.
+        """
+        thread = threading.Thread(target=self._warm_all, name="engine-warm", daemon=True)
+        thread.start()
+        return thread
+
+    def _warm_all(self) -> None:
+        try:
+            self._ensure_memory()
+            _ = self.model
+            self.warm_up()
+        except Exception:
+            pass  # the first real request retries and reports the error
+
+    def _model_identity(self) -> str:
+        # The file load_model picks (the compact .dlm when fresh), not just model_path.
+        source = model_source(self.model_path, prefer_compact=self.use_compiled_scorer)
+        return f"{file_identity(source)}|{embeddings_utils.SENTENCE_MODEL_NAME}"
 
     def _load_model(self):
-        model = joblib.load(self.model_path)
+        # Shared by every engine in the process; prefers the compact artefact.
+        model = load_model(self.model_path, prefer_compact=self.use_compiled_scorer)
         if not hasattr(model, "classes_") or len(model.classes_) != 10:
             raise ValueError(
                 f"Incorrect model loaded from {self.model_path}. "
@@ -61,36 +162,265 @@ class AnalysisEngine:
         return model
 
     def refresh_memory(self):
-        base_names, base_ing, base_embeds = embeddings_utils.load_base_product_memory(self.sentence_model)
-        user_names, user_ing, user_embeds, user_entries = embeddings_utils.load_user_memory()
-
-        self.product_names = [*base_names, *user_names]
-        self.ingredient_lists = [*base_ing, *user_ing]
-        if base_embeds.numel() == 0 and user_embeds.numel() == 0:
+        """
+        Full reload of base and user memory. Only needed at start-up or when
+        the user memory file was rewritten; new entries go through sync_memory().
+        The base memory comes from the memory-mapped snapshot, so only user
+        ingredients not already in it are encoded.
+        """
+        if self.shared_memory is not None:
+            self._attach_shared_memory()
+            return
+
+        base = embeddings_utils.load_base_snapshot(lambda: self.sentence_model)
+        user_entries, user_offset = embeddings_utils.read_user_memory_since(0)
+        user_names, user_ing, user_embeds = embeddings_utils.user_memory_from_entries(user_entries)
+
+        self.product_names = [*base.product_names, *user_names]
+        self.ingredient_lists = [*base.ingredient_lists, *user_ing]
+        if self._quantized:
+            # No concatenated copy: the snapshot and user store maps are the rows.
+            self.embeddings = self._row_segments(base.embeddings, user_embeds)
+        elif base.embeddings.numel() == 0 and user_embeds.numel() == 0:
             self.embeddings = torch.empty((0, self.sentence_model.get_sentence_embedding_dimension()), dtype=torch.float32)
-        elif base_embeds.numel() == 0:
+        elif base.embeddings.numel() == 0:
             self.embeddings = user_embeds
         elif user_embeds.numel() == 0:
-            self.embeddings = base_embeds
+            self.embeddings = base.embeddings
         else:
-            self.embeddings = torch.cat([base_embeds, user_embeds], dim=0)
-
-        self.flat_ingredients, self.flat_embeddings = embeddings_utils.build_flat_ingredient_embeddings(
-            self.ingredient_lists,
-            self.sentence_model,
-            device=self.embeddings.device if self.embeddings.numel() > 0 else None,
-        )
+            self.embeddings = torch.cat([base.embeddings, user_embeds], dim=0)
+
+        self._flat_seen = set(base.flat_ingredients)
+        user_flat = embeddings_utils.new_flat_ingredients(user_ing, self._flat_seen)
+        self.flat_ingredients = [*base.flat_ingredients, *user_flat]
+        self.flat_embeddings = self._row_segments(base.flat_embeddings) if self._quantized else base.flat_embeddings
+        if user_flat:
+            user_flat_embeds = embeddings_utils.encode_ingredients(user_flat, self.sentence_model, device=self._memory_device())
+            if self._quantized:
+                self.flat_embeddings.append(user_flat_embeds)
+            elif self.flat_embeddings.numel() == 0:
+                self.flat_embeddings = user_flat_embeds
+            else:
+                self.flat_embeddings = torch.cat([self.flat_embeddings, user_flat_embeds], dim=0)
         self.user_entries = user_entries
+        self._user_memory_offset = user_offset
+        self._finish_refresh()
 
-    def generate_explanation(self, ingredients: List[str], score: int) -> str:
-        ingredients_lower = [i.lower() for i in ingredients]
+    def _finish_refresh(self) -> None:
+        self._memory_keys = set()
+        self.memory_version = file_identity(embeddings_utils.BASE_EMBEDDINGS_PATH)
+        self._advance_memory_version(self.product_names, self.ingredient_lists)
 
-        detected_strong = [
-            bad for bad in UNSAFE_KEYWORDS if any(bad in ing for ing in ingredients_lower)
-        ]
-        detected_mild = [
-            mid for mid in NEUTRAL_RISK if any(mid in ing for ing in ingredients_lower)
+        self._product_rows = embeddings_utils.row_buffer(self.embeddings)
+        self._flat_rows = embeddings_utils.row_buffer(self.flat_embeddings)
+        self.product_index = embeddings_utils.build_vector_index(self.embeddings, self.index_backend)
+        self.flat_index = embeddings_utils.build_vector_index(self.flat_embeddings, self.index_backend)
+        self._memory_pending = False
+
+    def _attach_shared_memory(self) -> None:
+        """
+        Map the shared matrices, first (re)building them under the writer
+        lock if they are missing, stale, or behind the user memory file.
+        """
+        shared = self.shared_memory
+        source = embeddings_utils.base_memory_source()
+        with shared.lock():
+            state = shared.read_state()
+            if state is None or state.get("source") != source or state["user_offset"] > embeddings_utils.user_memory_size():
+                self.shared_memory = None
+                try:
+                    self.refresh_memory()  # private build, then published
+                finally:
+                    self.shared_memory = shared
+                state = shared.reset(
+                    source,
+                    embeddings_utils.as_numpy(self.embeddings),
+                    self.flat_ingredients,
+                    embeddings_utils.as_numpy(self.flat_embeddings),
+                    self._user_memory_offset,
+                )
+            else:
+                self._shared_generation = None  # do not trust local keys
+                state = self._publish_pending(state)
+            version = shared.version.read()
+
+        base = embeddings_utils.load_base_snapshot(lambda: self.sentence_model)
+        user_entries, self._user_memory_offset = embeddings_utils.read_user_memory_since(0, end=state["user_offset"])
+        user_names, user_ing, _ = embeddings_utils.user_memory_from_entries(user_entries)
+        self.flat_ingredients, self._keys_offset = shared.read_keys(state)
+        products, ingredients = shared.matrices(state)
+
+        self.product_names = [*base.product_names, *user_names]
+        self.ingredient_lists = [*base.ingredient_lists, *user_ing]
+        self.embeddings = self._mapped(products)
+        self.flat_embeddings = self._mapped(ingredients)
+        self._flat_seen = set(self.flat_ingredients)
+        self.user_entries = user_entries
+        self._shared_generation = state["generation"]
+        self._shared_version = version
+        self._finish_refresh()
+
+    def _publish_pending(self, state: Dict) -> Dict:
+        """
+        Publish user memory entries appended after the shared state: their
+        product rows plus any ingredients the shared vocabulary lacks.
+        Callers hold the writer lock.
+        """
+        entries, end = embeddings_utils.read_user_memory_since(state["user_offset"])
+        if not entries:
+            return state
+        _, ingredients, embeds = embeddings_utils.user_memory_from_entries(entries)
+        # Keys published by other workers since our last sync are not in _flat_seen.
+        local = state["generation"] == self._shared_generation
+        published, _ = self.shared_memory.read_keys(state, self._keys_offset if local else 0)
+        known = set(published)
+        fresh = [
+            ing
+            for ing in embeddings_utils.new_flat_ingredients(ingredients, set())
+            if ing not in known and not (local and ing in self._flat_seen)
         ]
+        vectors = embeddings_utils.encode_ingredients(fresh, self.sentence_model) if fresh else torch.empty((0, embeds.size(1)))
+        return self.shared_memory.append(embeds.detach().cpu().numpy(), fresh, vectors.detach().cpu().numpy(), end)
+
+    def _advance_memory_version(self, names: List[str], ingredient_lists: List[str]) -> None:
+        """
+        Chain every product not seen before into memory_version. The version
+        only depends on memory content, so workers with the same memory agree
+        on it. Re-storing a known product adds no new neighbour and keeps it.
+        """
+        digest = hashlib.sha256(self.memory_version.encode("utf-8"))
+        changed = False
+        for name, ingredients in zip(names, ingredient_lists):
+            key = f"{name}\x1f{ingredients}"
+            if key in self._memory_keys:
+                continue
+            self._memory_keys.add(key)
+            digest.update(key.encode("utf-8"))
+            digest.update(b"\x00")
+            changed = True
+        if changed:
+            self.memory_version = digest.hexdigest()
+
+    @property
+    def _quantized(self) -> bool:
+        return self.index_backend in embeddings_utils.QUANTIZED_BACKENDS
+
+    def _row_segments(self, *segments) -> embeddings_utils.MappedRows:
+        rows = embeddings_utils.MappedRows(segments)
+        if rows.dim is None:  # empty memory: the index still needs a width
+            rows.dim = self.sentence_model.get_sentence_embedding_dimension()
+        return rows
+
+    def _mapped(self, matrix: np.ndarray):
+        """
+        Wrap a memory-mapped shared matrix without copying it.
+        """
+        return embeddings_utils.MappedRows([matrix]) if self._quantized else torch.from_numpy(matrix)
+
+    def _extend_index(self, index, embeddings, new_rows):
+        if index is None:
+            # Builds one only once "auto" crosses the ANN threshold.
+            return embeddings_utils.build_vector_index(embeddings, self.index_backend)
+        index.add(embeddings_utils.as_numpy(new_rows))
+        return index
+
+    def sync_memory(self) -> int:
+        """
+        Incrementally add user memory entries appended since the last read,
+        whether by this process or another one. Only the new embedding rows
+        are appended and only ingredients not seen before are encoded.
+        Returns the number of entries added.
+        """
+        self._ensure_memory()
+        # Offsets and row appends must move together: without the lock two
+        # callers read the same offset and both append the same entries.
+        with self._sync_lock:
+            if self.shared_memory is not None:
+                return self._sync_shared_memory()
+            return self._sync_local_memory()
+
+    def _sync_local_memory(self) -> int:
+        if embeddings_utils.user_memory_size() < self._user_memory_offset:
+            # File was truncated or replaced; offsets are meaningless now.
+            self.refresh_memory()
+            return len(self.user_entries)
+
+        entries, self._user_memory_offset = embeddings_utils.read_user_memory_since(self._user_memory_offset)
+        if not entries:
+            return 0
+
+        names, ingredients, embeds = embeddings_utils.user_memory_from_entries(entries)
+        self.product_names.extend(names)
+        self.ingredient_lists.extend(ingredients)
+        self._advance_memory_version(names, ingredients)
+        self.embeddings = self._product_rows.append(embeds)
+        self.product_index = self._extend_index(self.product_index, self.embeddings, embeds)
+
+        new_flat = embeddings_utils.new_flat_ingredients(ingredients, self._flat_seen)
+        if new_flat:
+            new_embeds = embeddings_utils.encode_ingredients(new_flat, self.sentence_model, device=self._memory_device())
+            self.flat_embeddings = self._flat_rows.append(new_embeds)
+            self.flat_ingredients.extend(new_flat)
+            self.flat_index = self._extend_index(self.flat_index, self.flat_embeddings, new_embeds)
+
+        self.user_entries.extend(entries)
+        return len(entries)
+
+    def _sync_shared_memory(self) -> int:
+        """
+        Pick up rows other workers published. A single counter read when
+        nothing changed; otherwise only the new metadata is parsed and the
+        shared matrices are remapped.
+        """
+        shared = self.shared_memory
+        version = shared.version.read()
+        if version == self._shared_version:
+            return 0
+        state = shared.read_state()
+        if state is None or state["generation"] != self._shared_generation:
+            self.refresh_memory()
+            return len(self.user_entries)
+        self._shared_version = version
+
+        entries, self._user_memory_offset = embeddings_utils.read_user_memory_since(self._user_memory_offset, end=state["user_offset"])
+        keys, self._keys_offset = shared.read_keys(state, self._keys_offset)
+        if not entries and not keys:
+            return 0
+
+        names, ingredients, _ = embeddings_utils.user_memory_from_entries(entries)
+        self.product_names.extend(names)
+        self.ingredient_lists.extend(ingredients)
+        self._advance_memory_version(names, ingredients)
+        self.flat_ingredients.extend(keys)
+        self._flat_seen.update(keys)
+
+        products, flat = shared.matrices(state)
+        old_products, old_flat = len(self.embeddings), len(self.flat_embeddings)
+        self.embeddings = self._mapped(products)
+        self.flat_embeddings = self._mapped(flat)
+        if len(products) > old_products:
+            self.product_index = self._extend_index(self.product_index, self.embeddings, products[old_products:])
+        if len(flat) > old_flat:
+            self.flat_index = self._extend_index(self.flat_index, self.flat_embeddings, flat[old_flat:])
+
+        self.user_entries.extend(entries)
+        return len(entries)
+
+    def warm_up(self) -> None:
+        """
+        Run the encoder once so the first real request does not pay for its
+        lazy initialisation. Cheap to call again; safe from worker threads.
+        """
+        if self._warmed:
+            return
+        embeddings_utils.embed_text("aqua, glycerin", self.sentence_model, device=self._memory_device())
+        self._warmed = True
+
+    def generate_explanation(self, ingredients: List[str], score: int) -> str:
+        # Keywords never contain newlines, so no match can span two ingredients.
+        hits = SAFETY_MATCHER.find_all("\n".join(ingredients))
+        detected_strong = list(dict.fromkeys(hit.keyword for hit in hits if hit.group == "unsafe"))
+        detected_mild = list(dict.fromkeys(hit.keyword for hit in hits if hit.group == "mild"))
 
         if score >= 8:
             explanation = (
@@ -115,29 +445,98 @@ class AnalysisEngine:
 
     def _categorise_ingredients(self, ingredients: List[str]) -> Dict[str, List[str]]:
         safe, mild, unsafe = [], [], []
-        for ing in ingredients:
-            lower = ing.lower()
-            if any(bad in lower for bad in UNSAFE_KEYWORDS):
+        for ing, hits in zip(ingredients, SAFETY_MATCHER.hits_per_item(ingredients)):
+            groups = {hit.group for hit in hits}
+            if "unsafe" in groups:
                 unsafe.append(ing)
-            elif any(mid in lower for mid in NEUTRAL_RISK):
+            elif "mild" in groups:
                 mild.append(ing)
             else:
                 safe.append(ing)
         return {"safe": safe, "mild": mild, "unsafe": unsafe}
 
-    def analyze(self, ingredients_text: str, product_name: Optional[str] = None, skip_store: bool = False) -> Dict:
-        clean_text = join_ingredients_for_model(ingredients_text)
-        ingredients_list = split_ingredients(ingredients_text)
-
-        pred_label = self.model.predict([clean_text])[0]
-        pred_probs = self.model.predict_proba([clean_text])[0]
-        classes = list(self.model.classes_)
+    def _memory_device(self):
+        return getattr(self.embeddings, "device", None) if len(self.embeddings) else None
 
-        score = calculate_safety_score(ingredients_text)
+    def _predict(self, clean_texts: List[str]) -> Tuple[List[str], np.ndarray]:
+        """
+        One predict_proba pass; labels are the argmax class, as predict() would give.
+        """
+        model = self.model  # loads the scorer along with the model
+        scorer = self.scorer or model
+        pred_probs = np.asarray(scorer.predict_proba(clean_texts))
+        pred_labels = np.asarray(model.classes_)[np.argmax(pred_probs, axis=1)]
+        return pred_labels.tolist(), pred_probs
+
+    def _build_result(
+        self,
+        parsed: ParsedIngredients,
+        product_name: Optional[str],
+        pred_label: str,
+        pred_probs: np.ndarray,
+        embedding: torch.Tensor,
+        similar_products: List[Dict],
+        ingredient_similarities: Dict[str, Dict[str, float]],
+    ) -> Dict:
+        ingredients_list = list(parsed.ingredients)
+        score = calculate_safety_score(parsed)
         highlight_groups = self._categorise_ingredients(ingredients_list)
         explanation = self.generate_explanation(ingredients_list, score)
 
-        embedding = embeddings_utils.embed_text(clean_text, self.sentence_model, device=self.embeddings.device if self.embeddings.numel() > 0 else None)
+        return {
+            "product_name": product_name or "Untitled Product",
+            "ingredients_raw": parsed.raw,
+            "clean_text": parsed.clean_text,
+            "ingredients_list": ingredients_list,
+            "tfidf": {
+                "label": pred_label,
+                "probs": pred_probs.tolist(),
+                "classes": list(self.model.classes_),
+            },
+            "safety_score": score,
+            "highlight_groups": highlight_groups,
+            "explanation": explanation,
+            "embedding": embedding.cpu().tolist(),
+            "similar_products": similar_products,
+            "ingredient_similarities": ingredient_similarities,
+            "timestamp": _utc_timestamp(),
+        }
+
+    def _result_key(self, parsed: ParsedIngredients) -> Optional[str]:
+        if self.result_cache is None:
+            return None
+        return result_key(parsed.clean_text, self.model_identity, self.memory_version)
+
+    def _cached_result(self, key: Optional[str], parsed: ParsedIngredients, product_name: Optional[str]) -> Optional[Dict]:
+        if key is None:
+            return None
+        request = {
+            "product_name": product_name or "Untitled Product",
+            "ingredients_raw": parsed.raw,
+            "timestamp": _utc_timestamp(),
+        }
+        return self.result_cache.get(key, request)
+
+    def analyze(self, ingredients_text: str, product_name: Optional[str] = None, skip_store: bool = False) -> Dict:
+        # Clean and split once; every stage below reuses the same tokenisation.
+        parsed = parse_ingredients(ingredients_text)
+        self._ensure_memory()  # memory_version is part of the cache key
+        key = self._result_key(parsed)
+        result = self._cached_result(key, parsed, product_name)
+        if result is None:
+            result = self._analyze_one(parsed, product_name)
+            if key is not None:
+                self.result_cache.put(key, result)
+
+        if not skip_store:
+            self._store_results([result])
+
+        return result
+
+    def _analyze_one(self, parsed: ParsedIngredients, product_name: Optional[str]) -> Dict:
+        pred_labels, pred_probs = self._predict([parsed.clean_text])
+
+        embedding = embeddings_utils.embed_text(parsed.clean_text, self.sentence_model, device=self._memory_device())
 
         similar_products = embeddings_utils.find_similar_products(
             embedding,
@@ -145,52 +544,189 @@ class AnalysisEngine:
             self.ingredient_lists,
             self.embeddings,
             top_k=5,
+            index=self.product_index,
         )
 
         ingredient_similarities = embeddings_utils.most_similar_ingredients(
-            ingredients_text,
+            parsed,
             self.flat_ingredients,
             self.flat_embeddings,
             self.sentence_model,
             top_k=1,
+            index=self.flat_index,
         )
 
-        result = {
-            "product_name": product_name or "Untitled Product",
-            "ingredients_raw": ingredients_text,
-            "clean_text": clean_text,
-            "ingredients_list": ingredients_list,
-            "tfidf": {
-                "label": pred_label,
-                "probs": pred_probs.tolist(),
-                "classes": classes,
-            },
-            "safety_score": score,
-            "highlight_groups": highlight_groups,
-            "explanation": explanation,
-            "embedding": embedding.cpu().tolist(),
-            "similar_products": similar_products,
-            "ingredient_similarities": ingredient_similarities,
-            "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-        }
+        return self._build_result(
+            parsed,
+            product_name,
+            pred_labels[0],
+            pred_probs[0],
+            embedding,
+            similar_products,
+            ingredient_similarities,
+        )
+
+    def analyze_many(
+        self,
+        texts: List[str],
+        names: Optional[List[Optional[str]]] = None,
+        skip_store: bool = False,
+        batch_size: int = 256,
+    ) -> List[Dict]:
+        """
+        Batched analyze(): one TF-IDF pass over all texts, product texts and
+        distinct ingredients encoded in large encoder batches, and one matrix
+        top-k per similarity stage. Results come back in input order and use
+        the same shape as analyze(). Every text is compared against the memory
+        as it was when the call started; results are stored together at the end.
+        Texts found in the result cache skip the batch entirely.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        names = list(names) if names is not None else [None] * len(texts)
+        if len(names) != len(texts):
+            raise ValueError(f"Got {len(texts)} ingredient lists but {len(names)} product names.")
+
+        parsed = parse_many(texts)
+        self._ensure_memory()
+        keys = [self._result_key(p) for p in parsed]
+        results = [self._cached_result(key, p, name) for key, p, name in zip(keys, parsed, names)]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            computed = self._analyze_batch([parsed[i] for i in missing], [names[i] for i in missing], batch_size)
+            for i, result in zip(missing, computed):
+                results[i] = result
+                if keys[i] is not None:
+                    self.result_cache.put(keys[i], result)
 
         if not skip_store:
-            self._store_result(result)
+            self._store_results(results)
 
-        return result
+        return results
+
+    def _analyze_batch(self, parsed: List[ParsedIngredients], names: List[Optional[str]], batch_size: int) -> List[Dict]:
+        clean_texts = [p.clean_text for p in parsed]
+        pred_labels, pred_probs = self._predict(clean_texts)
+
+        embeddings = embeddings_utils.embed_texts(
+            clean_texts,
+            self.sentence_model,
+            device=self._memory_device(),
+            batch_size=batch_size,
+        )
+
+        similar_products = embeddings_utils.find_similar_products_batch(
+            embeddings,
+            self.product_names,
+            self.ingredient_lists,
+            self.embeddings,
+            top_k=5,
+            index=self.product_index,
+        )
+
+        ingredient_similarities = embeddings_utils.most_similar_ingredients_batch(
+            parsed,
+            self.flat_ingredients,
+            self.flat_embeddings,
+            self.sentence_model,
+            top_k=1,
+            batch_size=batch_size,
+            index=self.flat_index,
+        )
+
+        return [
+            self._build_result(
+                parsed[i],
+                names[i],
+                pred_labels[i],
+                pred_probs[i],
+                embeddings[i],
+                similar_products[i],
+                ingredient_similarities[i],
+            )
+            for i in range(len(parsed))
+        ]
+
+    def similar_products_many(self, texts: List[str], top_k: int = 5, batch_size: int = 256) -> List[List[Dict]]:
+        """
+        Nearest stored products for each ingredient list: one encoder pass
+        and one matrix top-k for the whole batch.
+        """
+        if not texts:
+            return []
+        self._ensure_memory()
+        parsed = parse_many(list(texts))
+        embeddings = embeddings_utils.embed_texts(
+            [p.clean_text for p in parsed],
+            self.sentence_model,
+            device=self._memory_device(),
+            batch_size=batch_size,
+        )
+        return embeddings_utils.find_similar_products_batch(
+            embeddings,
+            self.product_names,
+            self.ingredient_lists,
+            self.embeddings,
+            top_k=top_k,
+            index=self.product_index,
+        )
+
+    def ingredient_insights_many(self, texts: List[str], top_k: int = 1, batch_size: int = 256) -> List[Dict]:
+        """
+        Per-ingredient view of each list: risk group, safety score and the
+        closest known ingredients. Skips the classifier and product search.
+        """
+        if not texts:
+            return []
+        self._ensure_memory()
+        parsed = parse_many(list(texts))
+        similarities = embeddings_utils.most_similar_ingredients_batch(
+            parsed,
+            self.flat_ingredients,
+            self.flat_embeddings,
+            self.sentence_model,
+            top_k=top_k,
+            batch_size=batch_size,
+            index=self.flat_index,
+        )
+        return [
+            {
+                "ingredients_list": list(p.ingredients),
+                "highlight_groups": self._categorise_ingredients(list(p.ingredients)),
+                "safety_score": calculate_safety_score(p),
+                "ingredient_similarities": sims,
+            }
+            for p, sims in zip(parsed, similarities)
+        ]
 
     def _store_result(self, result: Dict):
-        entry = {
-            "product_name": result.get("product_name", "Untitled Product"),
-            "ingredients": result.get("ingredients_raw", ""),
-            "embedding": result.get("embedding", []),
-            "timestamp": result.get("timestamp"),
-            "analysis": result,
-        }
-        embeddings_utils.append_user_memory(entry)
-        self.refresh_memory()
+        self._store_results([result])
+
+    def _store_results(self, results: List[Dict]):
+        entries = [
+            {
+                "product_name": result.get("product_name", "Untitled Product"),
+                "ingredients": result.get("ingredients_raw", ""),
+                "embedding": result.get("embedding", []),
+                "timestamp": result.get("timestamp"),
+                "analysis": result,
+            }
+            for result in results
+        ]
+        if self.shared_memory is None:
+            embeddings_utils.append_user_memories(entries)
+        else:
+            # Single writer: append and publish the rows as one step.
+            with self.shared_memory.lock():
+                embeddings_utils.append_user_memories(entries)
+                state = self.shared_memory.read_state()
+                if state is not None:
+                    self._publish_pending(state)
+        self.sync_memory()
 
     def get_previous_results(self) -> List[Dict]:
+        self.sync_memory()
         return list(self.user_entries)
 
     def load_cached_analysis(self, entry: Dict) -> Optional[Dict]:
@@ -209,82 +745,20 @@ class AnalysisEngine:
     def generate_pdf_report(self, result: Dict, lime_image: Optional[bytes] = None) -> Optional[io.BytesIO]:
         """
         Build an in-memory PDF summarising the analysis. Returns BytesIO or None.
-        If fpdf is not installed, gracefully return None.
+        If fpdf is not installed, gracefully return None. Repeat requests for
+        the same result and image are served from the report cache.
         """
-        if FPDF is None:
-            return None
+        data = pdf_report.cached_report(result, lime_image)
+        return io.BytesIO(data) if data is not None else None
 
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", "B", 14)
-        pdf.cell(0, 10, "DermaLens Skincare Analysis", ln=True)
-
-        pdf.set_font("Arial", "", 11)
-        pdf.cell(0, 8, f"Product: {result.get('product_name', 'N/A')}", ln=True)
-        pdf.cell(0, 8, f"Timestamp: {result.get('timestamp', '')}", ln=True)
-        pdf.ln(4)
-
-        # Prediction
-        tfidf = result.get("tfidf", {})
-        pdf.set_font("Arial", "B", 12)
-        pdf.cell(0, 8, "Model Prediction", ln=True)
-        pdf.set_font("Arial", "", 11)
-        pdf.cell(0, 8, f"Label: {tfidf.get('label', 'N/A')}", ln=True)
-
-        probs = tfidf.get("probs")
-        classes = tfidf.get("classes", [])
-        if probs is not None:
-            probs_arr = np.array(probs)
-            top_idx = np.argsort(probs_arr)[::-1][:3]
-            for idx in top_idx:
-                pdf.cell(0, 8, f"{classes[idx]}: {probs_arr[idx]:.3f}", ln=True)
-        pdf.ln(4)
-
-        # Safety
-        pdf.set_font("Arial", "B", 12)
-        pdf.cell(0, 8, "Fungal Acne Score", ln=True)
-        pdf.set_font("Arial", "", 11)
-        pdf.cell(0, 8, f"Score: {result.get('safety_score', 'N/A')}/10", ln=True)
-        pdf.multi_cell(0, 8, f"Explanation: {result.get('explanation', '')}")
-        pdf.ln(4)
-
-        # Ingredients
-        pdf.set_font("Arial", "B", 12)
-        pdf.cell(0, 8, "Ingredients", ln=True)
-        pdf.set_font("Arial", "", 11)
-        pdf.multi_cell(0, 8, result.get("ingredients_raw", ""))
-        pdf.ln(4)
-
-        # Similar products
-        pdf.set_font("Arial", "B", 12)
-        pdf.cell(0, 8, "Similar Products", ln=True)
-        pdf.set_font("Arial", "", 11)
-        for item in result.get("similar_products", [])[:5]:
-            pdf.cell(0, 8, f"{item['product_name']} ({item['score']:.2f})", ln=True)
-        pdf.ln(4)
-
-        # Ingredient similarities
-        pdf.set_font("Arial", "B", 12)
-        pdf.cell(0, 8, "Ingredient Insights", ln=True)
-        pdf.set_font("Arial", "", 11)
-        for ing, sim in result.get("ingredient_similarities", {}).items():
-            pdf.cell(0, 8, f"{ing} -> {sim['closest_ingredient']} ({sim['score']:.2f})", ln=True)
-        pdf.ln(4)
-
-        # LIME image if provided
-        if lime_image:
-            try:
-                pdf.set_font("Arial", "B", 12)
-                pdf.cell(0, 8, "LIME Explanation", ln=True)
-                img_stream = io.BytesIO(lime_image)
-                pdf.image(img_stream, x=None, y=None, w=170)
-            except Exception:
-                pass
-
-        buffer = io.BytesIO()
-        pdf.output(buffer)
-        buffer.seek(0)
-        return buffer
+    def generate_batch_report(self, results: List[Dict]) -> Optional[io.BytesIO]:
+        """
+        One PDF covering several stored analyses, or None without fpdf.
+        """
+        if not results:
+            return None
+        data = pdf_report.cached_batch_report(list(results))
+        return io.BytesIO(data) if data is not None else None
 
 
 def fetch_product_ingredients(product_name: str) -> Dict[str, str]:
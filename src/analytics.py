@@ -4,19 +4,9 @@ from collections import Counter
 import pandas as pd
 import streamlit as st
 
-LOG_PATH = os.path.join("logs", "analysis_log.csv")
+from src.safety_score import SAFETY_MATCHER
 
-UNSAFE_KEYWORDS = [
-    "lauric acid",
-    "myristic acid",
-    "stearic acid",
-    "oleic acid",
-    "isopropyl myristate",
-    "cetyl alcohol",
-    "glyceryl stearate",
-    "polysorbate",
-    "sorbitan",
-]
+LOG_PATH = os.path.join("logs", "analysis_log.csv")
 
 
 def load_logs():
@@ -55,10 +45,7 @@ def main():
     st.subheader("Most Common Unsafe Ingredients")
     unsafe_counts = Counter()
     for text in df["raw_text"].astype(str):
-        lower = text.lower()
-        for word in UNSAFE_KEYWORDS:
-            if word in lower:
-                unsafe_counts[word] += 1
+        unsafe_counts.update(SAFETY_MATCHER.present(text, group="unsafe"))
 
     if unsafe_counts:
         st.write(dict(unsafe_counts))
@@ -1,3 +1,4 @@
+import hashlib
 import io
 import os
 import sys
@@ -9,20 +10,21 @@ import numpy as np
 import pandas as pd
 from PIL import Image, ImageDraw, ImageFont
 import streamlit as st
-from lime.lime_text import LimeTextExplainer
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src.analysis_engine import (  # noqa: E402
     AnalysisEngine,
-    NEUTRAL_RISK,
-    UNSAFE_KEYWORDS,
     fetch_product_ingredients,
     extract_ingredients_from_image,
 )
-from src.preprocessing import join_ingredients_for_model  # noqa: E402
-from src import barcode_scanner, store_availability, user_favourites  # noqa: E402
+from src.explanations import DEFAULT_LIME_SAMPLES, explain_prediction  # noqa: E402
+from src.result_cache import AnalysisResultCache  # noqa: E402
+from src.safety_score import NEUTRAL_RISK, UNSAFE_KEYWORDS  # noqa: E402
+from src.scan_pipeline import ScanJob, ScanPipeline  # noqa: E402
+from src.shared_memory import SharedMemory, shared_memory_enabled  # noqa: E402
+from src import pdf_report, store_availability, user_favourites  # noqa: E402
 
 st.set_page_config(
     page_title="DermaLens | Skincare Intelligence",
@@ -32,11 +34,33 @@ st.set_page_config(
 )
 
 EXECUTOR = ThreadPoolExecutor(max_workers=2)
+RESULT_CACHE_DIR = "models/result_cache"
+SCAN_STAGE_LABELS = {
+    "queued": "waiting",
+    "decode": "decoding barcode",
+    "lookup": "looking up product",
+    "ingredients": "fetching ingredients",
+    "analyze": "analyzing",
+}
+EXPLAINER_LABELS = {"Fast (exact linear)": "linear", "LIME sampling": "lime"}
 
 
 @st.cache_resource
 def get_engine() -> AnalysisEngine:
-    return AnalysisEngine()
+    # Construction is cheap; models and memory load on a background thread
+    # while the first page renders.
+    # Opt-in (DERMALENS_SHARED_MEMORY=1): matrices shared by every worker.
+    engine = AnalysisEngine(
+        result_cache=AnalysisResultCache(cache_dir=RESULT_CACHE_DIR),
+        shared_memory=SharedMemory() if shared_memory_enabled() else None,
+    )
+    engine.warm_in_background()
+    return engine
+
+
+@st.cache_resource
+def get_scan_pipeline(_engine: AnalysisEngine) -> ScanPipeline:
+    return ScanPipeline(_engine)
 
 
 def ensure_array(probs):
@@ -85,6 +109,10 @@ def init_state():
         "product_name_input": "",
         "dark_mode": True,
         "show_share": False,
+        "explainer_mode": "Fast (exact linear)",
+        "lime_samples": DEFAULT_LIME_SAMPLES,
+        "pdf_requested": set(),
+        "scan_job": None,
     }
     for key, value in defaults.items():
         if key not in st.session_state:
@@ -251,37 +279,22 @@ def render_previous_products(engine: AnalysisEngine, use_sidebar: bool = False):
     return cached
 
 
-def run_lime_if_requested(engine: AnalysisEngine, text: str, classes, model):
-    explainer = LimeTextExplainer(class_names=list(classes))
-
-    def predict_proba_lime(text_list):
-        processed = [join_ingredients_for_model(t) for t in text_list]
-        return model.predict_proba(processed)
-
-    exp = explainer.explain_instance(
+def run_lime_if_requested(engine: AnalysisEngine, text: str, mode: str = "linear", num_samples: int = DEFAULT_LIME_SAMPLES):
+    """
+    Memoised explanation for the current result; reruns reuse the cached
+    features and PNG instead of explaining again.
+    """
+    explanation = explain_prediction(
         text,
-        predict_proba_lime,
+        engine.model,
+        scorer=engine.scorer,
+        model_identity=engine.model_identity,
+        mode=mode,
         num_features=8,
-        top_labels=1,
+        num_samples=num_samples,
     )
-    top_idx = exp.top_labels[0]
-    top_label_name = classes[top_idx]
-    lime_df = pd.DataFrame(exp.as_list(label=top_idx), columns=["feature", "weight"])
-
-    lime_image_bytes: Optional[bytes] = None
-    try:
-        import matplotlib.pyplot as plt
-
-        fig = exp.as_pyplot_figure(label=top_idx)
-        buf = io.BytesIO()
-        fig.savefig(buf, format="png", bbox_inches="tight")
-        plt.close(fig)
-        buf.seek(0)
-        lime_image_bytes = buf.read()
-    except Exception:
-        lime_image_bytes = None
-
-    return top_label_name, lime_df, lime_image_bytes
+    lime_df = pd.DataFrame(list(explanation.features), columns=["feature", "weight"])
+    return explanation.label, lime_df, explanation.image
 
 
 def build_share_payload(result: Dict) -> str:
@@ -313,11 +326,23 @@ def perform_analysis(engine: AnalysisEngine, ingredients_text: str, product_name
             time.sleep(0.08)
             progress.progress(int(pct * 100))
         result = engine.analyze(ingredients_text, product_name=product_name or None)
+    set_analysis_result(result)
+
+
+def set_analysis_result(result: Dict, availability_future=None):
+    """
+    Make ``result`` the current analysis. A store check already running
+    for it (from the scan pipeline) is reused instead of starting another.
+    """
     st.session_state.analysis_result = result
     st.session_state.lime_image = None
     st.session_state.share_payload = build_share_payload(result)
     st.session_state.show_share = False
-    trigger_availability_check(result.get("product_name", ""))
+    if availability_future is not None:
+        st.session_state.availability_result = None
+        st.session_state.availability_future = availability_future
+    else:
+        trigger_availability_check(result.get("product_name", ""))
 
 
 def render_availability():
@@ -368,7 +393,16 @@ def render_actions(engine: AnalysisEngine, result: Dict, key_prefix: str = "anal
         if st.button("Share this analysis", key=f"share_{key_prefix}"):
             st.session_state["show_share"] = True
     with cols[2]:
-        pdf_buffer = engine.generate_pdf_report(result, lime_image=st.session_state.lime_image)
+        # Reports are only built once asked for; the button records which
+        # report (by content) this session wants ready for download.
+        lime_image = st.session_state.lime_image
+        report_id = pdf_report.report_key([result], lime_image)
+        requested = st.session_state.pdf_requested
+        if report_id not in requested and st.button("Prepare PDF report", key=f"pdf_prepare_{key_prefix}"):
+            requested.add(report_id)
+        if report_id not in requested:
+            return
+        pdf_buffer = engine.generate_pdf_report(result, lime_image=lime_image)
         if pdf_buffer:
             st.download_button(
                 label="Download PDF report",
@@ -429,7 +463,10 @@ def render_analysis(engine: AnalysisEngine, result: Dict, expert_mode: bool, key
         if expert_mode:
             st.markdown("#### LIME Explanation")
             top_label_name, lime_df, lime_image = run_lime_if_requested(
-                engine, result["ingredients_raw"], classes, engine.model
+                engine,
+                result["ingredients_raw"],
+                mode=EXPLAINER_LABELS[st.session_state.get("explainer_mode", "Fast (exact linear)")],
+                num_samples=int(st.session_state.get("lime_samples", DEFAULT_LIME_SAMPLES)),
             )
             st.write(f"Top label explained: **{top_label_name}**")
             st.dataframe(lime_df)
@@ -438,28 +475,47 @@ def render_analysis(engine: AnalysisEngine, result: Dict, expert_mode: bool, key
             st.info("Toggle Expert Mode to run LIME explanations.")
 
 
+def render_scan_job(job: Optional[ScanJob]):
+    if job is None:
+        return
+    if not job.done():
+        st.info(f"Scanning in the background: {SCAN_STAGE_LABELS.get(job.stage, job.stage)}...")
+        st.button("Refresh scan status", key="scan_refresh")
+        return
+
+    if job.codes:
+        st.success(f"Detected barcode: {job.codes[0]}")
+    if job.lookup:
+        st.info(job.lookup.get("message", ""))
+    if job.product_name:
+        st.markdown(f"**Guessed product:** {job.product_name}")
+    if job.error:
+        st.warning(job.error)
+    if job.result is not None and st.session_state.get("scan_applied_frame") != job.frame_id:
+        st.session_state.ingredients_input = job.fetched.get("ingredients", "")
+        st.session_state.product_name_input = job.product_name
+        set_analysis_result(job.result, availability_future=job.availability_future)
+        st.session_state.scan_applied_frame = job.frame_id
+    if job.result is not None:
+        st.success("Ingredients pulled from web search and analyzed.")
+    if job.timings:
+        st.caption(" · ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in job.timings.items()))
+
+
 def render_scan_tab(engine: AnalysisEngine):
     st.markdown("Capture a product barcode to auto-fill a search.")
     camera_image = st.camera_input("Scan Product (Camera)")
     if camera_image is not None:
-        codes = barcode_scanner.decode_barcodes(camera_image)
-        if not codes:
-            st.warning("No barcode detected. Try again with better lighting.")
-        else:
-            code = codes[0]
-            st.success(f"Detected barcode: {code}")
-            lookup = barcode_scanner.lookup_product_from_barcode(code)
-            product_guess = lookup.get("product_name", "")
-            st.info(lookup.get("message", ""))
-            if product_guess:
-                st.markdown(f"**Guessed product:** {product_guess}")
-                fetched = fetch_product_ingredients(product_guess)
-                if fetched.get("ingredients"):
-                    st.session_state.ingredients_input = fetched["ingredients"]
-                    st.session_state.product_name_input = product_guess
-                    st.success("Ingredients pulled from web search. Ready to analyze.")
-                    if st.button("Analyze scanned product"):
-                        perform_analysis(engine, fetched["ingredients"], product_guess)
+        frame = camera_image.getvalue()
+        digest = hashlib.sha1(frame).hexdigest()
+        if st.session_state.get("scan_frame_digest") != digest:
+            # A new frame replaces (and cancels) this session's running scan.
+            previous = st.session_state.get("scan_job")
+            if previous is not None and not previous.done():
+                previous.cancel()
+            st.session_state.scan_frame_digest = digest
+            st.session_state.scan_job = get_scan_pipeline(engine).submit(frame)
+        render_scan_job(st.session_state.get("scan_job"))
 
     st.markdown("---")
     st.markdown("Manual fallback if scanning is not available or fails.")
@@ -488,6 +544,20 @@ def render_favourites_tab(engine: AnalysisEngine):
         st.info("No favourites saved yet. Analyze a product and star it to save.")
         return
 
+    if st.button("Prepare favourites report", key="fav_report_prepare"):
+        st.session_state.fav_report_requested = True
+    if st.session_state.get("fav_report_requested"):
+        analyses = [fav.get("analysis") or fav for fav in favourites]
+        report = engine.generate_batch_report(analyses)
+        if report:
+            st.download_button(
+                label="Download favourites PDF",
+                data=report,
+                file_name="dermalens_favourites.pdf",
+                mime="application/pdf",
+                key="fav_report_download",
+            )
+
     for fav in favourites:
         with st.container():
             cols = st.columns([1, 3, 1])
@@ -511,6 +581,10 @@ def render_sidebar(engine: AnalysisEngine):
     st.sidebar.toggle("Dark mode", key="dark_mode")
     st.sidebar.markdown("#### Expert Mode")
     st.sidebar.toggle("Enable LIME explanations", key="expert_mode", value=False)
+    if st.session_state.get("expert_mode"):
+        st.sidebar.radio("Explainer", list(EXPLAINER_LABELS), key="explainer_mode")
+        if st.session_state.get("explainer_mode") == "LIME sampling":
+            st.sidebar.slider("LIME samples", 500, 10000, step=500, key="lime_samples")
     st.sidebar.markdown("---")
     st.sidebar.markdown("#### Quick History")
     cached = render_previous_products(engine, use_sidebar=True)
@@ -1,17 +1,30 @@
 """
 Barcode decoding utilities for DermaLens.
 Uses pyzbar + Pillow to decode and a lightweight web search to guess product names.
+Barcodes already in the local product catalogue skip the web search.
+
+Benchmark the decoders on a folder of sample frames with:
+
+    python -m src.barcode_scanner bench path/to/images
 """
 from __future__ import annotations
 
 import io
-from typing import Dict, List
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
 from urllib.parse import quote_plus
 
+import numpy as np
 import requests
 from bs4 import BeautifulSoup
 from PIL import Image
 
+from src import http_cache
+from src.product_catalogue import GUESSED_SOURCE, get_catalogue
+
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
     "(KHTML, like Gecko) Chrome/120.0 Safari/537.36",
@@ -24,39 +37,218 @@ except ImportError:  # pragma: no cover
     ZBarSymbol = None
 
 
-def decode_barcodes(file_obj) -> List[str]:
-    """
-    Decode barcodes from a Streamlit UploadedFile or bytes object.
-    Returns a list of unique barcode strings.
-    """
-    if decode is None:
-        return []
+# Longest image side tried by the fast decoder, smallest first (None = full size).
+DECODE_SCALES = (480, 960, None)
+# Side of the thumbnail the gradient heuristic runs on.
+REGION_PROBE_SIDE = 320
+RETAIL_LENGTHS = (8, 12, 13)
 
-    if file_obj is None:
-        return []
 
+def _read_bytes(file_obj) -> bytes:
     data = file_obj if isinstance(file_obj, (bytes, bytearray)) else file_obj.read()
     if hasattr(file_obj, "seek"):
         try:
             file_obj.seek(0)
         except Exception:
             pass
+    return bytes(data)
+
+
+def _symbols():
+    return [ZBarSymbol.EAN13, ZBarSymbol.EAN8, ZBarSymbol.UPCA, ZBarSymbol.CODE128] if ZBarSymbol else None
+
+
+def _decode_image(image, symbols) -> List[str]:
+    results = decode(image, symbols=symbols) if symbols else decode(image)
+    return list(dict.fromkeys(res.data.decode("utf-8") for res in results if res.data))
+
 
+def is_valid_retail_code(code: str) -> bool:
+    """
+    True for an EAN-8, UPC-A or EAN-13 string whose check digit is correct.
+    """
+    if not code.isdigit() or len(code) not in RETAIL_LENGTHS:
+        return False
+    digits = [int(c) for c in code]
+    body, check = digits[:-1], digits[-1]
+    # Weights alternate 3, 1 starting from the digit next to the check digit.
+    total = sum(d * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(body)))
+    return (10 - total % 10) % 10 == check
+
+
+def _greyscale(data: bytes, max_side: Optional[int]) -> Image.Image:
+    """
+    Decode to greyscale with the longest side at most ``max_side``. JPEG
+    frames are decoded at reduced scale by libjpeg itself (draft mode).
+    """
+    image = Image.open(io.BytesIO(data))
+    if max_side and max(image.size) > max_side:
+        if image.format == "JPEG":
+            image.draft("L", (max_side, max_side))
+        image = image.convert("L")
+        image.thumbnail((max_side, max_side))
+        return image
+    return image.convert("L")
+
+
+def candidate_regions(grey: Image.Image, max_regions: int = 2, block: int = 8) -> List[Tuple[float, float, float, float]]:
+    """
+    Likely barcode areas as (left, top, right, bottom) fractions of the
+    image. Bars give strong gradients across them and weak ones along
+    them, so blocks where |dx| and |dy| differ most are grown into boxes.
+    """
+    probe = grey.copy()
+    probe.thumbnail((REGION_PROBE_SIDE, REGION_PROBE_SIDE))
+    arr = np.asarray(probe, dtype=np.float32)
+    if arr.shape[0] < 2 * block or arr.shape[1] < 2 * block:
+        return []
+    gx = np.abs(np.diff(arr, axis=1))[:-1, :]
+    gy = np.abs(np.diff(arr, axis=0))[:, :-1]
+    score = np.abs(gx - gy)
+    rows, cols = score.shape[0] // block, score.shape[1] // block
+    grid = score[: rows * block, : cols * block].reshape(rows, block, cols, block).mean(axis=(1, 3))
+    mask = grid > grid.mean() + grid.std()
+
+    regions = []
+    while mask.any() and len(regions) < max_regions:
+        seed = np.unravel_index(np.argmax(np.where(mask, grid, -1.0)), grid.shape)
+        component = np.zeros_like(mask)
+        stack = [seed]
+        while stack:
+            r, c = stack.pop()
+            if r < 0 or c < 0 or r >= rows or c >= cols or component[r, c] or not mask[r, c]:
+                continue
+            component[r, c] = True
+            stack.extend([(r + 1, c), (r - 1, c), (r, c + 1), (r, c - 1)])
+        mask &= ~component
+        found_rows, found_cols = np.nonzero(component)
+        if len(found_rows) < 2:
+            continue
+        top, bottom = found_rows.min() / rows, (found_rows.max() + 1) / rows
+        left, right = found_cols.min() / cols, (found_cols.max() + 1) / cols
+        pad_y, pad_x = 0.1 * (bottom - top) + 0.02, 0.1 * (right - left) + 0.02
+        regions.append((max(0.0, left - pad_x), max(0.0, top - pad_y), min(1.0, right + pad_x), min(1.0, bottom + pad_y)))
+    return regions
+
+
+def decode_fast(data: bytes, scales: Sequence[Optional[int]] = DECODE_SCALES) -> List[str]:
+    """
+    Greyscale, coarse-to-fine decoding. At each scale the candidate regions
+    are tried before the whole frame, and decoding stops as soon as a code
+    with a valid EAN/UPC checksum turns up. Valid retail codes come first.
+    """
+    if decode is None or not data:
+        return []
+    symbols = _symbols()
+    found: List[str] = []
+    regions = None
+    for max_side in scales:
+        try:
+            grey = _greyscale(data, max_side)
+        except Exception:
+            continue  # keep what earlier scales found; try the next one
+        if regions is None:
+            regions = candidate_regions(grey)
+        width, height = grey.size
+        crops = [
+            grey.crop((int(l * width), int(t * height), int(r * width), int(b * height)))
+            for l, t, r, b in regions
+        ]
+        for image in [*crops, grey]:
+            for code in _decode_image(image, symbols):
+                if code not in found:
+                    found.append(code)
+            valid = [code for code in found if is_valid_retail_code(code)]
+            if valid:
+                return valid + [code for code in found if code not in valid]
+    return found
+
+
+def decode_full(data: bytes) -> List[str]:
+    """
+    Reference decoder: the whole full-resolution RGB frame in one pass.
+    """
+    if decode is None or not data:
+        return []
     try:
         image = Image.open(io.BytesIO(data)).convert("RGB")
     except Exception:
         return []
+    return _decode_image(image, _symbols())
 
-    symbols = [ZBarSymbol.EAN13, ZBarSymbol.EAN8, ZBarSymbol.UPCA, ZBarSymbol.CODE128] if ZBarSymbol else None
-    results = decode(image, symbols=symbols) if symbols else decode(image)
-    return list({res.data.decode("utf-8") for res in results if res.data})
+
+def decode_barcodes(file_obj, mode: str = "fast") -> List[str]:
+    """
+    Decode barcodes from a Streamlit UploadedFile or bytes object.
+    Returns a list of unique barcode strings. ``mode`` is "fast"
+    (decode_fast) or "full" (decode_full).
+    """
+    if decode is None:
+        return []
+
+    if file_obj is None:
+        return []
+
+    data = _read_bytes(file_obj)
+    return decode_full(data) if mode == "full" else decode_fast(data)
+
+
+def decode_batch(frames: Sequence, max_workers: Optional[int] = None, mode: str = "fast") -> List[List[str]]:
+    """
+    Decode several frames (bytes or file objects) in a process pool.
+    Results are in input order; a single frame is decoded inline.
+    """
+    data = [_read_bytes(frame) for frame in frames]
+    fn = decode_full if mode == "full" else decode_fast
+    if len(data) <= 1:
+        return [fn(frame) for frame in data]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(fn, data))
+
+
+def benchmark(folder: str, max_workers: Optional[int] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Time both decoders on every image in ``folder`` and report how often
+    the fast decoder agrees with the full one.
+    """
+    paths = sorted(
+        os.path.join(folder, name)
+        for name in os.listdir(folder)
+        if name.lower().endswith((".jpg", ".jpeg", ".png", ".bmp", ".webp"))
+    )
+    frames = []
+    for path in paths:
+        with open(path, "rb") as fh:
+            frames.append(fh.read())
+
+    report: Dict[str, Dict[str, float]] = {}
+    outputs: Dict[str, List[List[str]]] = {}
+    for mode, fn in (("full", decode_full), ("fast", decode_fast)):
+        started = time.perf_counter()
+        outputs[mode] = [fn(frame) for frame in frames]
+        elapsed = time.perf_counter() - started
+        report[mode] = {
+            "images": len(frames),
+            "decoded": sum(1 for codes in outputs[mode] if codes),
+            "total_s": elapsed,
+            "per_image_ms": 1000 * elapsed / max(len(frames), 1),
+        }
+    started = time.perf_counter()
+    decode_batch(frames, max_workers=max_workers)
+    elapsed = time.perf_counter() - started
+    report["fast_batch"] = {"images": len(frames), "total_s": elapsed, "per_image_ms": 1000 * elapsed / max(len(frames), 1)}
+    agree = sum(
+        1
+        for full, fast in zip(outputs["full"], outputs["fast"])
+        if not full or (fast and fast[0] in full)
+    )
+    report["fast"]["agreement"] = agree / max(len(frames), 1)
+    return report
 
 
 def _search_first_result(query: str) -> Dict[str, str]:
     url = f"https://duckduckgo.com/html/?q={quote_plus(query)}"
-    response = requests.get(url, headers=HEADERS, timeout=8)
-    response.raise_for_status()
-    soup = BeautifulSoup(response.text, "lxml")
+    soup = BeautifulSoup(http_cache.cached_get_text(url, source="barcode_search"), "lxml")
     first = soup.select_one(".result")
     if not first:
         return {}
@@ -77,6 +269,16 @@ def lookup_product_from_barcode(barcode: str) -> Dict[str, str]:
     if not barcode:
         return {"status": "missing", "message": "No barcode detected.", "product_name": "", "link": ""}
 
+    catalogue = get_catalogue()
+    known = catalogue.lookup_barcode(barcode)
+    if known is not None:
+        return {
+            "status": "success",
+            "message": "Found this barcode in the local product catalogue.",
+            "product_name": known.name,
+            "link": "",
+        }
+
     try:
         result = _search_first_result(f"{barcode} skincare product")
     except requests.RequestException as exc:
@@ -87,6 +289,8 @@ def lookup_product_from_barcode(barcode: str) -> Dict[str, str]:
 
     title = result.get("title", "")
     product_name = title.split(" - ")[0] if title else ""
+    if product_name:
+        catalogue.add(product_name, barcode=barcode, source=GUESSED_SOURCE)
     return {
         "status": "success",
         "message": "Found a possible product match from barcode search.",
@@ -94,3 +298,11 @@ def lookup_product_from_barcode(barcode: str) -> Dict[str, str]:
         "link": result.get("link", ""),
         "snippet": result.get("snippet", ""),
     }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "bench":
+        print("usage: python -m src.barcode_scanner bench <image folder>")
+        sys.exit(1)
+    for name, row in benchmark(sys.argv[2]).items():
+        print(f"{name:>10}: " + ", ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}" for key, value in row.items()))
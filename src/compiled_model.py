@@ -0,0 +1,426 @@
+"""
+Compiled scorer for the TF-IDF + LogisticRegression pipeline.
+
+The vocabulary, idf vector and coefficient matrix are pulled out of the
+sklearn Pipeline saved by train_tfidf.py and documents are scored with
+plain NumPy ops. This skips sklearn's per-call input validation, which
+dominates the cost of single-document requests. Outputs match the
+pipeline's predict_proba to floating-point tolerance.
+
+The scorer can also be saved as a compact artefact (save_compact). One file
+holds a JSON header and 64-byte aligned sections:
+- the vocabulary as sorted UTF-8 terms plus an open-addressing hash table
+  of term ids;
+- a float32 idf vector, coefficient matrix and intercept.
+
+load_compact() memory-maps it, so loading is immediate, and workers on a
+machine share the weight pages. There is no unpickling and no per-process
+vocabulary dict. load_model() is the process-wide entry point: it prefers
+an up-to-date compact file next to the joblib pipeline and never loads
+the same file twice.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+from collections import Counter
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import joblib
+import numpy as np
+
+DEFAULT_TOKEN_PATTERN = r"(?u)\b\w\w+\b"
+COMPACT_SUFFIX = ".dlm"
+COMPACT_MAGIC = b"DLTFIDF1"
+_LENGTH = struct.Struct("<Q")
+_ALIGN = 64
+
+
+class CompiledTfidfModel:
+    """
+    Drop-in stand-in for the pipeline's predict / predict_proba / classes_.
+    Supports the word analyzer with the default tokeniser (no custom
+    preprocessor, tokenizer, stop words or accent stripping).
+    """
+
+    def __init__(
+        self,
+        vocabulary: Dict[str, int],
+        idf: Optional[np.ndarray],
+        coef: np.ndarray,
+        intercept: np.ndarray,
+        classes: Sequence[str],
+        ngram_range: Tuple[int, int] = (1, 1),
+        token_pattern: str = DEFAULT_TOKEN_PATTERN,
+        lowercase: bool = True,
+        norm: Optional[str] = "l2",
+        sublinear_tf: bool = False,
+        binary: bool = False,
+        multinomial: bool = True,
+    ):
+        coef = np.asarray(coef)
+        if coef.ndim != 2 or coef.shape[0] != len(classes):
+            raise ValueError("Compiled scoring needs one coefficient row per class (multi-class models only).")
+        self.vocabulary = vocabulary
+        self.idf = None if idf is None else np.asarray(idf)
+        # (n_features, n_classes) so a document gathers contiguous rows.
+        self.coef_t = np.ascontiguousarray(coef.T)
+        self.intercept = np.asarray(intercept)
+        self.classes_ = np.asarray(classes)
+        self.ngram_range = tuple(ngram_range)
+        self.token_pattern = token_pattern
+        self._token_re = re.compile(token_pattern)
+        self.lowercase = lowercase
+        self.norm = norm
+        self.sublinear_tf = sublinear_tf
+        self.binary = binary
+        self.multinomial = multinomial
+        self._terms: Optional[List[str]] = None
+
+    @classmethod
+    def from_pipeline(cls, pipeline) -> "CompiledTfidfModel":
+        """
+        Extract the scorer from a fitted Pipeline([TfidfVectorizer, LogisticRegression]).
+        Raises ValueError if the pipeline uses features this scorer does not mirror.
+        """
+        steps = getattr(pipeline, "steps", None)
+        if not steps or len(steps) != 2:
+            raise ValueError("Expected a two-step TF-IDF + classifier Pipeline.")
+        vectorizer, clf = steps[0][1], steps[1][1]
+
+        unsupported = [
+            name
+            for name in ("preprocessor", "tokenizer", "stop_words", "strip_accents")
+            if getattr(vectorizer, name, None) is not None
+        ]
+        if getattr(vectorizer, "analyzer", None) != "word":
+            unsupported.append("analyzer")
+        if not hasattr(vectorizer, "vocabulary_") or not hasattr(clf, "coef_"):
+            raise ValueError("Pipeline is not fitted or is not TF-IDF + linear.")
+        if unsupported:
+            raise ValueError(f"Vectorizer options not supported by the compiled scorer: {', '.join(unsupported)}")
+
+        idf = vectorizer.idf_ if getattr(vectorizer, "use_idf", True) else None
+        multi_class = getattr(clf, "multi_class", "auto")
+        ovr = multi_class == "ovr" or (
+            multi_class in ("auto", "deprecated") and getattr(clf, "solver", "lbfgs") == "liblinear"
+        )
+        return cls(
+            vocabulary=dict(vectorizer.vocabulary_),
+            idf=idf,
+            coef=clf.coef_,
+            intercept=clf.intercept_,
+            classes=clf.classes_,
+            ngram_range=vectorizer.ngram_range,
+            token_pattern=vectorizer.token_pattern,
+            lowercase=vectorizer.lowercase,
+            norm=vectorizer.norm,
+            sublinear_tf=vectorizer.sublinear_tf,
+            binary=vectorizer.binary,
+            multinomial=not ovr,
+        )
+
+    def analyze(self, doc: str) -> List[str]:
+        """
+        Word n-grams in the same order sklearn's word analyzer produces them.
+        """
+        if self.lowercase:
+            doc = doc.lower()
+        tokens = self._token_re.findall(doc)
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return tokens
+        grams = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n, len(tokens)) + 1):
+            grams.extend(" ".join(tokens[i : i + n]) for i in range(len(tokens) - n + 1))
+        return grams
+
+    def features(self, doc: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Sparse TF-IDF row for one document as (feature ids, values).
+        """
+        lookup = self.vocabulary.get
+        counts = Counter(idx for idx in map(lookup, self.analyze(doc)) if idx is not None)
+        if not counts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        idx = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        if self.binary:
+            values = np.ones_like(values)
+        elif self.sublinear_tf:
+            values = 1.0 + np.log(values)
+        if self.idf is not None:
+            values = values * self.idf[idx]
+        if self.norm == "l2":
+            values = values / np.sqrt(np.dot(values, values))
+        elif self.norm == "l1":
+            values = values / np.abs(values).sum()
+        return idx, values
+
+    @property
+    def terms(self) -> List[str]:
+        """
+        Feature id -> n-gram string, built on first use.
+        """
+        if self._terms is None:
+            terms = [""] * self.coef_t.shape[0]
+            for term, idx in self.vocabulary.items():
+                terms[idx] = term
+            self._terms = terms
+        return self._terms
+
+    def decision_function(self, docs: Iterable[str]) -> np.ndarray:
+        rows = []
+        for doc in docs:
+            idx, values = self.features(doc)
+            rows.append(values @ self.coef_t[idx] + self.intercept)
+        if not rows:
+            return np.empty((0, len(self.classes_)))
+        return np.vstack(rows)
+
+    def predict_proba(self, docs: Iterable[str]) -> np.ndarray:
+        scores = self.decision_function(docs)
+        if self.multinomial:
+            scores = scores - scores.max(axis=1, keepdims=True)
+            exp = np.exp(scores)
+            return exp / exp.sum(axis=1, keepdims=True)
+        probs = 1.0 / (1.0 + np.exp(-scores))
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def predict(self, docs: Iterable[str]) -> np.ndarray:
+        return self.classes_[np.argmax(self.decision_function(docs), axis=1)]
+
+
+class MappedVocabulary(Mapping):
+    """
+    Read-only term -> feature id mapping over memory-mapped arrays. Term i
+    is ``blob[offsets[i]:offsets[i + 1]]``. ``table`` is a power-of-two
+    open-addressing table of term ids keyed by crc32 (-1 marks an empty
+    slot), so a lookup is one hash and usually one comparison.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray, table: np.ndarray):
+        self._blob = blob
+        self._view = memoryview(blob) if len(blob) else memoryview(b"")
+        self._offsets = offsets
+        self._table = table
+        self._mask = len(table) - 1
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def term(self, idx: int) -> str:
+        return bytes(self._view[int(self._offsets[idx]) : int(self._offsets[idx + 1])]).decode("utf-8")
+
+    def get(self, term, default=None):
+        if not isinstance(term, str) or self._mask < 0:
+            return default
+        data = term.encode("utf-8")
+        slot = zlib.crc32(data) & self._mask
+        while True:
+            idx = int(self._table[slot])
+            if idx < 0:
+                return default
+            if self._view[int(self._offsets[idx]) : int(self._offsets[idx + 1])] == data:
+                return idx
+            slot = (slot + 1) & self._mask
+
+    def __getitem__(self, term) -> int:
+        idx = self.get(term)
+        if idx is None:
+            raise KeyError(term)
+        return idx
+
+    def __contains__(self, term) -> bool:
+        return self.get(term) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.term(i) for i in range(len(self)))
+
+    def items(self):
+        return ((self.term(i), i) for i in range(len(self)))
+
+
+def compact_path(model_path: str) -> str:
+    """
+    Where the compact artefact for a joblib pipeline lives.
+    """
+    return os.path.splitext(model_path)[0] + COMPACT_SUFFIX
+
+
+def save_compact(model: CompiledTfidfModel, path: str) -> None:
+    """
+    Write ``model`` as a compact artefact, atomically. Feature ids are
+    renumbered in sorted term order; weights are stored as float32.
+    """
+    ordered = sorted(model.vocabulary.items())
+    old_ids = np.array([idx for _, idx in ordered], dtype=np.int64)
+    encoded = [term.encode("utf-8") for term, _ in ordered]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(data) for data in encoded], dtype=np.uint64)
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    table = np.full(1 << max(1, (2 * len(encoded) - 1).bit_length()), -1, dtype=np.int32)
+    mask = len(table) - 1
+    for idx, data in enumerate(encoded):
+        slot = zlib.crc32(data) & mask
+        while table[slot] >= 0:
+            slot = (slot + 1) & mask
+        table[slot] = idx
+
+    sections = {
+        "offsets": offsets,
+        "blob": blob,
+        "table": table,
+        "coef_t": np.ascontiguousarray(model.coef_t[old_ids], dtype=np.float32),
+        "intercept": np.asarray(model.intercept, dtype=np.float32),
+    }
+    if model.idf is not None:
+        sections["idf"] = np.asarray(model.idf[old_ids], dtype=np.float32)
+
+    header = {
+        "classes": [str(c) for c in model.classes_],
+        "ngram_range": list(model.ngram_range),
+        "token_pattern": model.token_pattern,
+        "lowercase": model.lowercase,
+        "norm": model.norm,
+        "sublinear_tf": model.sublinear_tf,
+        "binary": model.binary,
+        "multinomial": model.multinomial,
+        "sections": {},
+    }
+    # Section offsets are relative to the data start, so the header size
+    # does not depend on them.
+    position = 0
+    for name, array in sections.items():
+        header["sections"][name] = {"offset": position, "dtype": array.dtype.str, "shape": list(array.shape)}
+        position = (position + array.nbytes + _ALIGN - 1) // _ALIGN * _ALIGN
+    raw_header = json.dumps(header).encode("utf-8")
+    data_start = (len(COMPACT_MAGIC) + _LENGTH.size + len(raw_header) + _ALIGN - 1) // _ALIGN * _ALIGN
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(COMPACT_MAGIC)
+        fh.write(_LENGTH.pack(len(raw_header)))
+        fh.write(raw_header)
+        for name, array in sections.items():
+            fh.write(b"\0" * (data_start + header["sections"][name]["offset"] - fh.tell()))
+            fh.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+def load_compact(path: str) -> CompiledTfidfModel:
+    """
+    Memory-map a compact artefact written by save_compact.
+    """
+    with open(path, "rb") as fh:
+        if fh.read(len(COMPACT_MAGIC)) != COMPACT_MAGIC:
+            raise ValueError(f"{path} is not a compact DermaLens model.")
+        (length,) = _LENGTH.unpack(fh.read(_LENGTH.size))
+        header = json.loads(fh.read(length).decode("utf-8"))
+    data_start = (len(COMPACT_MAGIC) + _LENGTH.size + length + _ALIGN - 1) // _ALIGN * _ALIGN
+
+    def section(name):
+        spec = header["sections"].get(name)
+        if spec is None:
+            return None
+        shape = tuple(spec["shape"])
+        if not all(shape):
+            return np.zeros(shape, dtype=spec["dtype"])
+        return np.memmap(path, dtype=spec["dtype"], mode="r", offset=data_start + spec["offset"], shape=shape)
+
+    coef_t = section("coef_t")
+    return CompiledTfidfModel(
+        vocabulary=MappedVocabulary(section("blob"), section("offsets"), section("table")),
+        idf=section("idf"),
+        coef=coef_t.T,
+        intercept=section("intercept"),
+        classes=header["classes"],
+        ngram_range=tuple(header["ngram_range"]),
+        token_pattern=header["token_pattern"],
+        lowercase=header["lowercase"],
+        norm=header["norm"],
+        sublinear_tf=header["sublinear_tf"],
+        binary=header["binary"],
+        multinomial=header["multinomial"],
+    )
+
+
+def export_compact(pipeline, path: str, probe_texts: Sequence[str] = (), atol: float = 1e-5) -> Optional[str]:
+    """
+    Compile ``pipeline`` and save it as a compact artefact. The float32
+    file is reloaded and checked against the pipeline on ``probe_texts``
+    (same labels, probabilities within ``atol``). Returns the path, or
+    None if the pipeline cannot be compiled or the check fails.
+    """
+    compiled = compile_pipeline(pipeline, probe_texts)
+    if compiled is None:
+        return None
+    save_compact(compiled, path)
+    if probe_texts:
+        texts = list(probe_texts)
+        expected = np.asarray(pipeline.predict_proba(texts))
+        got = load_compact(path).predict_proba(texts)
+        if not (np.array_equal(got.argmax(axis=1), expected.argmax(axis=1)) and np.allclose(got, expected, atol=atol)):
+            os.remove(path)
+            return None
+    return path
+
+
+_MODELS: Dict[Tuple[str, int, int], object] = {}
+_MODELS_LOCK = threading.Lock()
+
+
+def _fresh_compact(model_path: str) -> Optional[str]:
+    compact = compact_path(model_path)
+    if model_path == compact or not os.path.exists(compact):
+        return None
+    if os.path.exists(model_path) and os.path.getmtime(compact) < os.path.getmtime(model_path):
+        return None  # the pipeline was retrained after the export
+    return compact
+
+
+def model_source(model_path: str, prefer_compact: bool = True) -> str:
+    """
+    The file load_model reads for ``model_path``: its up-to-date compact
+    artefact if there is one, else ``model_path`` itself.
+    """
+    return (_fresh_compact(model_path) if prefer_compact else None) or model_path
+
+
+def load_model(model_path: str, prefer_compact: bool = True):
+    """
+    Process-wide model loader. Returns the compact scorer when an
+    up-to-date one sits next to ``model_path``, else the joblib pipeline.
+    Each file version is loaded once per process, however many callers.
+    """
+    target = model_source(model_path, prefer_compact)
+    stat = os.stat(target)  # FileNotFoundError for a missing model
+    key = (os.path.abspath(target), stat.st_size, stat.st_mtime_ns)
+    with _MODELS_LOCK:
+        model = _MODELS.get(key)
+        if model is None:
+            model = load_compact(target) if target.endswith(COMPACT_SUFFIX) else joblib.load(target)
+            _MODELS[key] = model
+        return model
+
+
+def compile_pipeline(pipeline, probe_texts: Sequence[str] = (), atol: float = 1e-9) -> Optional[CompiledTfidfModel]:
+    """
+    Compile a pipeline, or return None if it is not supported or the
+    compiled scorer disagrees with the pipeline on the probe texts.
+    """
+    try:
+        compiled = CompiledTfidfModel.from_pipeline(pipeline)
+    except (ValueError, AttributeError):
+        return None
+    if probe_texts:
+        expected = np.asarray(pipeline.predict_proba(list(probe_texts)))
+        if not np.allclose(compiled.predict_proba(probe_texts), expected, atol=atol):
+            return None
+    return compiled
@@ -0,0 +1,113 @@
+"""
+Persistent ingredient -> embedding cache shared by the embeddings utilities.
+Vectors live in a memory-mapped VectorStore; a plain-text keys file maps each
+cleaned ingredient string to its row. One cache exists per encoder model so
+vectors from different models never mix.
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from src.preprocessing import clean_ingredients_text
+from src.shared_memory import file_lock
+from src.vector_store import VectorStore
+
+CACHE_DIR = "models/embedding_cache"
+
+
+def cache_key(ingredient: str) -> str:
+    """
+    Normalise an ingredient string into its cache key.
+    Falls back to the stripped raw text when cleaning leaves nothing.
+    """
+    key = clean_ingredients_text(ingredient) or str(ingredient).strip()
+    return key.replace("\n", " ")
+
+
+class IngredientEmbeddingCache:
+    """
+    Append-only on-disk cache. Keys are appended after their vectors, so a
+    key line never points at a row that was not fully written.
+    """
+
+    def __init__(self, model_name: str, dim: int, cache_dir: str = CACHE_DIR):
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        self.model_name = model_name
+        self.keys_path = os.path.join(cache_dir, f"{slug}.keys")
+        self.store = VectorStore(os.path.join(cache_dir, f"{slug}.vec"), dim=dim)
+        self._index: Dict[str, int] = {}
+        self._rows = 0
+        self._keys_offset = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self._lock:
+            self._read_new_keys()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _read_new_keys(self) -> None:
+        if not os.path.exists(self.keys_path):
+            return
+        with open(self.keys_path, "rb") as fh:
+            fh.seek(self._keys_offset)
+            chunk = fh.read()
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].split(b"\n")[:-1]:
+            self._index.setdefault(line.decode("utf-8"), self._rows)
+            self._rows += 1
+        self._keys_offset += end
+
+    def lookup(self, keys: List[str]) -> np.ndarray:
+        """
+        Row id for each key, or -1 where the key is not cached.
+        """
+        with self._lock:
+            self._read_new_keys()
+            return np.array([self._index.get(key, -1) for key in keys], dtype=np.int64)
+
+    def add(self, keys: List[str], vectors: np.ndarray) -> None:
+        # The file lock keeps another process from truncating rows whose
+        # keys it has not seen yet.
+        with self._lock, file_lock(self.keys_path + ".lock"):
+            self._read_new_keys()
+            fresh = [(i, key) for i, key in enumerate(keys) if key not in self._index]
+            if not fresh:
+                return
+            # Vectors written without their keys (interrupted add) are discarded.
+            self.store.truncate(self._rows)
+            self.store.append(np.asarray(vectors)[[i for i, _ in fresh]])
+            with open(self.keys_path, "a", encoding="utf-8") as fh:
+                fh.write("".join(key + "\n" for _, key in fresh))
+            self._read_new_keys()
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Copy the given rows out of the memory map as float32.
+        """
+        return np.asarray(self.store.matrix()[rows], dtype=np.float32)
+
+    def get_or_encode(self, ingredients: List[str], encode_fn) -> Tuple[np.ndarray, int]:
+        """
+        Return a float32 matrix with one row per ingredient. ``encode_fn`` is
+        called once with the distinct cache misses (as cleaned keys) and must
+        return an array of their vectors. Also returns the number of misses.
+        """
+        keys = [cache_key(ing) for ing in ingredients]
+        rows = self.lookup(keys)
+        missing = list(dict.fromkeys(key for key, row in zip(keys, rows) if row < 0))
+        missed = int((rows < 0).sum())
+        self.hits += len(keys) - missed
+        self.misses += missed
+        if missing:
+            self.add(missing, encode_fn(missing))
+            rows = self.lookup(keys)
+        return self.vectors(rows), len(missing)
@@ -1,15 +1,32 @@
 import json
 import os
+import threading
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 
+import numpy as np
 import pandas as pd
 import torch
 from sentence_transformers import SentenceTransformer, util
 
+from src import vector_index
+from src.embedding_cache import IngredientEmbeddingCache
+from src.memory_snapshot import SNAPSHOT_PATH, MemorySnapshot, load_snapshot, write_snapshot
+from src.preprocessing import IngredientsInput, parse_ingredients
+from src.result_cache import file_identity
+from src.shared_memory import file_lock
+from src.vector_store import VectorStore
+
+SENTENCE_MODEL_NAME = "all-MiniLM-L6-v2"
 BASE_EMBEDDINGS_PATH = "models/ingredient_embeddings.pt"
 BASE_PRODUCT_MEMORY_PATH = "data/product_memory.csv"
 USER_MEMORY_PATH = "data/user_product_memory.jsonl"
+INGREDIENT_CACHE_DIR = "models/embedding_cache"
+
+# Below this many rows exact search is fast enough; above it "auto" uses IVF.
+ANN_MIN_ROWS = 50_000
+# Index backends that keep a quantised copy and re-rank against float32 rows.
+QUANTIZED_BACKENDS = ("float16", "int8")
 
 
 def _safe_load_torch(path: str) -> torch.Tensor:
@@ -43,8 +60,36 @@ def _safe_load_torch(path: str) -> torch.Tensor:
     return tensor.float().contiguous()
 
 
+_INGREDIENT_CACHES: Dict[str, IngredientEmbeddingCache] = {}
+_INGREDIENT_CACHES_LOCK = threading.Lock()
+
+
 def load_sentence_model() -> SentenceTransformer:
-    return SentenceTransformer("all-MiniLM-L6-v2")
+    model = SentenceTransformer(SENTENCE_MODEL_NAME)
+    # Tag the encoder so its ingredient vectors can be cached on disk.
+    model.dermalens_model_name = SENTENCE_MODEL_NAME
+    return model
+
+
+def get_ingredient_cache(model: SentenceTransformer) -> Optional[IngredientEmbeddingCache]:
+    """
+    Shared on-disk ingredient cache for this encoder. Returns None for
+    encoders without a known model name or when the cache dir is not writable.
+    """
+    name = getattr(model, "dermalens_model_name", None)
+    if not name:
+        return None
+    with _INGREDIENT_CACHES_LOCK:
+        if name not in _INGREDIENT_CACHES:
+            try:
+                _INGREDIENT_CACHES[name] = IngredientEmbeddingCache(
+                    name,
+                    model.get_sentence_embedding_dimension(),
+                    cache_dir=INGREDIENT_CACHE_DIR,
+                )
+            except OSError:
+                return None
+        return _INGREDIENT_CACHES[name]
 
 
 def embed_text(text, model: SentenceTransformer, device=None) -> torch.Tensor:
@@ -62,18 +107,63 @@ def embed_text(text, model: SentenceTransformer, device=None) -> torch.Tensor:
     return tensor
 
 
+def embed_texts(texts: List[str], model: SentenceTransformer, device=None, batch_size: int = 64) -> torch.Tensor:
+    """
+    Embed a list of texts in encoder batches and return a 2D float tensor.
+    """
+    if not texts:
+        return torch.empty((0, model.get_sentence_embedding_dimension()), dtype=torch.float32)
+    tensor = model.encode(list(texts), batch_size=batch_size, convert_to_tensor=True).float()
+    if device:
+        tensor = tensor.to(device)
+    if tensor.ndim == 1:
+        tensor = tensor.unsqueeze(0)
+    return tensor
+
+
+def encode_ingredients(ingredients: List[str], model: SentenceTransformer, device=None, batch_size: int = 64) -> torch.Tensor:
+    """
+    Embed ingredient strings through the persistent ingredient cache.
+    The encoder only runs on cache misses, in one batch.
+    """
+    cache = get_ingredient_cache(model)
+    if cache is None or not ingredients:
+        return embed_texts(ingredients, model, device=device, batch_size=batch_size)
+
+    matrix, _ = cache.get_or_encode(
+        ingredients,
+        lambda keys: embed_texts(keys, model, batch_size=batch_size).cpu().numpy(),
+    )
+    tensor = torch.from_numpy(matrix)
+    if device:
+        tensor = tensor.to(device)
+    return tensor
+
+
+def iter_base_product_memory(path: Optional[str] = None, chunk_size: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """
+    Cleaned product memory rows (product_names, ingredients), in chunks of
+    ``chunk_size`` CSV rows, or as one frame. Rows missing either column
+    are dropped. Row i of the base embeddings belongs to the i-th row
+    yielded here, so the precompute script uses this too. ``path``
+    defaults to BASE_PRODUCT_MEMORY_PATH as it is when called.
+    """
+    path = path or BASE_PRODUCT_MEMORY_PATH
+    chunks = pd.read_csv(path, chunksize=chunk_size) if chunk_size else [pd.read_csv(path)]
+    for df in chunks:
+        df = df.dropna(subset=["product_names", "ingredients"])
+        yield pd.DataFrame({
+            "product_names": df["product_names"].astype(str).str.strip(),
+            "ingredients": df["ingredients"].astype(str).str.strip(),
+        })
+
+
 def load_base_product_memory(model: SentenceTransformer) -> Tuple[List[str], List[str], torch.Tensor]:
     """
     Load the baked-in product memory CSV and embeddings file.
     Returns product_names, ingredient_lists, and embeddings tensor.
     """
-    df = (
-        pd.read_csv(BASE_PRODUCT_MEMORY_PATH)
-        .dropna(subset=["product_names", "ingredients"])
-    )
-    df["product_names"] = df["product_names"].astype(str).str.strip()
-    df["ingredients"] = df["ingredients"].astype(str).str.strip()
-
+    df = next(iter_base_product_memory())
     product_names = df["product_names"].tolist()
     ingredient_lists = df["ingredients"].tolist()
 
@@ -86,7 +176,7 @@ def load_base_product_memory(model: SentenceTransformer) -> Tuple[List[str], Lis
     if embeddings.ndim != 2 or embeddings.size(-1) != expected_dim:
         raise ValueError(
             f"Loaded embeddings have shape {tuple(embeddings.shape)}, "
-            f"expected (?, {expected_dim}). Regenerate ingredient_embeddings.pt."
+            f"expected (?, {expected_dim}). Regenerate it with: python src/ingredient_embeddings.py"
         )
 
     # Align length if mismatch
@@ -98,120 +188,512 @@ def load_base_product_memory(model: SentenceTransformer) -> Tuple[List[str], Lis
     return product_names, ingredient_lists, embeddings
 
 
-def _load_user_memory_raw() -> List[Dict]:
+def base_memory_source() -> str:
+    """
+    Identity of everything the base memory snapshot is derived from.
+    """
+    return "|".join([
+        file_identity(BASE_PRODUCT_MEMORY_PATH),
+        file_identity(BASE_EMBEDDINGS_PATH),
+        SENTENCE_MODEL_NAME,
+    ])
+
+
+def build_base_snapshot(model: SentenceTransformer) -> MemorySnapshot:
+    """
+    Base product memory plus its flat ingredient embeddings, on CPU.
+    """
+    names, ingredient_lists, embeddings = load_base_product_memory(model)
+    flat, flat_embeddings = build_flat_ingredient_embeddings(ingredient_lists, model)
+    return MemorySnapshot(
+        product_names=names,
+        ingredient_lists=ingredient_lists,
+        embeddings=embeddings,
+        flat_ingredients=flat,
+        flat_embeddings=flat_embeddings.cpu(),
+        source=base_memory_source(),
+    )
+
+
+def load_base_snapshot(model_loader: Callable[[], SentenceTransformer], path: str = SNAPSHOT_PATH) -> MemorySnapshot:
+    """
+    Memory-map the base snapshot if it matches the current sources.
+    Otherwise build it (the only case that needs the encoder, so it is
+    passed as a loader) and write it for the next process.
+    """
+    snapshot = load_snapshot(path, base_memory_source())
+    if snapshot is not None:
+        return snapshot
+    snapshot = build_base_snapshot(model_loader())
+    try:
+        write_snapshot(path, snapshot)
+    except OSError:
+        pass  # read-only deployment: still correct, just slower next time
+    return snapshot
+
+
+def user_embeddings_path() -> str:
+    """
+    Binary embedding matrix kept next to the user memory metadata file.
+    """
+    return os.path.splitext(USER_MEMORY_PATH)[0] + ".vec"
+
+
+def _user_memory_lock_path() -> str:
+    """
+    Lock file serialising writers of the user memory JSONL and its vectors
+    across processes.
+    """
+    return USER_MEMORY_PATH + ".lock"
+
+
+def _user_vector_store(dim: Optional[int] = None) -> Optional[VectorStore]:
+    """
+    Open the user embedding store, creating it when ``dim`` is given.
+    Returns None if it does not exist yet and cannot be created.
+    """
+    try:
+        return VectorStore(user_embeddings_path(), dim=dim)
+    except FileNotFoundError:
+        return None
+
+
+def _detach_embeddings(entries: List[Dict]) -> List[Dict]:
+    """
+    Move inline "embedding" lists into the binary store and return the
+    metadata entries, each pointing at its vector through a "row" id.
+    The copy of the embedding inside "analysis" is dropped as well.
+    """
+    with_vectors = [i for i, entry in enumerate(entries) if entry.get("embedding")]
+    rows: Dict[int, int] = {}
+    if with_vectors:
+        matrix = np.asarray([entries[i]["embedding"] for i in with_vectors], dtype=np.float32)
+        first_row = _user_vector_store(dim=matrix.shape[1]).append(matrix)
+        rows = {i: first_row + n for n, i in enumerate(with_vectors)}
+
+    detached = []
+    for i, entry in enumerate(entries):
+        meta = {key: value for key, value in entry.items() if key != "embedding"}
+        analysis = meta.get("analysis")
+        if isinstance(analysis, dict) and "embedding" in analysis:
+            meta["analysis"] = {key: value for key, value in analysis.items() if key != "embedding"}
+        if i in rows:
+            meta["row"] = rows[i]
+        detached.append(meta)
+    return detached
+
+
+def _rewrite_user_memory(entries: List[Dict]) -> List[Dict]:
+    """
+    Atomically replace the user memory JSONL with metadata-only entries.
+    """
+    detached = _detach_embeddings(entries)
+    tmp_path = f"{USER_MEMORY_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        fh.write("".join(json.dumps(entry) + "\n" for entry in detached))
+    os.replace(tmp_path, USER_MEMORY_PATH)
+    return detached
+
+
+def migrate_user_memory() -> int:
+    """
+    Rewrite a legacy user memory JSONL (embeddings inline as float lists)
+    into metadata JSONL + binary embedding store. Safe to call repeatedly;
+    returns the number of entries whose embeddings were moved.
+    """
+    with file_lock(_user_memory_lock_path()):
+        entries = _parse_jsonl_chunk(_read_user_memory_bytes(0))
+        legacy = sum(1 for entry in entries if "embedding" in entry)
+        if legacy:
+            _rewrite_user_memory(entries)
+    return legacy
+
+
+def user_memory_size() -> int:
+    """
+    Current size in bytes of the user memory JSONL file (0 if missing).
+    """
+    try:
+        return os.path.getsize(USER_MEMORY_PATH)
+    except OSError:
+        return 0
+
+
+def _read_user_memory_bytes(offset: int, end: Optional[int] = None) -> bytes:
     if not os.path.exists(USER_MEMORY_PATH):
-        return []
+        return b""
+    with open(USER_MEMORY_PATH, "rb") as fh:
+        fh.seek(offset)
+        return fh.read() if end is None else fh.read(max(0, end - offset))
+
+
+def _parse_jsonl_chunk(chunk: bytes) -> List[Dict]:
+    """
+    Parse the complete lines of a JSONL chunk, skipping malformed ones.
+    """
+    end = chunk.rfind(b"\n") + 1
     entries: List[Dict] = []
-    with open(USER_MEMORY_PATH, "r", encoding="utf-8") as fh:
-        for line in fh:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                entries.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
+    for line in chunk[:end].splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entries.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
     return entries
 
 
-def load_user_memory() -> Tuple[List[str], List[str], torch.Tensor, List[Dict]]:
+def read_user_memory_since(offset: int = 0, end: Optional[int] = None) -> Tuple[List[Dict], int]:
     """
-    Load user-generated product memory. Returns names, ingredients,
-    embeddings tensor, and the raw entries (for metadata like timestamp).
+    Read the complete JSONL entries appended after byte ``offset`` (up to
+    byte ``end`` if given). Returns the entries and the offset to resume
+    from. A trailing partial line (a write still in progress elsewhere) is
+    left for the next call. A full read (offset 0) of a legacy file
+    migrates it on the way.
+    """
+    chunk = _read_user_memory_bytes(offset, end)
+    end = chunk.rfind(b"\n") + 1
+    entries = _parse_jsonl_chunk(chunk)
+    if offset == 0 and any("embedding" in entry for entry in entries):
+        with file_lock(_user_memory_lock_path()):
+            entries = _parse_jsonl_chunk(_read_user_memory_bytes(0))
+            if any("embedding" in entry for entry in entries):
+                entries = _rewrite_user_memory(entries)
+            return entries, user_memory_size()
+    return entries, offset + end
+
+
+def user_memory_from_entries(entries: List[Dict]) -> Tuple[List[str], List[str], torch.Tensor]:
+    """
+    Split user memory entries into names, ingredients and an embeddings
+    tensor. A contiguous run of rows is returned as a zero-copy view over
+    the memory-mapped store; entries with inline (legacy) embeddings still work.
     """
-    entries = _load_user_memory_raw()
+    store = _user_vector_store()
     if not entries:
-        return [], [], torch.empty((0, 384), dtype=torch.float32), []
+        return [], [], torch.empty((0, store.dim if store else 384), dtype=torch.float32)
+
+    names = [entry.get("product_name", "Untitled") for entry in entries]
+    ingredients = [entry.get("ingredients", "") for entry in entries]
+    rows = [entry.get("row") for entry in entries]
+
+    matrix = store.matrix(copy_on_write=True) if store else None
+    if matrix is not None and all(isinstance(row, int) and 0 <= row < len(matrix) for row in rows):
+        start = rows[0]
+        if rows == list(range(start, start + len(rows))):
+            array = matrix[start : start + len(rows)]
+        else:
+            array = np.asarray(matrix[rows])
+        return names, ingredients, torch.from_numpy(array).float()
+
+    inline = next((entry["embedding"] for entry in entries if entry.get("embedding")), None)
+    dim = store.dim if store else len(inline) if inline else 384
+    array = np.zeros((len(entries), dim), dtype=np.float32)
+    for i, (entry, row) in enumerate(zip(entries, rows)):
+        if isinstance(row, int) and matrix is not None and 0 <= row < len(matrix):
+            array[i] = matrix[row]
+        elif entry.get("embedding"):
+            array[i] = entry["embedding"]
+    return names, ingredients, torch.from_numpy(array)
 
-    names = []
-    ingredients = []
-    embedding_rows = []
-    for entry in entries:
-        names.append(entry.get("product_name", "Untitled"))
-        ingredients.append(entry.get("ingredients", ""))
-        embedding_rows.append(entry.get("embedding", []))
 
-    tensor = torch.as_tensor(embedding_rows, dtype=torch.float32)
+def load_user_memory() -> Tuple[List[str], List[str], torch.Tensor, List[Dict]]:
+    """
+    Load user-generated product memory. Returns names, ingredients,
+    embeddings tensor (memory-mapped), and the raw entries (for metadata
+    like timestamp).
+    """
+    entries, _ = read_user_memory_since(0)
+    names, ingredients, tensor = user_memory_from_entries(entries)
     return names, ingredients, tensor, entries
 
 
 def append_user_memory(entry: Dict) -> None:
     """
-    Append a single entry to the user memory JSONL file.
+    Append a single entry to the user memory.
     """
+    append_user_memories([entry])
+
+
+def append_user_memories(entries: List[Dict]) -> None:
+    """
+    Append several entries: their embeddings go to the binary store first,
+    then the metadata lines (with row ids) to the JSONL in one write, so a
+    metadata line never points at a vector that was not written.
+    """
+    if not entries:
+        return
     Path(USER_MEMORY_PATH).parent.mkdir(parents=True, exist_ok=True)
-    with open(USER_MEMORY_PATH, "a", encoding="utf-8") as fh:
-        fh.write(json.dumps(entry))
-        fh.write("\n")
+    # Another process appending between the vector and metadata writes
+    # would pair metadata lines with the wrong row ids.
+    with file_lock(_user_memory_lock_path()):
+        detached = _detach_embeddings(entries)
+        with open(USER_MEMORY_PATH, "a", encoding="utf-8") as fh:
+            fh.write("".join(json.dumps(entry) + "\n" for entry in detached))
 
 
-def build_flat_ingredient_embeddings(ingredient_lists: List[str], model: SentenceTransformer, device=None) -> Tuple[List[str], torch.Tensor]:
+def new_flat_ingredients(ingredient_lists: List[str], seen: Set[str]) -> List[str]:
     """
-    Flatten ingredient lists into unique ingredient strings and build embeddings.
+    Return the ingredient strings in ``ingredient_lists`` that are not yet in
+    ``seen``, in first-seen order. ``seen`` is updated in place.
     """
     flat: List[str] = []
-    seen = set()
     for ing_list in ingredient_lists:
         parts = [p.strip() for p in str(ing_list).split(",") if p.strip()]
         for part in parts:
             if part not in seen:
                 seen.add(part)
                 flat.append(part)
+    return flat
+
+
+def build_flat_ingredient_embeddings(ingredient_lists: List[str], model: SentenceTransformer, device=None) -> Tuple[List[str], torch.Tensor]:
+    """
+    Flatten ingredient lists into unique ingredient strings and build embeddings.
+    """
+    flat = new_flat_ingredients(ingredient_lists, set())
 
     if not flat:
         return flat, torch.empty((0, model.get_sentence_embedding_dimension()), dtype=torch.float32)
 
-    tensor = model.encode(flat, convert_to_tensor=True).float()
-    if device:
-        tensor = tensor.to(device)
-    return flat, tensor
+    return flat, encode_ingredients(flat, model, device=device)
 
 
-def most_similar_ingredients(query_text: str, flat_ingredients: List[str], flat_embeddings: torch.Tensor, model: SentenceTransformer, top_k: int = 1) -> Dict[str, Dict[str, float]]:
+class EmbeddingBuffer:
+    """
+    Append-only 2D tensor with spare capacity. Appending writes into the
+    free rows (doubling the allocation when full) instead of re-concatenating
+    the whole matrix, so adding one row costs O(1) amortised.
+    """
+
+    def __init__(self, initial: torch.Tensor):
+        self._data = initial.float().contiguous()
+        self._size = initial.size(0) if initial.ndim == 2 else 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def view(self) -> torch.Tensor:
+        return self._data[: self._size]
+
+    def append(self, rows: torch.Tensor) -> torch.Tensor:
+        """
+        Append rows and return a view over all filled rows.
+        """
+        if rows.ndim == 1:
+            rows = rows.unsqueeze(0)
+        if rows.numel() == 0:
+            return self.view
+        if self._size == 0 and (self._data.ndim != 2 or self._data.size(1) != rows.size(1)):
+            self._data = torch.empty((0, rows.size(1)), dtype=torch.float32, device=rows.device)
+
+        needed = self._size + rows.size(0)
+        if needed > self._data.size(0):
+            capacity = max(needed, 2 * self._data.size(0), 64)
+            grown = torch.empty((capacity, self._data.size(1)), dtype=self._data.dtype, device=self._data.device)
+            grown[: self._size] = self._data[: self._size]
+            self._data = grown
+        self._data[self._size : needed] = rows.to(device=self._data.device, dtype=self._data.dtype)
+        self._size = needed
+        return self.view
+
+
+class MappedRows:
+    """
+    Float32 embedding rows kept as a list of segments (memory maps of the
+    snapshot, the user store or the shared matrices, plus small in-memory
+    tails) instead of one concatenated tensor. Used with the quantised
+    backends: searches score the index codes and gather only candidate rows
+    from here, so the float32 matrix is never copied into RAM. Appending has
+    the EmbeddingBuffer interface.
+    """
+
+    ndim = 2
+    device = None
+
+    def __init__(self, segments=(), dim: Optional[int] = None):
+        self.segments: List[np.ndarray] = []
+        self._starts = [0]
+        self.dim = dim
+        for segment in segments:
+            self.append(segment)
+
+    def __len__(self) -> int:
+        return self._starts[-1]
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self), self.dim or 0
+
+    def append(self, rows) -> "MappedRows":
+        """
+        Add rows (tensor or array, kept by reference) and return self.
+        """
+        array = as_numpy(rows)
+        if array.ndim == 1:
+            array = array.reshape(1, -1)
+        if array.shape[1]:
+            self.dim = array.shape[1]
+        if len(array):
+            self.segments.append(array)
+            self._starts.append(self._starts[-1] + len(array))
+        return self
+
+    def __getitem__(self, ids) -> np.ndarray:
+        """
+        Gather rows by an id array (or a slice) into a float32 array.
+        """
+        if isinstance(ids, slice):
+            ids = np.arange(*ids.indices(len(self)))
+        ids = np.asarray(ids, dtype=np.int64)
+        out = np.empty((len(ids), self.dim or 0), dtype=np.float32)
+        owner = np.searchsorted(self._starts, ids, side="right") - 1
+        for segment in np.unique(owner):
+            mask = owner == segment
+            out[mask] = self.segments[segment][ids[mask] - self._starts[segment]]
+        return out
+
+
+def as_numpy(matrix) -> np.ndarray:
+    """
+    NumPy view of an embeddings tensor or array. A MappedRows is
+    concatenated, so only use that for one-off exports.
+    """
+    if isinstance(matrix, MappedRows):
+        if not matrix.segments:
+            return np.empty((0, matrix.dim or 0), dtype=np.float32)
+        return np.concatenate(matrix.segments, axis=0).astype(np.float32, copy=False)
+    if isinstance(matrix, torch.Tensor):
+        return matrix.detach().cpu().numpy()
+    return np.asarray(matrix)
+
+
+def row_buffer(matrix):
+    """
+    Appendable holder for an embeddings matrix: MappedRows appends in place,
+    tensors go into an EmbeddingBuffer.
+    """
+    return matrix if isinstance(matrix, MappedRows) else EmbeddingBuffer(matrix)
+
+
+def build_vector_index(embeddings: torch.Tensor, backend: str = "auto", **kwargs) -> Optional[vector_index.ExactIndex]:
+    """
+    Build a search index over an embeddings matrix. "auto" keeps exact
+    brute force (returns None) below ANN_MIN_ROWS rows and uses IVF above it.
+    "float16" / "int8" keep a quantised copy for scoring; searches re-rank
+    its top candidates against ``embeddings`` (see _top_matches).
+    ``embeddings`` may be a tensor or a MappedRows.
+    """
+    rows = len(embeddings) if embeddings.ndim == 2 else 0
+    if backend == "auto":
+        if rows < ANN_MIN_ROWS:
+            return None
+        backend = "ivf"
+    dim = embeddings.shape[1] if embeddings.ndim == 2 else 0
+    index = vector_index.build_index(np.empty((0, dim), dtype=np.float32), backend=backend, **kwargs)
+    if rows:
+        for segment in embeddings.segments if isinstance(embeddings, MappedRows) else [as_numpy(embeddings)]:
+            index.add(segment)
+    return index
+
+
+def _top_matches(queries: torch.Tensor, embeddings: torch.Tensor, top_k: int, index=None) -> Tuple[List[List[float]], List[List[int]]]:
+    """
+    Row-wise top-k (scores, row ids) of queries against embeddings. Uses the
+    index when it covers every row, otherwise exact cosine similarity.
+    """
+    if queries.ndim == 1:
+        queries = queries.unsqueeze(0)
+    rows = len(embeddings) if embeddings.ndim == 2 else 0
+    top_k_eff = min(top_k, rows)
+    if top_k_eff <= 0:
+        return [[] for _ in range(queries.size(0))], [[] for _ in range(queries.size(0))]
+
+    if index is not None and len(index) == rows:
+        if isinstance(index, vector_index.QuantizedIndex):
+            # Re-rank in float32 against the (usually memory-mapped) rows.
+            source = embeddings if isinstance(embeddings, MappedRows) else as_numpy(embeddings)
+            scores, ids = index.search(queries.detach().cpu().numpy(), top_k_eff, source=source)
+        else:
+            scores, ids = index.search(queries.detach().cpu().numpy(), top_k_eff)
+        keep = ids >= 0
+        return (
+            [row[mask].tolist() for row, mask in zip(scores, keep)],
+            [row[mask].tolist() for row, mask in zip(ids, keep)],
+        )
+
+    if isinstance(embeddings, MappedRows):
+        embeddings = torch.from_numpy(as_numpy(embeddings))  # only when the index is out of step
+    sims = util.cos_sim(queries, embeddings)
+    top_scores, top_idx = torch.topk(sims, k=top_k_eff, dim=1)
+    return top_scores.cpu().tolist(), top_idx.cpu().tolist()
+
+
+def most_similar_ingredients(query_text: IngredientsInput, flat_ingredients: List[str], flat_embeddings: torch.Tensor, model: SentenceTransformer, top_k: int = 1, index=None) -> Dict[str, Dict[str, object]]:
     """
     For each ingredient in query_text, find the closest known ingredient.
+    query_text is split with parse_ingredients (the same tokenisation the
+    safety score uses) and may already be a ParsedIngredients. All query
+    ingredients are encoded in one call and scored with a single (Q x N)
+    similarity matrix. With top_k > 1 each entry also carries a ranked
+    "matches" list.
     """
-    user_ingredients = [p.strip() for p in str(query_text).split(",") if p.strip()]
+    return most_similar_ingredients_batch([query_text], flat_ingredients, flat_embeddings, model, top_k=top_k, index=index)[0]
 
-    if not user_ingredients or flat_embeddings.numel() == 0:
-        return {}
 
-    results: Dict[str, Dict[str, float]] = {}
-    for ing in user_ingredients:
-        ing_embedding = embed_text(ing, model, device=flat_embeddings.device)
-        sims = util.cos_sim(ing_embedding.unsqueeze(0), flat_embeddings)[0]
-        top_k_eff = min(top_k, sims.numel())
-        if top_k_eff == 0:
+def most_similar_ingredients_batch(query_texts: List[IngredientsInput], flat_ingredients: List[str], flat_embeddings: torch.Tensor, model: SentenceTransformer, top_k: int = 1, batch_size: int = 256, index=None) -> List[Dict[str, Dict[str, object]]]:
+    """
+    Batched most_similar_ingredients: every distinct ingredient across all
+    query texts is encoded once and scored with a single similarity matrix.
+    """
+    per_text = [parse_ingredients(text).ingredients for text in query_texts]
+    distinct = list(dict.fromkeys(ing for parts in per_text for ing in parts))
+    if top_k <= 0 or len(flat_embeddings) == 0 or not distinct:
+        return [{} for _ in per_text]
+
+    device = getattr(flat_embeddings, "device", None)
+    query_embeddings = encode_ingredients(distinct, model, device=device, batch_size=batch_size)
+    top_scores, top_idx = _top_matches(query_embeddings, flat_embeddings, top_k, index=index)
+
+    best: Dict[str, Dict[str, object]] = {}
+    for row, ing in enumerate(distinct):
+        if not top_idx[row]:
             continue
-        top_scores, top_idx = torch.topk(sims, k=top_k_eff)
-        results[ing] = {
-            "closest_ingredient": flat_ingredients[int(top_idx[0])],
-            "score": float(top_scores[0]),
+        best[ing] = {
+            "closest_ingredient": flat_ingredients[top_idx[row][0]],
+            "score": float(top_scores[row][0]),
         }
-    return results
+        if top_k > 1:
+            best[ing]["matches"] = [
+                {"ingredient": flat_ingredients[i], "score": float(score)}
+                for i, score in zip(top_idx[row], top_scores[row])
+            ]
+    return [{ing: dict(best[ing]) for ing in parts if ing in best} for parts in per_text]
 
 
-def find_similar_products(query_embedding: torch.Tensor, names: List[str], ingredient_lists: List[str], embeddings: torch.Tensor, top_k: int = 5) -> List[Dict[str, object]]:
+def find_similar_products(query_embedding: torch.Tensor, names: List[str], ingredient_lists: List[str], embeddings: torch.Tensor, top_k: int = 5, index=None) -> List[Dict[str, object]]:
     """
     Find nearest products for a given embedding.
+    Exact brute force unless an index covering all rows is passed.
     """
-    if embeddings.numel() == 0:
-        return []
+    return find_similar_products_batch(query_embedding, names, ingredient_lists, embeddings, top_k=top_k, index=index)[0]
 
-    query_tensor = query_embedding
-    if query_tensor.ndim == 1:
-        query_tensor = query_tensor.unsqueeze(0)
-    sims = util.cos_sim(query_tensor, embeddings)[0]
-    top_k_eff = min(top_k, sims.numel())
-    if top_k_eff == 0:
-        return []
-    top_scores, top_idx = torch.topk(sims, k=top_k_eff)
 
+def find_similar_products_batch(query_embeddings: torch.Tensor, names: List[str], ingredient_lists: List[str], embeddings: torch.Tensor, top_k: int = 5, index=None) -> List[List[Dict[str, object]]]:
+    """
+    Find nearest products for a (Q, d) batch of embeddings with one matrix top-k.
+    """
+    top_scores, top_idx = _top_matches(query_embeddings, embeddings, top_k, index=index)
     return [
-        {
-            "product_name": names[int(i)],
-            "ingredients": ingredient_lists[int(i)],
-            "score": float(top_scores[j]),
-        }
-        for j, i in enumerate(top_idx)
+        [
+            {
+                "product_name": names[i],
+                "ingredients": ingredient_lists[i],
+                "score": float(score),
+            }
+            for i, score in zip(row_idx, row_scores)
+        ]
+        for row_idx, row_scores in zip(top_idx, top_scores)
     ]
@@ -0,0 +1,186 @@
+"""
+Per-prediction explanations for Expert Mode.
+
+Two explainers produce the same (feature, weight) list and bar chart:
+
+- "linear": exact contributions for the TF-IDF + LogisticRegression
+  pipeline. A document's score for a class is sum(x_j * coef[class, j]), so
+  each n-gram's contribution is read straight off the compiled scorer.
+  Costs one vectorisation, no sampling.
+- "lime": LimeTextExplainer sampling, kept as an opt-in for models the
+  compiled scorer does not cover. Cost grows with ``num_samples``.
+
+Explanations (including the rendered PNG) are memoised per text, model
+identity, mode and feature count, so Streamlit reruns reuse them.
+"""
+from __future__ import annotations
+
+import io
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.compiled_model import CompiledTfidfModel
+from src.preprocessing import join_ingredients_for_model
+
+try:
+    from lime.lime_text import LimeTextExplainer  # type: ignore
+except ImportError:  # pragma: no cover
+    LimeTextExplainer = None
+
+EXPLAINER_MODES = ("linear", "lime")
+DEFAULT_LIME_SAMPLES = 5000
+
+
+@dataclass(frozen=True)
+class Explanation:
+    label: str
+    label_index: int
+    features: Tuple[Tuple[str, float], ...]
+    image: Optional[bytes] = None
+    mode: str = "linear"
+
+
+class ExplanationCache:
+    """
+    Small thread-safe LRU of finished explanations.
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Explanation]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Explanation]) -> Explanation:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        explanation = compute()
+        with self._lock:
+            self._entries[key] = explanation
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return explanation
+
+
+EXPLANATION_CACHE = ExplanationCache()
+
+
+def render_explanation_png(features: Sequence[Tuple[str, float]], label: str) -> Optional[bytes]:
+    """
+    Horizontal bar chart in LIME's style (positive weights green, negative
+    red). Uses a bare Figure so no pyplot state is shared between threads.
+    """
+    try:
+        from matplotlib.figure import Figure
+    except ImportError:  # pragma: no cover
+        return None
+
+    ordered = list(features)[::-1]
+    fig = Figure(figsize=(6, 0.4 * max(len(ordered), 1) + 1))
+    ax = fig.subplots()
+    weights = [weight for _, weight in ordered]
+    ax.barh(
+        range(len(ordered)),
+        weights,
+        color=["green" if weight > 0 else "red" for weight in weights],
+        align="center",
+    )
+    ax.set_yticks(range(len(ordered)))
+    ax.set_yticklabels([name for name, _ in ordered])
+    ax.set_title(f"Local explanation for class {label}")
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    return buf.getvalue()
+
+
+def linear_explanation(
+    scorer: CompiledTfidfModel,
+    text: str,
+    num_features: int = 8,
+    label_index: Optional[int] = None,
+) -> Explanation:
+    """
+    Exact per-n-gram contributions to the predicted (or given) class score.
+    """
+    clean_text = join_ingredients_for_model(text)
+    idx, values = scorer.features(clean_text)
+    if label_index is None:
+        label_index = int(np.argmax(scorer.predict_proba([clean_text])[0]))
+    contributions = values * scorer.coef_t[idx, label_index]
+    order = np.argsort(-np.abs(contributions), kind="stable")[:num_features]
+    terms = scorer.terms
+    features = tuple((terms[idx[i]], float(contributions[i])) for i in order)
+    return Explanation(label=str(scorer.classes_[label_index]), label_index=label_index, features=features, mode="linear")
+
+
+def lime_explanation(model, text: str, num_features: int = 8, num_samples: int = DEFAULT_LIME_SAMPLES) -> Explanation:
+    """
+    LIME sampling explanation of the top predicted class.
+    """
+    if LimeTextExplainer is None:
+        raise RuntimeError("lime is not installed; use the linear explainer instead.")
+    classes = list(model.classes_)
+    explainer = LimeTextExplainer(class_names=classes)
+
+    def predict_proba_lime(text_list: List[str]):
+        return model.predict_proba([join_ingredients_for_model(t) for t in text_list])
+
+    exp = explainer.explain_instance(
+        text,
+        predict_proba_lime,
+        num_features=num_features,
+        top_labels=1,
+        num_samples=num_samples,
+    )
+    top_idx = int(exp.top_labels[0])
+    features = tuple((str(name), float(weight)) for name, weight in exp.as_list(label=top_idx))
+    return Explanation(label=str(classes[top_idx]), label_index=top_idx, features=features, mode="lime")
+
+
+def explain_prediction(
+    text: str,
+    model,
+    scorer: Optional[CompiledTfidfModel] = None,
+    model_identity: str = "",
+    mode: str = "linear",
+    num_features: int = 8,
+    num_samples: int = DEFAULT_LIME_SAMPLES,
+    cache: Optional[ExplanationCache] = EXPLANATION_CACHE,
+) -> Explanation:
+    """
+    Memoised explanation with its PNG. "linear" needs a compiled scorer and
+    falls back to LIME when none is available.
+    """
+    if mode not in EXPLAINER_MODES:
+        raise ValueError(f"Unknown explainer mode {mode!r}; expected one of {EXPLAINER_MODES}.")
+    if mode == "linear" and scorer is None:
+        mode = "lime"
+
+    def compute() -> Explanation:
+        if mode == "linear":
+            explanation = linear_explanation(scorer, text, num_features=num_features)
+        else:
+            explanation = lime_explanation(model, text, num_features=num_features, num_samples=num_samples)
+        image = render_explanation_png(explanation.features, explanation.label)
+        return Explanation(explanation.label, explanation.label_index, explanation.features, image, explanation.mode)
+
+    if cache is None:
+        return compute()
+    if mode == "linear":
+        key = (mode, join_ingredients_for_model(text), model_identity, num_features)
+    else:
+        key = (mode, text, model_identity, num_features, num_samples)
+    return cache.get_or_compute(key, compute)
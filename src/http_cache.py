@@ -0,0 +1,258 @@
+"""
+Persistent HTTP response cache shared by the scraping modules.
+
+Responses are stored in a SQLite file keyed by URL, so they survive
+restarts and are shared by every worker process on the machine. Each
+source (DuckDuckGo search, barcode search, store pages) has its own TTL.
+Expired entries are revalidated with If-None-Match / If-Modified-Since
+when the server sent validators, and served stale if the upstream fails.
+A small in-process LRU sits in front of SQLite; the database is capped by
+total body size and evicts least recently used rows. Hits served from the
+LRU refresh the row's access time in batches, so hot URLs are not evicted.
+"""
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CACHE_PATH = "models/http_cache.sqlite"
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+}
+REQUEST_TIMEOUT = 8
+
+# Seconds a response is served without contacting upstream, per source.
+SOURCE_TTLS = {
+    "ingredient_search": 24 * 3600,
+    "barcode_search": 7 * 24 * 3600,
+    "store": 30 * 60,
+}
+DEFAULT_TTL = 3600
+# Same-URL fetches are serialised by one of a fixed set of locks.
+URL_LOCK_STRIPES = 64
+# Memory-tier hits written back to accessed_at in one statement.
+TOUCH_BATCH = 32
+
+_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Process-wide session with a keep-alive connection pool.
+    """
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _SESSION = session
+        return _SESSION
+
+
+@dataclass
+class CachedResponse:
+    url: str
+    text: str
+    etag: str = ""
+    last_modified: str = ""
+    fetched_at: float = 0.0
+
+
+class HttpResponseCache:
+    """
+    URL -> response text cache with an in-memory LRU over a SQLite store.
+    Concurrent fetches of the same URL in one process share one request.
+    """
+
+    def __init__(
+        self,
+        path: str = CACHE_PATH,
+        max_disk_bytes: int = 64 * 1024 * 1024,
+        max_memory_entries: int = 256,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_entries = max_memory_entries
+        self._clock = clock
+        self._memory: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._url_locks = [threading.Lock() for _ in range(URL_LOCK_STRIPES)]
+        self._touched: Dict[str, float] = {}
+        self.counters: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "url TEXT PRIMARY KEY, text TEXT NOT NULL, etag TEXT, last_modified TEXT, "
+                "fetched_at REAL NOT NULL, accessed_at REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+            self._db.commit()
+
+    def _remember(self, entry: CachedResponse) -> None:
+        self._memory[entry.url] = entry
+        self._memory.move_to_end(entry.url)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _url_lock(self, url: str) -> threading.Lock:
+        return self._url_locks[hash(url) % len(self._url_locks)]
+
+    def _count(self, source: str, name: str) -> None:
+        with self._lock:
+            self.counters[source][name] += 1
+
+    def _flush_touched(self) -> None:
+        """
+        Write pending memory-tier access times to SQLite. Callers hold _lock.
+        """
+        if not self._touched:
+            return
+        self._db.executemany(
+            "UPDATE responses SET accessed_at = ? WHERE url = ?",
+            [(accessed_at, url) for url, accessed_at in self._touched.items()],
+        )
+        self._touched.clear()
+
+    def _lookup(self, url: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._memory.get(url)
+            if entry is not None:
+                self._memory.move_to_end(url)
+                self._touched[url] = self._clock()
+                if len(self._touched) >= TOUCH_BATCH:
+                    self._flush_touched()
+                    self._db.commit()
+                return entry
+            row = self._db.execute(
+                "SELECT text, etag, last_modified, fetched_at FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE url = ?", (self._clock(), url))
+            self._db.commit()
+            entry = CachedResponse(url, row[0], row[1] or "", row[2] or "", row[3])
+            self._remember(entry)
+            return entry
+
+    def _store(self, entry: CachedResponse) -> None:
+        size = len(entry.text.encode("utf-8"))
+        with self._lock:
+            self._remember(entry)
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (url, text, etag, last_modified, fetched_at, accessed_at, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (entry.url, entry.text, entry.etag, entry.last_modified, entry.fetched_at, self._clock(), size),
+            )
+            self._touched.pop(entry.url, None)
+            self._flush_touched()  # eviction must see recent memory hits
+            self._evict()
+            self._db.commit()
+
+    def _evict(self) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        for url, size in self._db.execute("SELECT url, size FROM responses ORDER BY accessed_at").fetchall():
+            if total <= self.max_disk_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self._memory.pop(url, None)
+            total -= size
+
+    def get_text(
+        self,
+        url: str,
+        source: str = "default",
+        ttl: Optional[float] = None,
+        session: Optional[requests.Session] = None,
+        timeout: float = REQUEST_TIMEOUT,
+    ) -> str:
+        """
+        Response body for ``url``. Fresh cache entries are returned without
+        a request; stale ones are revalidated. Raises requests exceptions
+        only when upstream fails and nothing is cached.
+        """
+        ttl = SOURCE_TTLS.get(source, DEFAULT_TTL) if ttl is None else ttl
+        with self._url_lock(url):
+            cached = self._lookup(url)
+            if cached is not None and self._clock() - cached.fetched_at < ttl:
+                self._count(source, "hits")
+                return cached.text
+
+            headers = {}
+            if cached is not None and cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached is not None and cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+            try:
+                response = (session or get_session()).get(url, headers=headers, timeout=timeout)
+                if response.status_code == 304 and cached is not None:
+                    self._count(source, "revalidated")
+                    cached.fetched_at = self._clock()
+                    self._store(cached)
+                    return cached.text
+                response.raise_for_status()
+            except requests.RequestException:
+                if cached is None:
+                    self._count(source, "errors")
+                    raise
+                self._count(source, "stale")
+                return cached.text
+
+            self._count(source, "misses")
+            entry = CachedResponse(
+                url,
+                response.text,
+                etag=response.headers.get("ETag", ""),
+                last_modified=response.headers.get("Last-Modified", ""),
+                fetched_at=self._clock(),
+            )
+            self._store(entry)
+            return entry.text
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {source: dict(values) for source, values in self.counters.items()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._touched.clear()
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+
+_CACHE: Optional[HttpResponseCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache() -> HttpResponseCache:
+    """
+    Process-wide response cache, opened on first use.
+    """
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = HttpResponseCache(CACHE_PATH)
+        return _CACHE
+
+
+def cached_get_text(url: str, source: str, ttl: Optional[float] = None) -> str:
+    return get_cache().get_text(url, source=source, ttl=ttl)
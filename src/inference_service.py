@@ -0,0 +1,437 @@
+"""
+Headless JSON API around AnalysisEngine, for clients that cannot go through
+Streamlit (e.g. the mobile app).
+
+    POST /analyze              {"ingredients": "...", "product_name": "...", "store": false}
+    POST /similar-products     {"ingredients": "...", "top_k": 5}
+    POST /ingredient-insights  {"ingredients": "...", "top_k": 1}
+    GET  /metrics              request latency, batch sizes, queue depths
+    GET  /health
+
+Each POST endpoint has a MicroBatcher. It collects concurrent requests for
+up to a few milliseconds and runs them as one batched engine call (one
+TF-IDF pass, one encoder pass, one matrix top-k). Queues are bounded. When
+one is full the request is rejected straight away with 503 and Retry-After,
+rather than piling up latency.
+
+    python -m src.inference_service --port 8080 --max-batch 32 --max-wait-ms 5
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+MAX_BODY_BYTES = 256 * 1024
+MAX_TOP_K = 50
+REQUEST_TIMEOUT = 30.0
+RETRY_AFTER_SECONDS = 1
+
+
+class Overloaded(Exception):
+    """
+    Raised by MicroBatcher.submit when its queue is full.
+    """
+
+
+def _percentile(values: Sequence[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return float(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))])
+
+
+class ServiceMetrics:
+    """
+    Thread-safe counters plus a sliding window of recent latencies and batch
+    sizes per endpoint, summarised by snapshot().
+    """
+
+    def __init__(self, window: int = 2048):
+        self._lock = threading.Lock()
+        self.requests: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.rejected: Counter = Counter()
+        self.batches: Counter = Counter()
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._batch_sizes = defaultdict(lambda: deque(maxlen=window))
+        self._batch_seconds = defaultdict(lambda: deque(maxlen=window))
+
+    def observe_request(self, endpoint: str, seconds: float, status: int) -> None:
+        with self._lock:
+            self.requests[endpoint] += 1
+            if status == 503:
+                self.rejected[endpoint] += 1
+            elif status >= 400:
+                self.errors[endpoint] += 1
+            self._latencies[endpoint].append(seconds)
+
+    def observe_batch(self, name: str, size: int, seconds: float) -> None:
+        with self._lock:
+            self.batches[name] += 1
+            self._batch_sizes[name].append(size)
+            self._batch_seconds[name].append(seconds)
+
+    def snapshot(self, queue_depths: Optional[Dict[str, int]] = None) -> Dict[str, Dict]:
+        with self._lock:
+            endpoints = {}
+            for endpoint in sorted(set(self.requests) | set(self.batches)):
+                latencies = list(self._latencies[endpoint])
+                sizes = list(self._batch_sizes[endpoint])
+                batch_seconds = list(self._batch_seconds[endpoint])
+                endpoints[endpoint] = {
+                    "requests": self.requests[endpoint],
+                    "errors": self.errors[endpoint],
+                    "rejected": self.rejected[endpoint],
+                    "latency_ms": {
+                        "mean": 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+                        "p50": 1000 * _percentile(latencies, 0.50),
+                        "p95": 1000 * _percentile(latencies, 0.95),
+                        "p99": 1000 * _percentile(latencies, 0.99),
+                    },
+                    "batches": self.batches[endpoint],
+                    "batch_size": {
+                        "mean": sum(sizes) / len(sizes) if sizes else 0.0,
+                        "p50": _percentile(sizes, 0.50),
+                        "max": max(sizes) if sizes else 0,
+                    },
+                    "batch_ms_p50": 1000 * _percentile(batch_seconds, 0.50),
+                    "queue_depth": (queue_depths or {}).get(endpoint, 0),
+                }
+            return {"endpoints": endpoints}
+
+
+class MicroBatcher:
+    """
+    Collects items from concurrent callers and runs them through
+    ``run_batch`` together. A batch closes when it reaches
+    ``max_batch_size`` or ``max_wait`` seconds after its first item arrived,
+    so an idle service adds at most ``max_wait`` to a lone request.
+    ``run_batch`` gets a list of items and must return one result per item.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List], List],
+        max_batch_size: int = 32,
+        max_wait: float = 0.005,
+        max_queue: int = 256,
+        name: str = "batch",
+        metrics: Optional[ServiceMetrics] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self.metrics = metrics
+        self._clock = clock
+        self._queue: "queue.Queue[Tuple[object, Future]]" = queue.Queue(maxsize=max_queue)
+        self._closed = threading.Event()
+        # Orders submit() against close(), so nothing is queued after the drain.
+        self._submit_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, item) -> Future:
+        """
+        Queue ``item`` and return a Future for its result. Raises Overloaded
+        instead of blocking when the queue is full.
+        """
+        future: Future = Future()
+        with self._submit_lock:
+            if self._closed.is_set():
+                raise Overloaded(f"{self.name} batcher is shut down.")
+            try:
+                self._queue.put_nowait((item, future))
+            except queue.Full:
+                raise Overloaded(f"{self.name} queue is full ({self._queue.maxsize} pending).") from None
+        return future
+
+    def close(self) -> None:
+        """
+        Stop the worker and fail every request still queued with Overloaded,
+        so no caller waits on a future that will never resolve.
+        """
+        with self._submit_lock:
+            self._closed.set()
+        self._thread.join(timeout=1)
+        while True:
+            try:
+                _, future = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if future.set_running_or_notify_cancel():
+                future.set_exception(Overloaded(f"{self.name} batcher is shut down."))
+
+    def _collect(self) -> List[Tuple[object, Future]]:
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = self._clock() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - self._clock()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while not self._closed.is_set():
+            # Callers that already timed out cancelled their futures; skip them.
+            live = [(item, future) for item, future in self._collect() if future.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            started = self._clock()
+            try:
+                results = self.run_batch([item for item, _ in live])
+                if len(results) != len(live):
+                    raise RuntimeError(f"{self.name} batch returned {len(results)} results for {len(live)} items.")
+            except Exception as exc:
+                for _, future in live:
+                    future.set_exception(exc)
+                continue
+            for (_, future), result in zip(live, results):
+                future.set_result(result)
+            if self.metrics is not None:
+                self.metrics.observe_batch(self.name, len(live), self._clock() - started)
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _grouped(items: List[Dict], key: Callable[[Dict], object], run: Callable[[object, List[Dict]], List]) -> List:
+    """
+    Run ``run(key, items)`` once per distinct key (e.g. top_k) and put the
+    results back in item order.
+    """
+    groups: Dict[object, List[int]] = defaultdict(list)
+    for i, item in enumerate(items):
+        groups[key(item)].append(i)
+    results: List = [None] * len(items)
+    for group_key, indices in groups.items():
+        for i, result in zip(indices, run(group_key, [items[i] for i in indices])):
+            results[i] = result
+    return results
+
+
+def _parse_request(payload, default_top_k: int) -> Dict:
+    if not isinstance(payload, dict):
+        raise BadRequest("Request body must be a JSON object.")
+    ingredients = payload.get("ingredients")
+    if not isinstance(ingredients, str) or not ingredients.strip():
+        raise BadRequest("'ingredients' must be a non-empty string.")
+    product_name = payload.get("product_name")
+    if product_name is not None and not isinstance(product_name, str):
+        raise BadRequest("'product_name' must be a string.")
+    top_k = payload.get("top_k", default_top_k)
+    if not isinstance(top_k, int) or isinstance(top_k, bool) or not 1 <= top_k <= MAX_TOP_K:
+        raise BadRequest(f"'top_k' must be an integer between 1 and {MAX_TOP_K}.")
+    return {
+        "ingredients": ingredients,
+        "product_name": product_name,
+        "top_k": top_k,
+        "store": bool(payload.get("store", False)),
+        "include_embedding": bool(payload.get("include_embedding", False)),
+    }
+
+
+class InferenceService:
+    """
+    Routes requests to per-endpoint batchers over one engine. Engine calls
+    are serialised; each one is already a batched pass.
+    """
+
+    def __init__(
+        self,
+        engine,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        max_queue: int = 256,
+        request_timeout: float = REQUEST_TIMEOUT,
+    ):
+        self.engine = engine
+        self.request_timeout = request_timeout
+        self.metrics = ServiceMetrics()
+        self._engine_lock = threading.Lock()
+        options = dict(max_batch_size=max_batch_size, max_wait=max_wait_ms / 1000.0, max_queue=max_queue, metrics=self.metrics)
+        self.routes: Dict[str, Tuple[MicroBatcher, int]] = {
+            "/analyze": (MicroBatcher(self._run_analyze, name="/analyze", **options), 5),
+            "/similar-products": (MicroBatcher(self._run_similar, name="/similar-products", **options), 5),
+            "/ingredient-insights": (MicroBatcher(self._run_insights, name="/ingredient-insights", **options), 1),
+        }
+
+    def _run_analyze(self, items: List[Dict]) -> List[Dict]:
+        def run(store, group):
+            with self._engine_lock:
+                results = self.engine.analyze_many(
+                    [item["ingredients"] for item in group],
+                    names=[item["product_name"] for item in group],
+                    skip_store=not store,
+                )
+            return [
+                result if item["include_embedding"] else {k: v for k, v in result.items() if k != "embedding"}
+                for item, result in zip(group, results)
+            ]
+
+        return _grouped(items, lambda item: item["store"], run)
+
+    def _run_similar(self, items: List[Dict]) -> List[Dict]:
+        def run(top_k, group):
+            with self._engine_lock:
+                matches = self.engine.similar_products_many([item["ingredients"] for item in group], top_k=top_k)
+            return [{"similar_products": found} for found in matches]
+
+        return _grouped(items, lambda item: item["top_k"], run)
+
+    def _run_insights(self, items: List[Dict]) -> List[Dict]:
+        def run(top_k, group):
+            with self._engine_lock:
+                return self.engine.ingredient_insights_many([item["ingredients"] for item in group], top_k=top_k)
+
+        return _grouped(items, lambda item: item["top_k"], run)
+
+    def handle(self, method: str, path: str, payload=None) -> Tuple[int, Dict, Dict[str, str]]:
+        """
+        Returns (status, JSON body, extra headers). Records latency per path.
+        """
+        started = time.perf_counter()
+        status, body, headers = self._dispatch(method, path, payload)
+        if path in self.routes:
+            self.metrics.observe_request(path, time.perf_counter() - started, status)
+        return status, body, headers
+
+    def _dispatch(self, method: str, path: str, payload) -> Tuple[int, Dict, Dict[str, str]]:
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}, {}
+        if method == "GET" and path == "/metrics":
+            depths = {route: batcher.depth() for route, (batcher, _) in self.routes.items()}
+            return 200, self.metrics.snapshot(depths), {}
+        if path not in self.routes:
+            return 404, {"error": f"Unknown endpoint {path}."}, {}
+        if method != "POST":
+            return 405, {"error": "Use POST."}, {"Allow": "POST"}
+
+        batcher, default_top_k = self.routes[path]
+        try:
+            future = batcher.submit(_parse_request(payload, default_top_k))
+        except BadRequest as exc:
+            return 400, {"error": str(exc)}, {}
+        except Overloaded as exc:
+            return 503, {"error": str(exc)}, {"Retry-After": str(RETRY_AFTER_SECONDS)}
+        try:
+            return 200, future.result(timeout=self.request_timeout), {}
+        except FutureTimeout:
+            future.cancel()
+            return 504, {"error": "Timed out waiting for the engine."}, {}
+        except Exception as exc:
+            return 500, {"error": str(exc)}, {}
+
+    def close(self) -> None:
+        for batcher, _ in self.routes.values():
+            batcher.close()
+
+    def make_server(self, host: str = "127.0.0.1", port: int = 8080) -> ThreadingHTTPServer:
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive: mobile clients reuse one connection.
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status: int, body: Dict, headers: Dict[str, str]) -> None:
+                data = json.dumps(body, default=str).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._send(*service.handle("GET", self.path.split("?", 1)[0]))
+
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # The body's extent is unknown, so the connection cannot be reused.
+                    self.close_connection = True
+                    self._send(400, {"error": "Invalid Content-Length."}, {})
+                    return
+                if length > MAX_BODY_BYTES:
+                    self.close_connection = True
+                    self._send(413, {"error": f"Body larger than {MAX_BODY_BYTES} bytes."}, {})
+                    return
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"null")
+                except ValueError:
+                    self._send(400, {"error": "Body is not valid JSON."}, {})
+                    return
+                self._send(*service.handle("POST", self.path.split("?", 1)[0], payload))
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        return server
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from src.analysis_engine import AnalysisEngine
+    from src.result_cache import AnalysisResultCache
+    from src.shared_memory import SHARED_MEMORY_ENV, SharedMemory, shared_memory_enabled
+
+    parser = argparse.ArgumentParser(description="DermaLens JSON inference service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--queue", type=int, default=256, help="Pending requests per endpoint before 503s.")
+    parser.add_argument("--result-cache-dir", default="models/result_cache")
+    parser.add_argument(
+        "--shared-memory",
+        action="store_true",
+        default=shared_memory_enabled(),
+        help=f"Map the embedding matrices shared with other workers (default: ${SHARED_MEMORY_ENV}).",
+    )
+    args = parser.parse_args(argv)
+
+    engine = AnalysisEngine(
+        result_cache=AnalysisResultCache(cache_dir=args.result_cache_dir),
+        shared_memory=SharedMemory() if args.shared_memory else None,
+    )
+    engine.warm_in_background()
+    service = InferenceService(engine, max_batch_size=args.max_batch, max_wait_ms=args.max_wait_ms, max_queue=args.queue)
+    server = service.make_server(args.host, args.port)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,26 +1,214 @@
-import pandas as pd
+"""
+Precompute the base product embeddings (models/ingredient_embeddings.pt).
+
+Row i of the output is the embedding of the i-th product that
+embeddings_utils.load_base_product_memory keeps: rows missing a product
+name or ingredients are skipped the same way. A manifest next to the
+output records the model and a hash of each row's ingredient text. A
+rebuild streams the CSV in chunks and only encodes texts whose hash is not
+in the previous build; the rest are copied over.
+
+Rows are collected in a temporary VectorStore as they are produced. The
+finished .pt and manifest then replace the old ones atomically.
+
+    python src/ingredient_embeddings.py                      # incremental
+    python src/ingredient_embeddings.py --workers 4 --batch-size 128
+    python src/ingredient_embeddings.py --full               # re-encode everything
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from typing import Optional
+
+# Make it possible to import `src.*` even when run as a module
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+import numpy as np
 import torch
-from sentence_transformers import SentenceTransformer
 
-PRODUCT_MEMORY_PATH = "data/product_memory.csv"
-EMBEDDING_OUTPUT_PATH = "models/ingredient_embeddings.pt"
+from src import embeddings_utils
+from src.vector_store import VectorStore
+
+
+# --------------------------
+# PATHS + SETTINGS
+# --------------------------
+CHUNK_SIZE = 10_000
+BATCH_SIZE = 64
+
+
+def manifest_path(output: str) -> str:
+    return os.path.splitext(output)[0] + ".manifest.json"
+
+
+def text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+# --------------------------
+# PREVIOUS BUILD
+# --------------------------
+def load_previous(output: str, model_name: str, dim: int):
+    """
+    Return (row text hashes, matrix) from the last build, or ([], None) if
+    there is none or it was built with another model.
+    """
+    try:
+        with open(manifest_path(output), "r", encoding="utf-8") as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        return [], None
+    if manifest.get("model") != model_name or manifest.get("dim") != dim:
+        return [], None
+    try:
+        matrix = torch.load(output, map_location="cpu", weights_only=True, mmap=True)
+    except (OSError, RuntimeError, TypeError, ValueError):
+        return [], None
+    hashes = manifest.get("hashes", [])
+    if not isinstance(matrix, torch.Tensor) or matrix.ndim != 2 or matrix.size(0) != len(hashes) or matrix.size(1) != dim:
+        return [], None
+    return hashes, matrix.float().numpy()
+
+
+# --------------------------
+# ENCODING
+# --------------------------
+class Encoder:
+    """
+    Encode text batches in this process, or across ``workers`` processes
+    through the sentence-transformers multi-process pool.
+    """
+
+    def __init__(self, model, batch_size: int = BATCH_SIZE, workers: int = 1):
+        self.model = model
+        self.batch_size = batch_size
+        self.pool = model.start_multi_process_pool(["cpu"] * workers) if workers > 1 else None
+
+    def __call__(self, texts):
+        if self.pool is not None:
+            matrix = self.model.encode_multi_process(texts, self.pool, batch_size=self.batch_size)
+        else:
+            matrix = embeddings_utils.embed_texts(texts, self.model, batch_size=self.batch_size).cpu().numpy()
+        return np.asarray(matrix, dtype=np.float32)
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+
+# --------------------------
+# PRECOMPUTE
+# --------------------------
+def precompute(
+    csv_path: Optional[str] = None,
+    output: Optional[str] = None,
+    chunk_size: int = CHUNK_SIZE,
+    batch_size: int = BATCH_SIZE,
+    workers: int = 1,
+    full: bool = False,
+    model=None,
+    model_name: str = embeddings_utils.SENTENCE_MODEL_NAME,
+):
+    """
+    Build ``output`` from ``csv_path``. Returns counts of rows written,
+    encoded and reused. Both default to the paths embeddings_utils
+    loads from at the time of the call.
+    """
+    csv_path = csv_path or embeddings_utils.BASE_PRODUCT_MEMORY_PATH
+    output = output or embeddings_utils.BASE_EMBEDDINGS_PATH
+    model = model or embeddings_utils.load_sentence_model()
+    dim = model.get_sentence_embedding_dimension()
+    old_hashes, old_matrix = ([], None) if full else load_previous(output, model_name, dim)
+    previous = {h: row for row, h in enumerate(old_hashes)}
+    if previous:
+        print(f"♻️ Previous build has {len(previous)} rows; only changed texts are encoded.")
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    tmp_store = f"{output}.{os.getpid()}.vec.tmp"
+    if os.path.exists(tmp_store):
+        os.remove(tmp_store)
+    store = VectorStore(tmp_store, dim=dim)
+    hashes = []
+    stats = {"rows": 0, "encoded": 0, "reused": 0}
+    encoder = Encoder(model, batch_size=batch_size, workers=workers)
+    started = time.perf_counter()
+    try:
+        for chunk in embeddings_utils.iter_base_product_memory(csv_path, chunk_size):
+            texts = chunk["ingredients"].tolist()
+            chunk_hashes = [text_hash(text) for text in texts]
+            rows = np.empty((len(texts), dim), dtype=np.float32)
+            missing = [i for i, h in enumerate(chunk_hashes) if h not in previous]
+            reused = [i for i, h in enumerate(chunk_hashes) if h in previous]
+            if reused:
+                rows[reused] = old_matrix[[previous[chunk_hashes[i]] for i in reused]]
+            if missing:
+                rows[missing] = encoder([texts[i] for i in missing])
+            if len(rows):
+                store.append(rows)
+            hashes.extend(chunk_hashes)
+            stats["rows"] += len(texts)
+            stats["encoded"] += len(missing)
+            stats["reused"] += len(reused)
+            elapsed = time.perf_counter() - started
+            print(
+                f"  {stats['rows']} rows ({stats['encoded']} encoded, {stats['reused']} reused) "
+                f"- {stats['encoded'] / max(elapsed, 1e-9):.1f} encoded rows/s"
+            )
+    finally:
+        encoder.close()
+
+    if hashes == old_hashes:
+        # Nothing changed: keep the file (and the memory snapshot built from it).
+        os.remove(tmp_store)
+        print(f"✅ {output} is up to date ({stats['rows']} rows).")
+        return stats
 
-# Load product memory CSV and drop any blank rows
-df = (
-    pd.read_csv(PRODUCT_MEMORY_PATH)
-    .dropna(subset=["ingredients"])
-)
+    # torch.save reads the memory-mapped rows; the .pt is what the app loads.
+    tmp_output = f"{output}.{os.getpid()}.tmp"
+    torch.save(torch.from_numpy(store.matrix(copy_on_write=True)), tmp_output)
+    os.remove(tmp_store)
+    tmp_manifest = f"{manifest_path(output)}.{os.getpid()}.tmp"
+    with open(tmp_manifest, "w", encoding="utf-8") as fh:
+        json.dump({"model": model_name, "dim": dim, "rows": len(hashes), "hashes": hashes}, fh)
+    # Drop the old manifest first so an interrupted swap leads to a full
+    # rebuild, never to a manifest describing the wrong rows.
+    if os.path.exists(manifest_path(output)):
+        os.remove(manifest_path(output))
+    os.replace(tmp_output, output)
+    os.replace(tmp_manifest, manifest_path(output))
 
-# Embedder
-model = SentenceTransformer("all-MiniLM-L6-v2")
+    elapsed = time.perf_counter() - started
+    print(f"✅ Saved {stats['rows']} embeddings to {output} in {elapsed:.1f}s")
+    return stats
 
-# Get ingredient texts
-texts = df["ingredients"].astype(str).tolist()
 
-# Compute embeddings as a tensor for safe loading with weights_only=True
-embeddings = model.encode(texts, convert_to_tensor=True).float()
+# --------------------------
+# MAIN
+# --------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute the base product embeddings.")
+    parser.add_argument("--csv", default=None, help=f"Default: {embeddings_utils.BASE_PRODUCT_MEMORY_PATH}")
+    parser.add_argument("--output", default=None, help=f"Default: {embeddings_utils.BASE_EMBEDDINGS_PATH}")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="CSV rows read at a time.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Texts per encoder batch.")
+    parser.add_argument("--workers", type=int, default=1, help="Encoder processes.")
+    parser.add_argument("--full", action="store_true", help="Ignore the previous build and re-encode every row.")
+    args = parser.parse_args(argv)
+    precompute(
+        args.csv,
+        args.output,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        full=args.full,
+    )
 
-# Save the tensor (keeps dtype and shape; safe to load with weights_only=True)
-torch.save(embeddings.cpu(), EMBEDDING_OUTPUT_PATH)
 
-print(f"Saved clean embeddings to {EMBEDDING_OUTPUT_PATH}")
+if __name__ == "__main__":
+    main()
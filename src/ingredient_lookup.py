@@ -1,7 +1,9 @@
 """
 Lightweight ingredient lookup by product name using DuckDuckGo HTML results.
 This avoids API keys and keeps the dependency surface small while providing
-best-effort extraction of ingredient snippets.
+best-effort extraction of ingredient snippets. The local product catalogue
+is checked first; the web is only searched on a miss and what it finds is
+written back to the catalogue.
 """
 from __future__ import annotations
 
@@ -12,6 +14,9 @@ from urllib.parse import quote_plus
 import requests
 from bs4 import BeautifulSoup
 
+from src import http_cache
+from src.product_catalogue import get_catalogue
+
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
     "(KHTML, like Gecko) Chrome/120.0 Safari/537.36",
@@ -38,9 +43,7 @@ def _extract_ingredients_from_text(text: str) -> Optional[str]:
 
 def _fetch_search_page(query: str) -> BeautifulSoup:
     url = SEARCH_URL.format(query=quote_plus(query))
-    response = requests.get(url, headers=HEADERS, timeout=8)
-    response.raise_for_status()
-    return BeautifulSoup(response.text, "lxml")
+    return BeautifulSoup(http_cache.cached_get_text(url, source="ingredient_search"), "lxml")
 
 
 def search_ingredients_by_product_name(product_name: str) -> Dict[str, str]:
@@ -56,6 +59,17 @@ def search_ingredients_by_product_name(product_name: str) -> Dict[str, str]:
             "source": "",
         }
 
+    catalogue = get_catalogue()
+    local = catalogue.lookup_ingredients(product_name)
+    if local is not None:
+        entry, _ = local
+        return {
+            "status": "success",
+            "message": "Found ingredients in the local product catalogue.",
+            "ingredients": entry.ingredients,
+            "source": entry.name,
+        }
+
     query = f"{product_name} ingredients"
     base_response = {
         "status": "not_found",
@@ -84,6 +98,7 @@ def search_ingredients_by_product_name(product_name: str) -> Dict[str, str]:
             ingredients = _extract_ingredients_from_text(snippet_text)
 
         if ingredients:
+            catalogue.add(product_name.strip(), ingredients=ingredients, source=title_text or "DuckDuckGo")
             return {
                 "status": "success",
                 "message": "Fetched ingredients from web search.",
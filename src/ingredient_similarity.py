@@ -1,39 +1,71 @@
 """
 Compatibility wrapper around the new embeddings utilities.
+
+The shared encoder and memory used to be built at import time; they now
+load on first use. The old module attributes (sentence_model,
+product_names, ingredient_lists, base_embeddings, flat_ingredients,
+flat_embeddings) still resolve, loading on first access.
 """
-from typing import Dict, List
+import threading
+from typing import Dict, List, Optional
 
 import torch
 
 from src import embeddings_utils
 
-# Initialise shared models and memory on import for backward compatibility
-sentence_model = embeddings_utils.load_sentence_model()
-product_names, ingredient_lists, base_embeddings = embeddings_utils.load_base_product_memory(sentence_model)
-flat_ingredients, flat_embeddings = embeddings_utils.build_flat_ingredient_embeddings(
-    ingredient_lists, sentence_model, device=base_embeddings.device if base_embeddings.numel() > 0 else None
-)
+_STATE: Optional[Dict[str, object]] = None
+_STATE_LOCK = threading.Lock()
+
+
+def _state() -> Dict[str, object]:
+    global _STATE
+    with _STATE_LOCK:
+        if _STATE is None:
+            model = embeddings_utils.load_sentence_model()
+            snapshot = embeddings_utils.load_base_snapshot(lambda: model)
+            _STATE = {
+                "sentence_model": model,
+                "product_names": snapshot.product_names,
+                "ingredient_lists": snapshot.ingredient_lists,
+                "base_embeddings": snapshot.embeddings,
+                "flat_ingredients": snapshot.flat_ingredients,
+                "flat_embeddings": snapshot.flat_embeddings,
+            }
+        return _STATE
+
+
+def __getattr__(name: str):
+    if name in ("sentence_model", "product_names", "ingredient_lists", "base_embeddings", "flat_ingredients", "flat_embeddings"):
+        return _state()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _device():
+    base_embeddings = _state()["base_embeddings"]
+    return base_embeddings.device if base_embeddings.numel() > 0 else None
 
 
 def embed_text(text) -> torch.Tensor:
-    return embeddings_utils.embed_text(text, sentence_model, device=base_embeddings.device if base_embeddings.numel() > 0 else None)
+    return embeddings_utils.embed_text(text, _state()["sentence_model"], device=_device())
 
 
 def most_similar_ingredients(query_text: str, top_k: int = 1) -> Dict[str, Dict[str, float]]:
+    state = _state()
     return embeddings_utils.most_similar_ingredients(
         query_text,
-        flat_ingredients,
-        flat_embeddings,
-        sentence_model,
+        state["flat_ingredients"],
+        state["flat_embeddings"],
+        state["sentence_model"],
         top_k=top_k,
     )
 
 
 def find_similar_products(query_embedding, top_k: int = 5) -> List[Dict[str, object]]:
+    state = _state()
     return embeddings_utils.find_similar_products(
         query_embedding,
-        product_names,
-        ingredient_lists,
-        base_embeddings,
+        state["product_names"],
+        state["ingredient_lists"],
+        state["base_embeddings"],
         top_k=top_k,
     )
@@ -0,0 +1,120 @@
+"""
+Multi-pattern keyword matching (Aho-Corasick) for ingredient trigger lists.
+The automaton is built once from the keyword groups and finds every
+occurrence of every keyword in a single pass over the text, so the cost of a
+scan does not grow with the number of keywords.
+"""
+from __future__ import annotations
+
+from bisect import bisect_right
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+
+class KeywordHit(NamedTuple):
+    keyword: str
+    group: str
+    start: int
+    end: int
+
+
+class KeywordMatcher:
+    """
+    Matches lowercase keywords (substring semantics, overlaps included).
+    `groups` maps a group name (e.g. "unsafe") to its keywords; results keep
+    the declaration order of the keywords.
+    """
+
+    def __init__(self, groups: Dict[str, Iterable[str]]):
+        self.keywords: List[str] = []
+        self.keyword_groups: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+
+        for group, words in groups.items():
+            for word in words:
+                word = str(word).lower()
+                if word:
+                    self._insert(word, len(self.keywords))
+                    self.keywords.append(word)
+                    self.keyword_groups.append(group)
+        self._link()
+
+    def _insert(self, word: str, keyword_id: int) -> None:
+        node = 0
+        for ch in word:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(keyword_id)
+
+    def _link(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def _scan(self, text: str) -> Iterator[Tuple[int, int]]:
+        """
+        Yield (keyword id, end position) for every occurrence.
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for pos, ch in enumerate(str(text).lower()):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for keyword_id in out[node]:
+                yield keyword_id, pos + 1
+
+    def find_all(self, text: str) -> List[KeywordHit]:
+        """
+        Every keyword occurrence in `text` (case-insensitive), in text order.
+        """
+        hits: List[KeywordHit] = []
+        for keyword_id, end in self._scan(text):
+            keyword = self.keywords[keyword_id]
+            hits.append(KeywordHit(keyword, self.keyword_groups[keyword_id], end - len(keyword), end))
+        return hits
+
+    def _ordered(self, ids: Iterable[int], group: Optional[str]) -> List[str]:
+        return [
+            self.keywords[i]
+            for i in sorted(set(ids))
+            if group is None or self.keyword_groups[i] == group
+        ]
+
+    def present(self, text: str, group: Optional[str] = None) -> List[str]:
+        """
+        Distinct keywords found in `text`, optionally restricted to one group.
+        """
+        return self._ordered((keyword_id for keyword_id, _ in self._scan(text)), group)
+
+    def hits_per_item(self, items: Sequence[str]) -> List[List[KeywordHit]]:
+        """
+        Scan a list of strings (e.g. ingredients) in one pass and return the
+        hits belonging to each item. Matches never span two items.
+        """
+        starts: List[int] = []
+        offset = 0
+        for item in items:
+            starts.append(offset)
+            offset += len(item) + 1
+        per_item: List[List[KeywordHit]] = [[] for _ in items]
+        for hit in self.find_all("\n".join(items)):
+            idx = bisect_right(starts, hit.start) - 1
+            if hit.end <= starts[idx] + len(items[idx]):
+                per_item[idx].append(hit)
+        return per_item
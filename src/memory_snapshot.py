@@ -0,0 +1,122 @@
+"""
+Precomputed snapshot of the base product memory.
+
+One file holds the product names, ingredient lists, product embeddings and
+the flattened ingredient vocabulary with its embeddings. Layout: an 8-byte
+magic, an 8-byte header length, a JSON header (lists, shapes, offsets and
+the identity of the sources it was built from), then the raw float32
+matrices, 64-byte aligned. Loading reads the header and memory-maps the
+matrices, so a worker starts without reading the CSV or running the encoder.
+
+    python -m src.memory_snapshot      # (re)build models/memory_snapshot.bin
+"""
+from __future__ import annotations
+
+import json
+import os
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import torch
+
+SNAPSHOT_PATH = "models/memory_snapshot.bin"
+MAGIC = b"DLSNAP01"
+LENGTH = struct.Struct("<Q")
+ALIGN = 64
+
+
+@dataclass
+class MemorySnapshot:
+    product_names: List[str]
+    ingredient_lists: List[str]
+    embeddings: torch.Tensor
+    flat_ingredients: List[str]
+    flat_embeddings: torch.Tensor
+    source: str = ""
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_snapshot(path: str, snapshot: MemorySnapshot) -> None:
+    """
+    Write atomically: readers see either the old file or the complete new one.
+    """
+    product = np.ascontiguousarray(snapshot.embeddings.detach().cpu().numpy(), dtype=np.float32)
+    flat = np.ascontiguousarray(snapshot.flat_embeddings.detach().cpu().numpy(), dtype=np.float32)
+    header = {
+        "source": snapshot.source,
+        "product_names": snapshot.product_names,
+        "ingredient_lists": snapshot.ingredient_lists,
+        "flat_ingredients": snapshot.flat_ingredients,
+        "product_shape": list(product.shape),
+        "flat_shape": list(flat.shape),
+    }
+    # Offsets depend on the header length, which depends on the offsets:
+    # reserve room for them with placeholders first.
+    header["product_offset"] = header["flat_offset"] = 0
+    base = len(MAGIC) + LENGTH.size + len(json.dumps(header).encode("utf-8")) + 64
+    header["product_offset"] = _aligned(base)
+    header["flat_offset"] = _aligned(header["product_offset"] + product.nbytes)
+    raw_header = json.dumps(header).encode("utf-8")
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(MAGIC)
+        fh.write(LENGTH.pack(len(raw_header)))
+        fh.write(raw_header)
+        fh.write(b"\0" * (header["product_offset"] - fh.tell()))
+        fh.write(product.tobytes())
+        fh.write(b"\0" * (header["flat_offset"] - fh.tell()))
+        fh.write(flat.tobytes())
+    os.replace(tmp_path, path)
+
+
+def _mapped(path: str, offset: int, shape) -> torch.Tensor:
+    shape = tuple(shape)
+    if not shape[0]:
+        return torch.empty(shape, dtype=torch.float32)
+    array = np.memmap(path, dtype=np.float32, mode="c", offset=offset, shape=shape)
+    return torch.from_numpy(array)
+
+
+def load_snapshot(path: str = SNAPSHOT_PATH, source: Optional[str] = None) -> Optional[MemorySnapshot]:
+    """
+    Memory-map a snapshot. Returns None if it is missing, unreadable, or
+    was built from different sources than ``source``.
+    """
+    try:
+        with open(path, "rb") as fh:
+            if fh.read(len(MAGIC)) != MAGIC:
+                return None
+            (length,) = LENGTH.unpack(fh.read(LENGTH.size))
+            header = json.loads(fh.read(length).decode("utf-8"))
+    except (OSError, ValueError, struct.error):
+        return None
+    if source is not None and header.get("source") != source:
+        return None
+    try:
+        return MemorySnapshot(
+            product_names=header["product_names"],
+            ingredient_lists=header["ingredient_lists"],
+            embeddings=_mapped(path, header["product_offset"], header["product_shape"]),
+            flat_ingredients=header["flat_ingredients"],
+            flat_embeddings=_mapped(path, header["flat_offset"], header["flat_shape"]),
+            source=header.get("source", ""),
+        )
+    except (KeyError, ValueError, OSError):
+        return None
+
+
+if __name__ == "__main__":
+    from src import embeddings_utils
+
+    model = embeddings_utils.load_sentence_model()
+    built = embeddings_utils.build_base_snapshot(model)
+    write_snapshot(SNAPSHOT_PATH, built)
+    print(f"Wrote {len(built.product_names)} products and {len(built.flat_ingredients)} ingredients to {SNAPSHOT_PATH}")
@@ -0,0 +1,193 @@
+"""
+PDF reports for analysis results.
+
+Reports are built only when someone asks for one and the bytes are kept in
+a content-addressed cache: the key is a hash of the result and the LIME
+image, so asking again for the same report is a dictionary lookup.
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    from fpdf import FPDF  # type: ignore
+except ImportError:  # pragma: no cover
+    FPDF = None
+
+
+def _json_default(value):
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+def report_key(results: Sequence[Dict], lime_image: Optional[bytes] = None) -> str:
+    """
+    Content hash of the results (and optional LIME image) a report shows.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(list(results), sort_keys=True, default=_json_default).encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(lime_image or b"")
+    return digest.hexdigest()
+
+
+def _write_result(pdf, result: Dict, lime_image: Optional[bytes] = None) -> None:
+    pdf.set_font("Arial", "", 11)
+    pdf.cell(0, 8, f"Product: {result.get('product_name', 'N/A')}", ln=True)
+    pdf.cell(0, 8, f"Timestamp: {result.get('timestamp', '')}", ln=True)
+    pdf.ln(4)
+
+    # Prediction
+    tfidf = result.get("tfidf", {})
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 8, "Model Prediction", ln=True)
+    pdf.set_font("Arial", "", 11)
+    pdf.cell(0, 8, f"Label: {tfidf.get('label', 'N/A')}", ln=True)
+
+    probs = tfidf.get("probs")
+    classes = tfidf.get("classes", [])
+    if probs is not None:
+        probs_arr = np.array(probs)
+        top_idx = np.argsort(probs_arr)[::-1][:3]
+        for idx in top_idx:
+            pdf.cell(0, 8, f"{classes[idx]}: {probs_arr[idx]:.3f}", ln=True)
+    pdf.ln(4)
+
+    # Safety
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 8, "Fungal Acne Score", ln=True)
+    pdf.set_font("Arial", "", 11)
+    pdf.cell(0, 8, f"Score: {result.get('safety_score', 'N/A')}/10", ln=True)
+    pdf.multi_cell(0, 8, f"Explanation: {result.get('explanation', '')}")
+    pdf.ln(4)
+
+    # Ingredients
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 8, "Ingredients", ln=True)
+    pdf.set_font("Arial", "", 11)
+    pdf.multi_cell(0, 8, result.get("ingredients_raw", ""))
+    pdf.ln(4)
+
+    # Similar products
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 8, "Similar Products", ln=True)
+    pdf.set_font("Arial", "", 11)
+    for item in result.get("similar_products", [])[:5]:
+        pdf.cell(0, 8, f"{item['product_name']} ({item['score']:.2f})", ln=True)
+    pdf.ln(4)
+
+    # Ingredient similarities
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 8, "Ingredient Insights", ln=True)
+    pdf.set_font("Arial", "", 11)
+    for ing, sim in result.get("ingredient_similarities", {}).items():
+        pdf.cell(0, 8, f"{ing} -> {sim['closest_ingredient']} ({sim['score']:.2f})", ln=True)
+    pdf.ln(4)
+
+    # LIME image if provided
+    if lime_image:
+        try:
+            pdf.set_font("Arial", "B", 12)
+            pdf.cell(0, 8, "LIME Explanation", ln=True)
+            img_stream = io.BytesIO(lime_image)
+            pdf.image(img_stream, x=None, y=None, w=170)
+        except Exception:
+            pass
+
+
+def _output(pdf) -> bytes:
+    buffer = io.BytesIO()
+    pdf.output(buffer)
+    return buffer.getvalue()
+
+
+def build_report(result: Dict, lime_image: Optional[bytes] = None) -> Optional[bytes]:
+    """
+    PDF bytes for one analysis, or None if fpdf is not installed.
+    """
+    if FPDF is None:
+        return None
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", "B", 14)
+    pdf.cell(0, 10, "DermaLens Skincare Analysis", ln=True)
+    _write_result(pdf, result, lime_image)
+    return _output(pdf)
+
+
+def build_batch_report(results: Sequence[Dict], title: str = "DermaLens Skincare Report") -> Optional[bytes]:
+    """
+    One PDF covering several analyses: a summary page listing every product,
+    then one section per product. None if fpdf is not installed.
+    """
+    if FPDF is None:
+        return None
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", "B", 14)
+    pdf.cell(0, 10, title, ln=True)
+    pdf.set_font("Arial", "", 11)
+    pdf.cell(0, 8, f"Products: {len(results)}", ln=True)
+    pdf.ln(2)
+    for i, result in enumerate(results, start=1):
+        label = result.get("tfidf", {}).get("label", "N/A")
+        pdf.cell(0, 8, f"{i}. {result.get('product_name', 'N/A')} - score {result.get('safety_score', 'N/A')}/10 - {label}", ln=True)
+
+    for i, result in enumerate(results, start=1):
+        pdf.add_page()
+        pdf.set_font("Arial", "B", 14)
+        pdf.cell(0, 10, f"{i}. {result.get('product_name', 'N/A')}", ln=True)
+        _write_result(pdf, result)
+    return _output(pdf)
+
+
+class ReportCache:
+    """
+    Thread-safe LRU of generated PDF bytes keyed by report_key().
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_build(self, key: str, build) -> Optional[bytes]:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        data = build()
+        if data is None:
+            return None
+        with self._lock:
+            self._entries[key] = data
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return data
+
+
+REPORT_CACHE = ReportCache()
+
+
+def cached_report(result: Dict, lime_image: Optional[bytes] = None, cache: ReportCache = REPORT_CACHE) -> Optional[bytes]:
+    return cache.get_or_build(report_key([result], lime_image), lambda: build_report(result, lime_image))
+
+
+def cached_batch_report(results: List[Dict], cache: ReportCache = REPORT_CACHE) -> Optional[bytes]:
+    return cache.get_or_build(f"batch:{report_key(results)}", lambda: build_batch_report(results))
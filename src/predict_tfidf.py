@@ -1,6 +1,6 @@
 import os
-import joblib
 
+from src.compiled_model import load_model as load_cached_model
 from src.preprocessing import join_ingredients_for_model
 from src.safety_score import calculate_safety_score
 
@@ -10,17 +10,18 @@ MODEL_PATH = os.path.join("models", "tfidf_logreg_model.joblib")
 def load_model():
     if not os.path.exists(MODEL_PATH):
         raise FileNotFoundError(f"Model not found at {MODEL_PATH}. Train it first.")
-    return joblib.load(MODEL_PATH)
+    # Loaded once per process (the compact artefact when one is exported).
+    return load_cached_model(MODEL_PATH)
 
 
 def predict_safety(ingredients_text: str):
     model = load_model()
     clean_text = join_ingredients_for_model(ingredients_text)
 
-    pred_label = model.predict([clean_text])[0]
+    # single pass through the pipeline; predict() would just take the argmax
     pred_proba = model.predict_proba([clean_text])[0]
-
     classes = model.classes_
+    pred_label = classes[pred_proba.argmax()]
     proba_dict = {cls: float(p) for cls, p in zip(classes, pred_proba)}
 
     # calculate fungal acne score
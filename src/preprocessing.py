@@ -1,5 +1,10 @@
 import re
-from typing import List
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple, Union
+
+_DISALLOWED_CHARS = re.compile(r"[^a-z0-9,/%\s\-]")
+_WHITESPACE = re.compile(r"\s+")
+
 
 def clean_ingredients_text(text: str) -> str:
     """
@@ -18,10 +23,10 @@ def clean_ingredients_text(text: str) -> str:
     text = text.replace("\n", " ").replace("\t", " ")
 
     # remove anything that's not letter, number, comma, space or slash
-    text = re.sub(r"[^a-z0-9,/%\s\-]", " ", text)
+    text = _DISALLOWED_CHARS.sub(" ", text)
 
     # collapse multiple spaces
-    text = re.sub(r"\s+", " ", text).strip()
+    text = _WHITESPACE.sub(" ", text).strip()
 
     return text
 
@@ -42,3 +47,55 @@ def join_ingredients_for_model(text: str) -> str:
     Returns cleaned text for TF-IDF model.
     """
     return clean_ingredients_text(text)
+
+
+@dataclass(frozen=True)
+class ParsedIngredients:
+    """
+    One request's ingredient text, cleaned and split exactly once.
+    Cleaned text is already lowercase, so `ingredients` doubles as the
+    lowercase form used for keyword matching.
+    """
+
+    raw: str
+    clean_text: str
+    ingredients: Tuple[str, ...]
+
+    @property
+    def keyword_text(self) -> str:
+        """
+        Ingredients joined by newlines: keywords never contain one, so a
+        single matcher pass cannot match across two ingredients.
+        """
+        return "\n".join(self.ingredients)
+
+
+IngredientsInput = Union[str, ParsedIngredients]
+
+
+def parse_ingredients(text: IngredientsInput) -> ParsedIngredients:
+    """
+    Clean and split an ingredients string once for the whole pipeline.
+    Already-parsed input is returned unchanged.
+    """
+    if isinstance(text, ParsedIngredients):
+        return text
+    clean_text = clean_ingredients_text(text)
+    ingredients = tuple(p.strip() for p in clean_text.split(",") if p.strip())
+    return ParsedIngredients(raw=text if isinstance(text, str) else "", clean_text=clean_text, ingredients=ingredients)
+
+
+def parse_many(texts: Iterable[IngredientsInput]) -> List[ParsedIngredients]:
+    """
+    Parse a batch of ingredient texts; repeated texts are parsed once.
+    """
+    seen: Dict[str, ParsedIngredients] = {}
+    parsed = []
+    for text in texts:
+        if isinstance(text, ParsedIngredients):
+            parsed.append(text)
+            continue
+        if text not in seen:
+            seen[text] = parse_ingredients(text)
+        parsed.append(seen[text])
+    return parsed
@@ -0,0 +1,366 @@
+"""
+Local product catalogue: barcode -> product and product name -> ingredients.
+
+Built from the baked-in product memory CSV, the user memory JSONL (whose
+tail is picked up as it grows), bulk imported dumps (CSV or JSONL, e.g.
+Open Beauty Facts exports) and every successful web lookup, which is
+written back to CATALOGUE_PATH. Names are
+matched fuzzily through a character-trigram inverted index, so "cerave
+moisturizing lotion" finds "CeraVe Moisturising Lotion 236ml" without a
+web search. Only spelling and pack size may differ: a sibling product
+("CeraVe Foaming Cleanser" for "CeraVe Hydrating Cleanser") is a miss.
+
+    python -m src.product_catalogue import dump.csv [more.jsonl ...]
+    python -m src.product_catalogue search "cerave lotion"
+"""
+from __future__ import annotations
+
+import csv
+import json
+import os
+import re
+import sys
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+CATALOGUE_PATH = "data/product_catalogue.jsonl"
+BASE_PRODUCT_MEMORY_PATH = "data/product_memory.csv"
+USER_MEMORY_PATH = "data/user_product_memory.jsonl"
+
+# Dice similarity a fuzzy name match needs before it replaces a web search.
+MIN_NAME_SCORE = 0.75
+# Each word of the query and of the match needs a counterpart in the other
+# name at least this similar (spelling variants such as -ise / -ize pass,
+# sibling products such as "Foaming" / "Hydrating" do not).
+MIN_TOKEN_SCORE = 0.75
+
+# Source of barcode -> name pairs guessed from a web search result title.
+# Guesses only fill gaps: they never move a barcode or name that a dump,
+# import or user memory row already set.
+GUESSED_SOURCE = "barcode search"
+
+# Column names accepted by import_dump, first match wins.
+NAME_COLUMNS = ("product_name", "product_names", "name", "product_name_en")
+INGREDIENT_COLUMNS = ("ingredients", "ingredients_text", "ingredients_text_en")
+BARCODE_COLUMNS = ("barcode", "code", "ean", "gtin")
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+# Pack sizes ("236ml", "50 ml") say nothing about which product it is.
+_SIZE_UNITS = {"ml", "l", "cl", "g", "kg", "mg", "oz", "fl"}
+_SIZE = re.compile(r"^\d+(?:ml|l|cl|g|kg|mg|oz)$")
+
+
+def normalise_name(name: str) -> str:
+    return _NON_ALNUM.sub(" ", str(name).lower()).strip()
+
+
+def name_trigrams(name: str) -> List[str]:
+    """
+    Distinct character trigrams of a normalised name, padded so short
+    words and word boundaries still produce grams.
+    """
+    padded = f"  {normalise_name(name)} "
+    return list(dict.fromkeys(padded[i : i + 3] for i in range(len(padded) - 2)))
+
+
+def _name_tokens(name: str) -> List[str]:
+    words = normalise_name(name).split()
+    return [
+        word
+        for i, word in enumerate(words)
+        if not (
+            word in _SIZE_UNITS
+            or _SIZE.match(word)
+            or (word.isdigit() and i + 1 < len(words) and words[i + 1] in _SIZE_UNITS)
+        )
+    ]
+
+
+def _token_score(a: str, b: str) -> float:
+    if a == b:
+        return 1.0
+    grams_a, grams_b = set(name_trigrams(a)), set(name_trigrams(b))
+    return 2.0 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+def same_product(query: str, candidate: str) -> bool:
+    """
+    True when every word of each name (pack sizes aside) has a close
+    counterpart in the other, i.e. the names differ at most in spelling.
+    """
+    query_tokens, candidate_tokens = _name_tokens(query), _name_tokens(candidate)
+    if not query_tokens or not candidate_tokens:
+        return False
+
+    def covered(tokens, others):
+        return all(any(_token_score(t, o) >= MIN_TOKEN_SCORE for o in others) for t in tokens)
+
+    return covered(query_tokens, candidate_tokens) and covered(candidate_tokens, query_tokens)
+
+
+def normalise_barcode(code: str) -> str:
+    return re.sub(r"\D", "", str(code))
+
+
+@dataclass
+class CatalogueEntry:
+    name: str
+    ingredients: str = ""
+    barcode: str = ""
+    source: str = ""
+
+
+def _first(row: Dict, columns: Tuple[str, ...]) -> str:
+    for column in columns:
+        value = row.get(column)
+        if value is not None and str(value).strip() and str(value).strip().lower() != "nan":
+            return str(value).strip()
+    return ""
+
+
+def _parse_jsonl(lines: Iterable) -> Iterator[Dict]:
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            continue
+
+
+def _read_rows(path: str) -> Iterator[Dict]:
+    if path.endswith((".jsonl", ".json")):
+        with open(path, "r", encoding="utf-8") as fh:
+            yield from _parse_jsonl(fh)
+    else:
+        with open(path, "r", encoding="utf-8", newline="") as fh:
+            sample = fh.read(4096)
+            fh.seek(0)
+            delimiter = "\t" if sample.count("\t") > sample.count(",") else ","
+            yield from csv.DictReader(fh, delimiter=delimiter)
+
+
+class ProductCatalogue:
+    """
+    In-memory catalogue with exact barcode lookup and fuzzy name search.
+    Records with the same normalised name are merged; later non-empty
+    fields win. ``path`` is the append-only JSONL that persists imports
+    and write-backs (None keeps everything in memory).
+    """
+
+    def __init__(self, path: Optional[str] = CATALOGUE_PATH):
+        self.path = path
+        self.entries: List[CatalogueEntry] = []
+        self._by_name: Dict[str, int] = {}
+        self._by_barcode: Dict[str, int] = {}
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        self._gram_counts: List[int] = []
+        self._guessed_barcodes: Set[str] = set()
+        self._lock = threading.RLock()
+        self.user_memory_path: Optional[str] = None
+        self._user_memory_offset = 0
+        self._sync_lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._add_rows(_read_rows(path), persist=False)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _merge(self, name: str, ingredients: str, barcode: str, source: str) -> Optional[int]:
+        key = normalise_name(name)
+        barcode = normalise_barcode(barcode)
+        if not key and barcode in self._by_barcode:
+            idx = self._by_barcode[barcode]
+        elif not key:
+            return None
+        else:
+            idx = self._by_name.get(key)
+        if idx is None:
+            idx = len(self.entries)
+            self.entries.append(CatalogueEntry(name=name.strip(), source=source))
+            self._by_name[key] = idx
+            grams = name_trigrams(name)
+            for gram in grams:
+                self._postings[gram].append(idx)
+            self._gram_counts.append(len(grams))
+        entry = self.entries[idx]
+        guessed = source == GUESSED_SOURCE
+        if ingredients:
+            entry.ingredients = ingredients.strip()
+            entry.source = source or entry.source
+        elif source and not guessed and entry.source == GUESSED_SOURCE:
+            entry.source = source  # real data now vouches for the name
+        if barcode and not (guessed and self._barcode_known(entry, barcode)):
+            entry.barcode = barcode
+            self._by_barcode[barcode] = idx
+            if guessed:
+                self._guessed_barcodes.add(barcode)
+            else:
+                self._guessed_barcodes.discard(barcode)
+        return idx
+
+    def _barcode_known(self, entry: CatalogueEntry, barcode: str) -> bool:
+        """
+        True when ``barcode`` or ``entry``'s own barcode came from real data.
+        """
+        if barcode in self._by_barcode and barcode not in self._guessed_barcodes:
+            return True
+        return bool(entry.barcode) and entry.barcode not in self._guessed_barcodes
+
+    def _add_rows(self, rows: Iterable[Dict], persist: bool, source: str = "") -> int:
+        added = []
+        with self._lock:
+            for row in rows:
+                name = _first(row, NAME_COLUMNS)
+                ingredients = _first(row, INGREDIENT_COLUMNS)
+                barcode = _first(row, BARCODE_COLUMNS)
+                row_source = str(row.get("source") or source)
+                if self._merge(name, ingredients, barcode, row_source) is not None:
+                    added.append({"name": name, "ingredients": ingredients, "barcode": normalise_barcode(barcode), "source": row_source})
+            if persist and self.path and added:
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as fh:
+                    fh.write("".join(json.dumps(record) + "\n" for record in added))
+        return len(added)
+
+    def add(self, name: str, ingredients: str = "", barcode: str = "", source: str = "", persist: bool = True) -> None:
+        """
+        Add or update one product; persisted unless ``persist`` is False.
+        """
+        self._add_rows([{"name": name, "ingredients": ingredients, "barcode": barcode, "source": source}], persist=persist)
+
+    def import_dump(self, path: str, persist: bool = True) -> int:
+        """
+        Bulk-load a CSV/TSV/JSONL dump. Returns the number of rows taken.
+        """
+        return self._add_rows(_read_rows(path), persist=persist, source=os.path.basename(path))
+
+    def load_sources(self, product_memory_path: str = BASE_PRODUCT_MEMORY_PATH, user_memory_path: str = USER_MEMORY_PATH) -> None:
+        """
+        Index the products DermaLens already knows about. These are not
+        persisted: the source files remain the source of truth. The user
+        memory is followed afterwards through sync_user_memory.
+        """
+        if os.path.exists(product_memory_path):
+            self._add_rows(_read_rows(product_memory_path), persist=False, source="product_memory")
+        with self._sync_lock:
+            self.user_memory_path = user_memory_path
+            self._user_memory_offset = 0
+        self.sync_user_memory()
+
+    def sync_user_memory(self) -> int:
+        """
+        Index the user memory entries appended since the last call and
+        return how many were taken. Like the engine's incremental sync it
+        reads from a byte offset and leaves a trailing partial line for
+        next time; a truncated or replaced file is read again from the
+        start (merging a row twice changes nothing).
+        """
+        with self._sync_lock:
+            path = self.user_memory_path
+            if not path:
+                return 0
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return 0
+            if size < self._user_memory_offset:
+                self._user_memory_offset = 0
+            if size == self._user_memory_offset:
+                return 0
+            with open(path, "rb") as fh:
+                fh.seek(self._user_memory_offset)
+                chunk = fh.read(size - self._user_memory_offset)
+            end = chunk.rfind(b"\n") + 1
+            self._user_memory_offset += end
+            rows = list(_parse_jsonl(chunk[:end].decode("utf-8", errors="replace").splitlines()))
+        return self._add_rows(rows, persist=False, source="user_memory")
+
+    def lookup_barcode(self, barcode: str) -> Optional[CatalogueEntry]:
+        with self._lock:
+            idx = self._by_barcode.get(normalise_barcode(barcode))
+            return self.entries[idx] if idx is not None else None
+
+    def search(self, name: str, limit: int = 5, min_score: float = 0.0) -> List[Tuple[CatalogueEntry, float]]:
+        """
+        Best fuzzy name matches as (entry, Dice score over trigrams).
+        """
+        grams = name_trigrams(name)
+        if not grams:
+            return []
+        with self._lock:
+            overlap: Counter = Counter()
+            for gram in grams:
+                overlap.update(self._postings.get(gram, ()))
+            scored = [
+                (2.0 * shared / (len(grams) + self._gram_counts[idx]), idx)
+                for idx, shared in overlap.items()
+            ]
+            scored.sort(key=lambda item: (-item[0], item[1]))
+            return [(self.entries[idx], score) for score, idx in scored[:limit] if score >= min_score]
+
+    def lookup_ingredients(self, name: str, min_score: float = MIN_NAME_SCORE) -> Optional[Tuple[CatalogueEntry, float]]:
+        """
+        Ingredients of the product ``name`` refers to, or None (search the
+        web). An exact normalised-name match decides on its own. Otherwise
+        the best match that is the same product (same_product) and scores
+        ``min_score`` is used. Either way a product without ingredients is
+        a miss: the next near match is a different product. Names guessed
+        from a barcode search say nothing about ingredients and are skipped.
+        """
+        with self._lock:
+            idx = self._by_name.get(normalise_name(name))
+            if idx is not None:
+                entry = self.entries[idx]
+                if entry.ingredients:
+                    return entry, 1.0
+                if entry.source != GUESSED_SOURCE:
+                    return None
+        for entry, score in self.search(name, limit=10, min_score=min_score):
+            if not entry.ingredients and entry.source == GUESSED_SOURCE:
+                continue
+            if same_product(name, entry.name):
+                return (entry, score) if entry.ingredients else None
+        return None
+
+
+_CATALOGUE: Optional[ProductCatalogue] = None
+_CATALOGUE_LOCK = threading.Lock()
+
+
+def get_catalogue() -> ProductCatalogue:
+    """
+    Process-wide catalogue, built on first use and brought up to date
+    with the user memory tail on every call.
+    """
+    global _CATALOGUE
+    with _CATALOGUE_LOCK:
+        if _CATALOGUE is None:
+            catalogue = ProductCatalogue(CATALOGUE_PATH)
+            catalogue.load_sources()
+            _CATALOGUE = catalogue
+        catalogue = _CATALOGUE
+    catalogue.sync_user_memory()
+    return catalogue
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) < 2 or argv[0] not in ("import", "search"):
+        print(__doc__)
+        return 1
+    catalogue = get_catalogue()
+    if argv[0] == "import":
+        for path in argv[1:]:
+            print(f"Imported {catalogue.import_dump(path)} rows from {path}")
+    else:
+        for entry, score in catalogue.search(" ".join(argv[1:])):
+            print(f"{score:.2f}  {entry.name}  [{entry.barcode or '-'}]  {'has ingredients' if entry.ingredients else ''}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,183 @@
+"""
+Cache of finished analyze() results.
+
+Keys are a hash of the cleaned ingredient text, the identity of the model
+that produced the result and the version of the product memory it was
+compared against, so a new model file or new memory entries simply stop
+old entries from matching. Results live in a bounded in-process LRU and,
+optionally, as one JSON file per key in a directory shared by workers.
+"""
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+# Request-specific fields; everything else depends only on the cache key.
+REQUEST_FIELDS = ("product_name", "ingredients_raw", "timestamp")
+
+
+def file_identity(path: str) -> str:
+    """
+    Cheap identity for a file on disk: path, size and modification time.
+    Returns an empty string for a missing file.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ""
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def result_key(clean_text: str, model_identity: str, memory_version: str) -> str:
+    digest = hashlib.sha256()
+    for part in (clean_text, model_identity, memory_version):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class AnalysisResultCache:
+    """
+    Thread-safe LRU of analysis results with an optional on-disk tier.
+    ``get`` returns a shallow copy with the request fields filled in:
+    callers may set top-level fields but must not mutate nested values,
+    which are shared with the cache. Disk reads and writes happen outside
+    the lock, so one slow miss does not stall every other lookup.
+    """
+
+    def __init__(self, max_entries: int = 512, cache_dir: Optional[str] = None, max_disk_entries: int = 10_000):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        if cache_dir:
+            Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _remember(self, key: str, result: Dict) -> None:
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _read_disk(self, key: str) -> Optional[Dict]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _write_disk(self, key: str, result: Dict) -> None:
+        if not self.cache_dir:
+            return
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                json.dump(result, fh)
+            os.replace(tmp_path, self._path(key))
+        except (OSError, TypeError, ValueError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % 64 == 0
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        """
+        Drop the least recently written files above max_disk_entries.
+        """
+        try:
+            paths = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".json")]
+        except OSError:
+            return
+        excess = len(paths) - self.max_disk_entries
+        if excess <= 0:
+            return
+        paths.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in paths[:excess]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def get(self, key: str, request: Optional[Dict] = None) -> Optional[Dict]:
+        """
+        Cached result for ``key`` or None. ``request`` overrides the
+        request-specific fields (product name, raw text, timestamp).
+        """
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if cached is None:
+            cached = self._read_disk(key)
+            with self._lock:
+                if cached is None:
+                    self.misses += 1
+                    return None
+                self._remember(key, cached)
+                self.hits += 1
+                self.disk_hits += 1
+        result = dict(cached)
+        if request:
+            result.update({field: request[field] for field in REQUEST_FIELDS if field in request})
+        return result
+
+    def put(self, key: str, result: Dict) -> None:
+        # Deep-copied once here, so later changes by the producer never leak in.
+        stored = copy.deepcopy(result)
+        with self._lock:
+            self._remember(key, stored)
+        self._write_disk(key, stored)
+
+    def clear(self) -> None:
+        """
+        Drop every in-memory entry and, if configured, every file on disk.
+        """
+        with self._lock:
+            self._entries.clear()
+        if not self.cache_dir:
+            return
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".json"):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -1,4 +1,5 @@
-from src.preprocessing import split_ingredients
+from src.keyword_matcher import KeywordMatcher
+from src.preprocessing import IngredientsInput, parse_ingredients
 
 # Ingredients known to trigger fungal acne strongly (you can expand this list!)
 UNSAFE_KEYWORDS = [
@@ -8,6 +9,7 @@ UNSAFE_KEYWORDS = [
     "oleic acid",
     "isopropyl myristate",
     "cetyl alcohol",
+    "cetearyl alcohol",
     "glyceryl stearate",
     "polysorbate",
     "sorbitan",
@@ -20,27 +22,30 @@ NEUTRAL_RISK = [
     "fragrance"
 ]
 
+# The one matcher for these lists: the engine and analytics import it too.
+SAFETY_MATCHER = KeywordMatcher({"unsafe": UNSAFE_KEYWORDS, "mild": NEUTRAL_RISK})
 
-def calculate_safety_score(ingredients_text: str):
+
+def calculate_safety_score(ingredients_text: IngredientsInput):
     """
     Returns a fungal acne safety score from 0 to 10.
     Based purely on ingredient-level analysis.
     Model prediction is separate.
+    Accepts raw text or an already ParsedIngredients.
     """
 
-    ingredients = [i.lower() for i in split_ingredients(ingredients_text)]
+    joined = parse_ingredients(ingredients_text).keyword_text
 
     score = 10  # start perfect
 
+    # One scan for both groups; each distinct keyword counts once.
+    found = {(hit.keyword, hit.group) for hit in SAFETY_MATCHER.find_all(joined)}
+
     # strong negative ingredients
-    for bad in UNSAFE_KEYWORDS:
-        if any(bad in ing for ing in ingredients):
-            score -= 4  # strong penalty
+    score -= 4 * sum(1 for _, group in found if group == "unsafe")
 
     # mild-risk ingredients
-    for mid in NEUTRAL_RISK:
-        if any(mid in ing for ing in ingredients):
-            score -= 1
+    score -= 1 * sum(1 for _, group in found if group == "mild")
 
     # keep score within bounds
     score = max(0, min(10, score))
@@ -0,0 +1,138 @@
+"""
+Background scan flow: barcode decode -> product lookup -> ingredient fetch
+-> analyze, run off the Streamlit script thread.
+
+submit() returns a ScanJob straight away; the UI polls job.done() the same
+way it polls the availability future. Stages overlap where they can: the
+store check starts as soon as a product name is guessed, and the sentence
+encoder is warmed while the ingredient fetch is in flight. The pipeline is
+shared by every session, so it never cancels jobs itself: the session that
+owns a job calls job.cancel() when a newer frame replaces it, and the job
+stops at its next stage boundary.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from src import barcode_scanner, ingredient_lookup, store_availability
+
+STAGES = ("decode", "lookup", "ingredients", "analyze")
+
+
+class ScanCancelled(Exception):
+    pass
+
+
+class ScanJob:
+    """
+    One camera frame moving through the pipeline. ``stage`` names the step
+    in progress, ``timings`` holds seconds per finished stage, and the
+    fields below fill in as stages complete.
+    """
+
+    def __init__(self, frame_id: int):
+        self.frame_id = frame_id
+        self.stage = "queued"
+        self.timings: Dict[str, float] = {}
+        self.codes: List[str] = []
+        self.lookup: Dict[str, str] = {}
+        self.product_name = ""
+        self.fetched: Dict[str, str] = {}
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.availability_future: Optional[Future] = None
+        self.future: Optional[Future] = None
+        self._cancelled = threading.Event()
+        self._children: List[Future] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        for child in self._children:
+            child.cancel()
+
+    def done(self) -> bool:
+        return self.future is not None and self.future.done()
+
+    def _check(self) -> None:
+        if self.cancelled:
+            raise ScanCancelled()
+
+
+class ScanPipeline:
+    """
+    Runs scan jobs for one engine on a private thread pool (jobs submit
+    sub-tasks, so sharing a small pool with other work could deadlock).
+    """
+
+    def __init__(self, engine, max_workers: int = 4, analyze: bool = True, clock: Callable[[], float] = time.perf_counter):
+        self.engine = engine
+        self.analyze = analyze
+        self._clock = clock
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scan")
+        self._lock = threading.Lock()
+        self._frames = 0
+
+    def submit(self, frame: bytes) -> ScanJob:
+        """
+        Start a job for ``frame``. Jobs of other sessions are left alone.
+        """
+        with self._lock:
+            self._frames += 1
+            job = ScanJob(self._frames)
+        job.future = self._executor.submit(self._run, job, frame)
+        return job
+
+    def _timed(self, job: ScanJob, stage: str, fn, *args):
+        job._check()
+        job.stage = stage
+        started = self._clock()
+        try:
+            return fn(*args)
+        finally:
+            job.timings[stage] = self._clock() - started
+
+    def _spawn(self, job: ScanJob, fn, *args) -> Future:
+        future = self._executor.submit(fn, *args)
+        job._children.append(future)
+        return future
+
+    def _run(self, job: ScanJob, frame: bytes) -> ScanJob:
+        try:
+            job.codes = self._timed(job, "decode", barcode_scanner.decode_barcodes, frame)
+            if not job.codes:
+                job.error = "No barcode detected. Try again with better lighting."
+                return job
+
+            job.lookup = self._timed(job, "lookup", barcode_scanner.lookup_product_from_barcode, job.codes[0])
+            job.product_name = job.lookup.get("product_name", "")
+            if not job.product_name:
+                job.error = job.lookup.get("message") or "No product match found for this barcode."
+                return job
+
+            # Both run while the ingredient fetch below is in flight.
+            job._check()
+            job.availability_future = self._spawn(job, store_availability.check_store_availability, job.product_name)
+            warm = self._spawn(job, self.engine.warm_up)
+
+            job.fetched = self._timed(job, "ingredients", ingredient_lookup.search_ingredients_by_product_name, job.product_name)
+            ingredients = job.fetched.get("ingredients", "")
+            if not ingredients:
+                job.error = job.fetched.get("message") or "No ingredient list found."
+                return job
+
+            if self.analyze:
+                warm.result()
+                job.result = self._timed(job, "analyze", self.engine.analyze, ingredients, job.product_name)
+            return job
+        except Exception as exc:  # includes ScanCancelled and cancelled sub-tasks
+            job.error = "Cancelled by a newer frame." if job.cancelled else str(exc)
+            return job
+        finally:
+            job.stage = "cancelled" if job.cancelled else "done"
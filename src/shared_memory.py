@@ -0,0 +1,237 @@
+"""
+Product and ingredient embedding matrices shared by every worker process.
+
+The matrices live in VectorStore files under SHARED_MEMORY_DIR that each
+worker memory-maps, so N Streamlit or service processes share one copy of
+the pages instead of holding N private tensors. Writes follow a
+single-writer protocol: whoever holds the directory's file lock appends the
+new rows and then publishes them by replacing ``state.json`` and bumping a
+16-byte memory-mapped version counter. Readers poll the counter, which costs
+one memory read. Only when it has moved do they re-read the state and remap
+the matrices.
+
+A full rebuild (new base memory, rewritten user memory) writes a new
+generation of files under new names. Workers still mapping the old
+generation keep working until they notice the generation change. The files
+of the generation just replaced stay until the next rebuild, so a worker
+that read the old state a moment earlier can still open them.
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from src.vector_store import VectorStore
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: only threads are serialised
+    fcntl = None
+
+SHARED_MEMORY_DIR = "models/shared_memory"
+# Set to 1 when several worker processes serve the app or the API, so they
+# map one copy of the embedding matrices instead of holding one each.
+SHARED_MEMORY_ENV = "DERMALENS_SHARED_MEMORY"
+VERSION = struct.Struct("<QQ")  # generation, appends
+
+_THREAD_LOCKS: Dict[str, threading.Lock] = {}
+_THREAD_LOCKS_GUARD = threading.Lock()
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """
+    Exclusive lock across processes (flock on ``path``) and across threads
+    of this process.
+    """
+    path = os.path.abspath(path)
+    with _THREAD_LOCKS_GUARD:
+        thread_lock = _THREAD_LOCKS.setdefault(path, threading.Lock())
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with thread_lock, open(path, "a+b") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+
+def shared_memory_enabled() -> bool:
+    """
+    True when SHARED_MEMORY_ENV opts this process into shared memory.
+    """
+    return os.environ.get(SHARED_MEMORY_ENV, "").strip().lower() in ("1", "true", "yes")
+
+
+class VersionCounter:
+    """
+    (generation, appends) pair in a small memory-mapped file. Reading it is a
+    memory access, so workers can check it on every request.
+    """
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a+b") as fh:
+            if os.path.getsize(path) < VERSION.size:
+                fh.write(b"\0" * (VERSION.size - os.path.getsize(path)))
+        self._fh = open(path, "r+b")
+        self._map = mmap.mmap(self._fh.fileno(), VERSION.size)
+
+    def read(self) -> Tuple[int, int]:
+        return VERSION.unpack_from(self._map, 0)
+
+    def bump(self, new_generation: bool = False) -> Tuple[int, int]:
+        """
+        Advance the counter. Callers hold the writer lock.
+        """
+        generation, appends = self.read()
+        version = (generation + 1, 0) if new_generation else (generation, appends + 1)
+        VERSION.pack_into(self._map, 0, *version)
+        return version
+
+
+class SharedMemory:
+    """
+    Shared product matrix (one row per product, base memory first, then the
+    user memory in file order) and flat ingredient matrix with its keys.
+    ``state.json`` records how many rows of each are published, how far into
+    the user memory JSONL they reach, and what base memory they came from.
+    """
+
+    def __init__(self, directory: str = SHARED_MEMORY_DIR):
+        self.directory = directory
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.lock_path = os.path.join(directory, "writer.lock")
+        self.state_path = os.path.join(directory, "state.json")
+        self.version = VersionCounter(os.path.join(directory, "version"))
+
+    def lock(self):
+        """
+        The single-writer lock. Hold it to publish rows.
+        """
+        return file_lock(self.lock_path)
+
+    def _path(self, generation: int, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.{generation}")
+
+    def read_state(self) -> Optional[Dict]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def _write_state(self, state: Dict) -> None:
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(state, fh)
+        os.replace(tmp_path, self.state_path)
+
+    def reset(self, source: str, products: np.ndarray, keys: List[str], ingredients: np.ndarray, user_offset: int) -> Dict:
+        """
+        Publish a complete new generation. Callers hold the writer lock.
+        """
+        old = self.read_state()
+        generation = self.version.read()[0] + 1
+        products = np.asarray(products, dtype=np.float32)
+        ingredients = np.asarray(ingredients, dtype=np.float32)
+        dim = max(products.shape[-1], ingredients.shape[-1])
+        if not dim:
+            raise ValueError("Cannot publish embedding matrices without a dimension.")
+        for name, matrix in (("products", products), ("ingredients", ingredients)):
+            path = self._path(generation, name)
+            if os.path.exists(path):
+                os.remove(path)
+            store = VectorStore(path, dim=dim)
+            if len(matrix):
+                store.append(matrix)
+        keys_path = self._path(generation, "keys")
+        with open(keys_path, "w", encoding="utf-8") as fh:
+            fh.write("".join(json.dumps(key) + "\n" for key in keys))
+        state = {
+            "generation": generation,
+            "source": source,
+            "user_offset": user_offset,
+            "products": len(products),
+            "ingredients": len(ingredients),
+            "keys_bytes": os.path.getsize(keys_path),
+        }
+        self._write_state(state)
+        self.version.bump(new_generation=True)
+        if old is not None:
+            self._remove_generations_before(old["generation"])
+        return state
+
+    def _remove_generations_before(self, keep: int) -> None:
+        """
+        Delete the files of generations older than ``keep``. Open maps keep
+        their pages alive; only new opens of those files fail.
+        """
+        for entry in os.listdir(self.directory):
+            name, _, generation = entry.partition(".")
+            if name in ("products", "ingredients", "keys") and generation.isdigit() and int(generation) < keep:
+                try:
+                    os.remove(os.path.join(self.directory, entry))
+                except OSError:
+                    pass
+
+    def append(self, products: np.ndarray, keys: List[str], ingredients: np.ndarray, user_offset: int) -> Dict:
+        """
+        Publish appended rows. Callers hold the writer lock. Rows are written
+        before the state that counts them, so readers never see a partial row.
+        """
+        state = dict(self.read_state())
+        generation = state["generation"]
+        if len(products):
+            store = VectorStore(self._path(generation, "products"))
+            store.truncate(state["products"])  # drop rows of an interrupted append
+            store.append(products)
+            state["products"] += len(products)
+        if keys:
+            store = VectorStore(self._path(generation, "ingredients"))
+            store.truncate(state["ingredients"])
+            store.append(ingredients)
+            keys_path = self._path(generation, "keys")
+            with open(keys_path, "r+b") as fh:
+                fh.truncate(state["keys_bytes"])
+                fh.seek(0, os.SEEK_END)
+                fh.write("".join(json.dumps(key) + "\n" for key in keys).encode("utf-8"))
+            state["ingredients"] += len(keys)
+            state["keys_bytes"] = os.path.getsize(keys_path)
+        state["user_offset"] = user_offset
+        self._write_state(state)
+        self.version.bump()
+        return state
+
+    def matrices(self, state: Dict) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Copy-on-write memory maps over the published rows. Pages are shared
+        with every other process mapping the same generation.
+        """
+        generation = state["generation"]
+        products = VectorStore(self._path(generation, "products")).matrix(copy_on_write=True)
+        ingredients = VectorStore(self._path(generation, "ingredients")).matrix(copy_on_write=True)
+        return products[: state["products"]], ingredients[: state["ingredients"]]
+
+    def read_keys(self, state: Dict, start: int = 0) -> Tuple[List[str], int]:
+        """
+        Ingredient keys published after byte ``start`` of the keys file.
+        Returns them and the byte offset to resume from.
+        """
+        end = state["keys_bytes"]
+        if end <= start:
+            return [], start
+        with open(self._path(state["generation"], "keys"), "rb") as fh:
+            fh.seek(start)
+            chunk = fh.read(end - start)
+        return [json.loads(line) for line in chunk.splitlines() if line.strip()], end
@@ -1,27 +1,36 @@
 """
 Store availability checker for UK retailers (Boots and Superdrug).
 Uses HTML scraping with BeautifulSoup to avoid heavy dependencies or APIs.
+
+Each retailer is a Retailer plugin. check_store_availability() queries every
+registered retailer concurrently through one pooled keep-alive session, so
+latency is that of the slowest store rather than the sum. Results are kept
+in a TTL cache; lookups that failed expire much sooner than successful ones.
+Pages themselves go through the shared persistent HTTP cache.
 """
 from __future__ import annotations
 
-import functools
 import re
-from typing import Dict, List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 from urllib.parse import quote_plus, urljoin
 
 import requests
 from bs4 import BeautifulSoup
 
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-    "(KHTML, like Gecko) Chrome/120.0 Safari/537.36",
-}
+from src import http_cache
+
+RESULT_TTL = 30 * 60
+ERROR_TTL = 60
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="store-check")
 
 
 def _fetch_html(url: str) -> BeautifulSoup:
-    response = requests.get(url, headers=HEADERS, timeout=8)
-    response.raise_for_status()
-    return BeautifulSoup(response.text, "lxml")
+    return BeautifulSoup(http_cache.cached_get_text(url, source="store"), "lxml")
 
 
 def _extract_price(text: str) -> str:
@@ -29,79 +38,186 @@ def _extract_price(text: str) -> str:
     return match.group(0) if match else text.strip()
 
 
-def check_boots_stock(product_name: str) -> Dict[str, object]:
+def _empty_result(store: str) -> Dict[str, object]:
+    return {"store": store, "available": False, "price": None, "link": None, "error": None}
+
+
+class Retailer:
+    """
+    One store to check. Subclasses (or instances) set the search URL
+    template and the CSS selectors for product links and prices; override
+    parse() for anything the selectors cannot express.
+    """
+
+    name = "Store"
+    base_url = ""
+    search_url = ""  # format string with a {query} placeholder
+    link_selectors: Sequence[str] = ()
+    price_selectors: Sequence[str] = ()
+    # By default a product link only counts as stock when it has an href.
+    available_without_href = False
+
+    def direct_result(self, product_name: str) -> Optional[Dict[str, object]]:
+        """
+        Answer without a request (e.g. a pasted store URL), or None.
+        """
+        return None
+
+    def parse(self, soup: BeautifulSoup, result: Dict[str, object]) -> Dict[str, object]:
+        link_el = None
+        for selector in self.link_selectors:
+            link_el = soup.select_one(selector)
+            if link_el is not None:
+                break
+        if link_el is not None:
+            href = link_el.get("href")
+            if href:
+                result["link"] = href if href.startswith("http") else urljoin(self.base_url, href)
+                result["available"] = True
+            elif self.available_without_href:
+                result["available"] = True
+
+        for selector in self.price_selectors:
+            price_el = soup.select_one(selector)
+            if price_el is not None:
+                result["price"] = _extract_price(price_el.get_text(" ", strip=True))
+                break
+        return result
+
+    def check(self, product_name: str) -> Dict[str, object]:
+        result = _empty_result(self.name)
+        if not product_name:
+            result["error"] = "No product name provided."
+            return result
+        direct = self.direct_result(product_name)
+        if direct is not None:
+            result.update(direct)
+            return result
+        try:
+            soup = _fetch_html(self.search_url.format(query=quote_plus(product_name)))
+        except requests.RequestException as exc:
+            result["error"] = str(exc)
+            return result
+        return self.parse(soup, result)
+
+
+class BootsRetailer(Retailer):
     """
     Boots search is heavily templated; use multiple selectors to detect tiles.
     If a direct Boots URL is passed, treat it as available.
     """
-    result = {"store": "Boots", "available": False, "price": None, "link": None, "error": None}
-    if not product_name:
-        result["error"] = "No product name provided."
-        return result
 
-    # If the user pasted a direct Boots URL, mark as available.
-    if product_name.startswith("http") and "boots.com" in product_name:
-        result.update({"available": True, "link": product_name})
-        return result
+    name = "Boots"
+    base_url = "https://www.boots.com"
+    search_url = "https://www.boots.com/search?searchTerm={query}"
+    link_selectors = ("a[data-productid]", "a[data-test='product-link']", "a[href*='/p/']")
+    price_selectors = ("[data-e2e='product-card-price']", ".product_price", ".price")
+    # Templated Boots tiles do not always carry the href on the matched
+    # anchor; a tile alone has always counted as a hit for Boots.
+    available_without_href = True
 
-    try:
-        url = f"https://www.boots.com/search?searchTerm={quote_plus(product_name)}"
-        soup = _fetch_html(url)
-    except requests.RequestException as exc:
-        result["error"] = str(exc)
-        return result
+    def direct_result(self, product_name: str) -> Optional[Dict[str, object]]:
+        if product_name.startswith("http") and "boots.com" in product_name:
+            return {"available": True, "link": product_name}
+        return None
 
-    # Try multiple selectors for product cards
-    candidates = soup.select("a[data-productid]") or soup.select("a[data-test='product-link']") or soup.select(
-        "a[href*='/p/']"
-    )
-    if candidates:
-        href = candidates[0].get("href")
-        if href:
-            result["link"] = href if href.startswith("http") else urljoin("https://www.boots.com", href)
-        result["available"] = True
-
-    price_el = (
-        soup.select_one("[data-e2e='product-card-price']")
-        or soup.select_one(".product_price")
-        or soup.select_one(".price")
-    )
-    if price_el:
-        result["price"] = _extract_price(price_el.get_text(" ", strip=True))
-    return result
 
+class SuperdrugRetailer(Retailer):
+    name = "Superdrug"
+    base_url = "https://www.superdrug.com"
+    search_url = "https://www.superdrug.com/search?text={query}"
+    link_selectors = ("a[data-test='product-tile']", "a[href*='/p/']")
+    price_selectors = ("[data-test='product-price']", ".price", ".ProductPrice")
+
+
+RETAILERS: List[Retailer] = [BootsRetailer(), SuperdrugRetailer()]
 
-def check_superdrug_stock(product_name: str) -> Dict[str, object]:
-    result = {"store": "Superdrug", "available": False, "price": None, "link": None, "error": None}
-    if not product_name:
-        result["error"] = "No product name provided."
-        return result
-    try:
-        url = f"https://www.superdrug.com/search?text={quote_plus(product_name)}"
-        soup = _fetch_html(url)
-    except requests.RequestException as exc:
-        result["error"] = str(exc)
-        return result
 
-    link_el = soup.select_one("a[data-test='product-tile']") or soup.select_one("a[href*='/p/']")
-    if link_el and link_el.get("href"):
-        href = link_el["href"]
-        result["link"] = href if href.startswith("http") else urljoin("https://www.superdrug.com", href)
-        result["available"] = True
+def register_retailer(retailer: Retailer) -> None:
+    """
+    Add a store to every availability check. Retailers run concurrently,
+    so a new store does not add to worst-case latency.
+    """
+    RETAILERS.append(retailer)
+    clear_cache()
+
+
+class TTLCache:
+    """
+    Small thread-safe cache whose entries expire. The TTL is chosen per
+    entry so failures can be retried sooner than successes.
+    """
+
+    def __init__(self, maxsize: int = 256, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self._clock = clock
+        self._entries: Dict[object, Tuple[float, object]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires <= self._clock():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl: float) -> None:
+        with self._lock:
+            if len(self._entries) >= self.maxsize and key not in self._entries:
+                now = self._clock()
+                for stale in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                    del self._entries[stale]
+                if len(self._entries) >= self.maxsize:
+                    # Drop whatever expires soonest.
+                    del self._entries[min(self._entries, key=lambda k: self._entries[k][0])]
+            self._entries[key] = (self._clock() + ttl, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
 
-    price_el = soup.select_one("[data-test='product-price']") or soup.select_one(".price") or soup.select_one(".ProductPrice")
-    if price_el:
-        result["price"] = _extract_price(price_el.get_text(" ", strip=True))
-    return result
+
+_CACHE = TTLCache()
+
+
+def clear_cache() -> None:
+    _CACHE.clear()
+
+
+def check_boots_stock(product_name: str) -> Dict[str, object]:
+    return BootsRetailer().check(product_name)
+
+
+def check_superdrug_stock(product_name: str) -> Dict[str, object]:
+    return SuperdrugRetailer().check(product_name)
 
 
-@functools.lru_cache(maxsize=64)
-def check_store_availability(product_name: str) -> List[Dict[str, object]]:
+def check_store_availability(product_name: str, retailers: Optional[Sequence[Retailer]] = None) -> List[Dict[str, object]]:
     """
-    Return a list of availability dicts for configured stores.
-    Cached to avoid repeated scraping during a single session.
+    Return a list of availability dicts for configured stores, in retailer
+    order. Stores are queried in parallel; results are cached for
+    RESULT_TTL seconds, or ERROR_TTL if any store failed.
     """
-    return [
-        check_boots_stock(product_name),
-        check_superdrug_stock(product_name),
-    ]
+    retailers = list(RETAILERS if retailers is None else retailers)
+    key = (product_name, tuple(retailer.name for retailer in retailers))
+    cached = _CACHE.get(key)
+    if cached is not None:
+        return [dict(item) for item in cached]
+
+    futures = [_EXECUTOR.submit(retailer.check, product_name) for retailer in retailers]
+    results = []
+    for retailer, future in zip(retailers, futures):
+        try:
+            results.append(future.result(timeout=http_cache.REQUEST_TIMEOUT * 2))
+        except FutureTimeout:
+            results.append({**_empty_result(retailer.name), "error": "Timed out."})
+        except Exception as exc:  # a plugin bug must not hide the other stores
+            results.append({**_empty_result(retailer.name), "error": str(exc)})
+
+    ttl = ERROR_TTL if any(item.get("error") for item in results) else RESULT_TTL
+    _CACHE.set(key, results, ttl)
+    return [dict(item) for item in results]
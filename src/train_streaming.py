@@ -0,0 +1,237 @@
+"""
+Out-of-core trainer for large labelled corpora.
+
+train_tfidf loads the whole CSV into pandas and keeps a TF-IDF vocabulary in
+memory. This trainer reads ingredients_multilabel.csv and any shard CSVs in
+chunks instead. It hashes tokens into a fixed feature space
+(HashingVectorizer, no vocabulary) and updates an SGD logistic-regression
+classifier with partial_fit, so memory stays flat however many rows there
+are.
+
+The result is a Pipeline with classes_, predict and predict_proba, so
+AnalysisEngine loads it like the TF-IDF model. To fold new labelled rows
+into an existing model without a full refit, use --update:
+
+    python src/train_streaming.py                              # main dataset
+    python src/train_streaming.py data/ingredients_multilabel.csv data/shards/*.csv
+    python src/train_streaming.py --update new_rows.csv        # incremental
+"""
+import argparse
+import os
+import sys
+import zlib
+
+# Make it possible to import `src.*` even when run as a module
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import Pipeline
+
+from src.preprocessing import join_ingredients_for_model
+
+
+# --------------------------
+# PATHS + SETTINGS
+# --------------------------
+DATA_PATH = os.path.join(PROJECT_ROOT, "data", "ingredients_multilabel.csv")
+MODEL_PATH = os.path.join(PROJECT_ROOT, "models", "tfidf_streaming_model.joblib")
+
+CHUNK_SIZE = 50_000
+N_FEATURES = 2 ** 20
+EXPECTED_CLASSES = 10
+# Rows whose text hashes into this bucket (out of 100) are held out.
+HOLDOUT_PERCENT = 10
+RANDOM_STATE = 42
+
+
+# --------------------------
+# STREAMING DATA
+# --------------------------
+def iter_chunks(paths, chunk_size: int = CHUNK_SIZE):
+    """
+    Yield (texts, labels) per chunk across every CSV in ``paths``, already
+    cleaned for the model. Incomplete rows are dropped.
+    """
+    for path in paths:
+        for chunk in pd.read_csv(path, usecols=["ingredients", "label"], chunksize=chunk_size):
+            chunk = chunk.dropna(subset=["ingredients", "label"])
+            if chunk.empty:
+                continue
+            texts = [join_ingredients_for_model(str(text).strip()) for text in chunk["ingredients"]]
+            labels = chunk["label"].astype(str).str.strip().to_numpy()
+            yield np.asarray(texts, dtype=object), labels
+
+
+def scan_classes(paths, chunk_size: int = CHUNK_SIZE):
+    """
+    Distinct labels across all files. Reads only the label column.
+    partial_fit needs the full class list on its first call.
+    """
+    classes = set()
+    for path in paths:
+        for chunk in pd.read_csv(path, usecols=["label"], chunksize=chunk_size):
+            classes.update(chunk["label"].dropna().astype(str).str.strip())
+    return np.array(sorted(classes))
+
+
+def is_holdout(texts, percent: int = HOLDOUT_PERCENT) -> np.ndarray:
+    """
+    Deterministic holdout split by text hash. The same row lands on the
+    same side in every run and every chunking.
+    """
+    return np.array([zlib.crc32(text.encode("utf-8")) % 100 < percent for text in texts], dtype=bool)
+
+
+# --------------------------
+# MODEL
+# --------------------------
+def build_streaming_model(alpha: float = 1e-5):
+    """
+    Stateless hashing features + SGD logistic regression (predict_proba).
+    """
+    return Pipeline(
+        steps=[
+            (
+                "hashing",
+                HashingVectorizer(
+                    ngram_range=(1, 2),
+                    n_features=N_FEATURES,
+                    alternate_sign=False,
+                    norm="l2",
+                ),
+            ),
+            (
+                "clf",
+                SGDClassifier(
+                    loss="log_loss",
+                    alpha=alpha,
+                    random_state=RANDOM_STATE,
+                ),
+            ),
+        ]
+    )
+
+
+def macro_f1(confusion: np.ndarray) -> float:
+    """
+    Macro-F1 from a confusion matrix (rows: true, columns: predicted). Like
+    sklearn, classes absent from both truth and predictions are left out.
+    """
+    tp = np.diag(confusion).astype(np.float64)
+    true, predicted = confusion.sum(axis=1), confusion.sum(axis=0)
+    present = (true + predicted) > 0
+    if not present.any():
+        return 0.0
+    return float(np.mean(2 * tp[present] / (true + predicted)[present]))
+
+
+def partial_fit_chunks(model, chunks, classes=None, holdout_percent: int = HOLDOUT_PERCENT):
+    """
+    One pass of partial_fit over ``chunks``. Each chunk's holdout rows are
+    scored once the chunk has been trained on, and only a confusion matrix
+    is kept, so memory stays flat. Returns (training rows seen, holdout
+    macro-F1 or None).
+    """
+    vectorizer, clf = model.named_steps["hashing"], model.named_steps["clf"]
+    rng = np.random.RandomState(RANDOM_STATE)
+    seen = 0
+    confusion = None
+    for texts, labels in chunks:
+        held = is_holdout(texts, holdout_percent) if holdout_percent else np.zeros(len(texts), dtype=bool)
+        train = np.flatnonzero(~held)
+        if len(train):
+            # Shuffle within the chunk; files are often sorted by label.
+            train = rng.permutation(train)
+            X = vectorizer.transform(texts[train])
+            if hasattr(clf, "classes_"):
+                clf.partial_fit(X, labels[train])
+            else:
+                clf.partial_fit(X, labels[train], classes=classes)
+            seen += len(train)
+        if not held.any() or not hasattr(clf, "classes_"):
+            continue
+        index = {label: i for i, label in enumerate(clf.classes_)}
+        if confusion is None:
+            confusion = np.zeros((len(index), len(index)), dtype=np.int64)
+        truth = np.array([index[label] for label in labels[held]])
+        predicted = np.array([index[label] for label in model.predict(texts[held])])
+        np.add.at(confusion, (truth, predicted), 1)
+
+    if confusion is None:
+        return seen, None
+    return seen, macro_f1(confusion)
+
+
+def check_contract(model) -> None:
+    """
+    Same check as AnalysisEngine._load_model, run before saving.
+    """
+    classes = getattr(model, "classes_", [])
+    if len(classes) != EXPECTED_CLASSES:
+        raise ValueError(f"Expected a {EXPECTED_CLASSES}-class model but the data has {len(classes)} classes: {list(classes)}")
+
+
+# --------------------------
+# TRAIN / UPDATE
+# --------------------------
+def train_streaming(paths=None, output: str = MODEL_PATH, epochs: int = 1, chunk_size: int = CHUNK_SIZE, update: bool = False):
+    """
+    Stream ``paths`` (default: the labelled CSV) through partial_fit for
+    ``epochs`` passes and save the model. With ``update`` the model at
+    ``output`` is loaded and trained further on ``paths`` only.
+    """
+    paths = list(paths or [DATA_PATH])
+    if update:
+        print(f"📥 Updating model from: {output}")
+        model = joblib.load(output)
+        if "hashing" not in model.named_steps:
+            raise ValueError(f"{output} is not a streaming model; --update needs one trained by this script.")
+        classes = model.classes_
+        unknown = set(scan_classes(paths, chunk_size)) - set(classes)
+        if unknown:
+            raise ValueError(f"New rows use labels the model was not trained on: {sorted(unknown)}")
+    else:
+        model = build_streaming_model()
+        classes = scan_classes(paths, chunk_size)
+        if len(classes) != EXPECTED_CLASSES:
+            raise ValueError(f"Expected {EXPECTED_CLASSES} labels in the data, found {len(classes)}: {list(classes)}")
+
+    print(f"🚀 Streaming {len(paths)} file(s) in chunks of {chunk_size} rows, {epochs} epoch(s)...")
+    for epoch in range(epochs):
+        seen, macro_f1 = partial_fit_chunks(model, iter_chunks(paths, chunk_size), classes=classes)
+        score = f"{macro_f1:.3f}" if macro_f1 is not None else "n/a"
+        print(f"  epoch {epoch + 1}: {seen} training rows, holdout macro-F1 {score}")
+
+    check_contract(model)
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    tmp_path = f"{output}.{os.getpid()}.tmp"
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, output)
+    print(f"✅ Model saved to: {output}")
+    return model
+
+
+# --------------------------
+# MAIN
+# --------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Out-of-core hashing + SGD trainer.")
+    parser.add_argument("paths", nargs="*", help="Labelled CSVs (ingredients,label). Default: the main dataset.")
+    parser.add_argument("--output", default=MODEL_PATH)
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--update", action="store_true", help="Continue training the model at --output on the given rows.")
+    args = parser.parse_args(argv)
+    if args.update and not args.paths:
+        parser.error("--update needs the CSVs holding the new rows.")
+    train_streaming(args.paths, output=args.output, epochs=args.epochs, chunk_size=args.chunk_size, update=args.update)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,29 @@
+import argparse
+import hashlib
+import itertools
+import json
+import math
 import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 # Make it possible to import `src.*` even when run as a module
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
 sys.path.append(PROJECT_ROOT)
 
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
+import sklearn
+from sklearn.model_selection import StratifiedKFold, train_test_split
 from sklearn.pipeline import Pipeline
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import classification_report, confusion_matrix
+from sklearn.metrics import classification_report, confusion_matrix, f1_score
 import joblib
 
+from src.compiled_model import compact_path, export_compact
 from src.preprocessing import join_ingredients_for_model
 
 
@@ -22,13 +32,73 @@ from src.preprocessing import join_ingredients_for_model
 # --------------------------
 DATA_PATH = os.path.join(PROJECT_ROOT, "data", "ingredients_multilabel.csv")
 MODEL_PATH = os.path.join(PROJECT_ROOT, "models", "tfidf_multiclass_model.joblib")
+CACHE_DIR = os.path.join(PROJECT_ROOT, "models", "train_cache")
+SEARCH_RESULTS_PATH = os.path.join(PROJECT_ROOT, "models", "search_results.json")
+# Memory-mapped float32 copy of MODEL_PATH that the engine and CLI load instead.
+COMPACT_MODEL_PATH = compact_path(MODEL_PATH)
+
+# Bump when join_ingredients_for_model changes so cached corpora are rebuilt.
+PREPROCESS_VERSION = 1
+RANDOM_STATE = 42
+
+DEFAULT_VECTORIZER = {"ngram_range": (1, 2), "max_features": 20000, "min_df": 2, "max_df": 0.95}
+DEFAULT_CLASSIFIER = {"C": 1.0, "max_iter": 600}
+
+# Search space: every vectoriser config is crossed with every classifier config.
+VECTORIZER_GRID = {
+    "ngram_range": [(1, 1), (1, 2)],
+    "max_features": [20000, 100000],
+    "min_df": [2],
+    "max_df": [0.95],
+    "sublinear_tf": [False, True],
+}
+CLASSIFIER_GRID = {"C": [0.3, 1.0, 3.0], "max_iter": [600]}
 
 
 # --------------------------
 # LOAD + CLEAN DATA
 # --------------------------
-def load_data():
+def data_hash(path: str = DATA_PATH) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _preprocess_chunk(texts):
+    return [join_ingredients_for_model(text) for text in texts]
+
+
+def preprocess_texts(texts, workers: int = 1, chunk_size: int = 50000):
+    """
+    join_ingredients_for_model over many rows, split across processes.
+    """
+    texts = list(texts)
+    if workers <= 1 or len(texts) <= chunk_size:
+        return _preprocess_chunk(texts)
+    chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [text for chunk in pool.map(_preprocess_chunk, chunks) for text in chunk]
+
+
+def corpus_path(cache_dir: str, digest: str) -> str:
+    return os.path.join(cache_dir, f"corpus-{digest[:16]}-v{PREPROCESS_VERSION}.joblib")
+
+
+def load_data(cache_dir: str = CACHE_DIR, workers: int = 1, digest: str = None):
+    """
+    Cleaned dataset with a "text_for_model" column. The preprocessed corpus
+    is cached under ``cache_dir`` keyed by the CSV's content hash, so
+    repeated experiments skip tokenisation entirely. Pass ``digest`` when
+    the hash is already known.
+    """
     print(f"📥 Loading dataset from: {DATA_PATH}")
+    cache_path = corpus_path(cache_dir, digest or data_hash())
+    if os.path.exists(cache_path):
+        df = joblib.load(cache_path)
+        print(f"✅ Loaded {len(df)} preprocessed rows from cache.")
+        return df
 
     df = pd.read_csv(DATA_PATH)
 
@@ -38,7 +108,11 @@ def load_data():
     df["label"] = df["label"].astype(str).str.strip()
 
     # Preprocess each ingredient list for modelling
-    df["text_for_model"] = df["ingredients"].apply(join_ingredients_for_model)
+    df["text_for_model"] = preprocess_texts(df["ingredients"].tolist(), workers=workers)
+    df = df.reset_index(drop=True)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    joblib.dump(df, cache_path)
 
     print(f"✅ Loaded {len(df)} rows.")
     print("Classes:", df["label"].unique())
@@ -48,29 +122,25 @@ def load_data():
 # --------------------------
 # BUILD PIPELINE
 # --------------------------
-def build_model():
+def _vectorizer(params=None, **overrides):
+    params = {**DEFAULT_VECTORIZER, **(params or {}), **overrides}
+    params["ngram_range"] = tuple(params["ngram_range"])
+    return TfidfVectorizer(**params)
+
+
+def _classifier(params=None, **overrides):
+    params = {**DEFAULT_CLASSIFIER, **(params or {}), **overrides}
+    return LogisticRegression(multi_class="multinomial", random_state=RANDOM_STATE, **params)
+
+
+def build_model(vectorizer_params=None, classifier_params=None):
     """
     TF-IDF + Logistic Regression for 10 classes.
     """
     pipeline = Pipeline(
         steps=[
-            (
-                "tfidf",
-                TfidfVectorizer(
-                    ngram_range=(1, 2),
-                    max_features=20000,
-                    min_df=2,
-                    max_df=0.95,
-                ),
-            ),
-            (
-                "clf",
-                LogisticRegression(
-                    max_iter=600,
-                    multi_class="multinomial",
-                    n_jobs=-1,
-                ),
-            ),
+            ("tfidf", _vectorizer(vectorizer_params)),
+            ("clf", _classifier(classifier_params, n_jobs=-1)),
         ]
     )
     return pipeline
@@ -111,10 +181,270 @@ def train_and_evaluate():
     joblib.dump(model, MODEL_PATH)
 
     print(f"\n✅ Model saved to: {MODEL_PATH}")
+    export_compact_model(model, list(X_test[:200]))
+
+
+# --------------------------
+# CACHED HYPERPARAMETER SEARCH
+# --------------------------
+def _grid(space):
+    keys = sorted(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def _config_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=list).encode("utf-8")).hexdigest()[:20]
+
+
+def _vectorise_fold(vectorizer_params, train_texts, y_train, val_texts, y_val, out_path):
+    """
+    Fit the vectoriser on one training fold and cache both matrices.
+    Runs in a worker process on the fold's own arrays; returns the cache path.
+    """
+    vectorizer = _vectorizer(vectorizer_params)
+    started = time.perf_counter()
+    X_train = vectorizer.fit_transform(train_texts)
+    fit_seconds = time.perf_counter() - started
+    X_val = vectorizer.transform(val_texts)
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    joblib.dump(
+        {
+            "X_train": X_train.astype(np.float32),
+            "y_train": y_train,
+            "X_val": X_val.astype(np.float32),
+            "y_val": y_val,
+            "fit_seconds": fit_seconds,
+        },
+        tmp_path,
+    )
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def _evaluate_fold(matrix_path, classifier_params, max_train_rows):
+    """
+    Fit the classifier on cached fold matrices (optionally a prefix of the
+    training rows) and score it. Runs in a worker process.
+    """
+    data = joblib.load(matrix_path, mmap_mode="r")
+    X_train, y_train = data["X_train"], data["y_train"]
+    if max_train_rows and max_train_rows < X_train.shape[0]:
+        # Fold rows are in stratified order (_folds), so a prefix is a
+        # stratified random subsample that holds every class.
+        X_train, y_train = X_train[:max_train_rows], y_train[:max_train_rows]
+    clf = _classifier(classifier_params, n_jobs=1)
+    started = time.perf_counter()
+    clf.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    y_pred = clf.classes_[np.argmax(clf.predict_proba(data["X_val"]), axis=1)]
+    predict_seconds = time.perf_counter() - started
+    return {
+        "macro_f1": float(f1_score(data["y_val"], y_pred, average="macro")),
+        "fit_seconds": fit_seconds + data["fit_seconds"],
+        "predict_ms_per_1k": 1e6 * predict_seconds / max(1, data["X_val"].shape[0]),
+    }
+
+
+def _stratified_order(indices, labels, rng):
+    """
+    Shuffle ``indices`` so that every prefix is stratified: each class's
+    rows are spread evenly over the order, and the first rows hold one of
+    every class.
+    """
+    indices = rng.permutation(indices)
+    position = np.empty(len(indices))
+    for label in np.unique(labels[indices]):
+        members = np.flatnonzero(labels[indices] == label)
+        position[members] = np.arange(len(members)) / len(members)
+    # Random tie-break between classes at the same relative position.
+    return indices[np.lexsort((rng.random_sample(len(indices)), position))]
+
+
+def _folds(labels, n_splits):
+    counts = pd.Series(labels).value_counts()
+    n_splits = max(2, min(n_splits, int(counts.min())))
+    splitter = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=RANDOM_STATE)
+    rng = np.random.RandomState(RANDOM_STATE)
+    folds = []
+    for train_idx, val_idx in splitter.split(np.zeros(len(labels)), labels):
+        folds.append((_stratified_order(train_idx, labels, rng), val_idx))
+    return folds
+
+
+def search(
+    mode: str = "halving",
+    n_splits: int = 5,
+    workers: int = None,
+    factor: int = 3,
+    vectorizer_grid=None,
+    classifier_grid=None,
+    cache_dir: str = CACHE_DIR,
+    results_path: str = SEARCH_RESULTS_PATH,
+):
+    """
+    Cross-validated search over vectoriser x classifier configs.
+
+    Vectoriser fits are cached per (data hash, params, fold), so every
+    classifier config and every later run reuses them. "grid" scores every
+    config on full folds. "halving" (successive halving) starts all configs
+    on a stratified 1/factor^k sample of each training fold and keeps the
+    best 1/factor each round until the survivors run on full folds. Fits
+    run in a process pool. Returns the ranked results, which are also written to
+    ``results_path`` with what is needed to reproduce them.
+    """
+    workers = workers or os.cpu_count() or 1
+    digest = data_hash()
+    df = load_data(cache_dir=cache_dir, workers=workers, digest=digest)
+    texts = df["text_for_model"].values
+    labels = df["label"].values
+    folds = _folds(labels, n_splits)
+    vectorizer_configs = _grid(vectorizer_grid or VECTORIZER_GRID)
+    classifier_configs = _grid(classifier_grid or CLASSIFIER_GRID)
+    candidates = [(v, c) for v in vectorizer_configs for c in classifier_configs]
+    print(f"🔎 {mode} search: {len(candidates)} configs x {len(folds)} folds on {workers} workers")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        matrix_paths = {}
+        jobs = []
+        for v_index, params in enumerate(vectorizer_configs):
+            for fold, (train_idx, val_idx) in enumerate(folds):
+                key = _config_key(digest, PREPROCESS_VERSION, params, RANDOM_STATE, len(folds), fold, "stratified")
+                out_path = os.path.join(cache_dir, f"tfidf-{key}.joblib")
+                matrix_paths[(v_index, fold)] = out_path
+                if os.path.exists(out_path):
+                    continue
+                # Each job gets only its fold's rows, not the whole corpus.
+                fold_data = (texts[train_idx], labels[train_idx], texts[val_idx], labels[val_idx])
+                jobs.append(pool.submit(_vectorise_fold, params, *fold_data, out_path))
+        for job in jobs:
+            job.result()
+        print(f"🧮 {len(matrix_paths)} fold matrices ready ({len(jobs)} built)")
+
+        train_rows = min(len(train_idx) for train_idx, _ in folds)
+        if mode == "halving":
+            rounds = max(1, math.ceil(math.log(len(candidates), factor))) if len(candidates) > 1 else 1
+            budgets = [max(len(set(labels)) * 10, train_rows // factor ** (rounds - 1 - r)) for r in range(rounds)]
+        elif mode == "grid":
+            budgets = [train_rows]
+        else:
+            raise ValueError(f"Unknown search mode: {mode}")
+
+        survivors = list(range(len(candidates)))
+        results = []
+        for round_index, budget in enumerate(budgets):
+            budget = min(budget, train_rows)
+            futures = {
+                (i, fold): pool.submit(
+                    _evaluate_fold,
+                    matrix_paths[(vectorizer_configs.index(candidates[i][0]), fold)],
+                    candidates[i][1],
+                    budget,
+                )
+                for i in survivors
+                for fold in range(len(folds))
+            }
+            round_results = []
+            for i in survivors:
+                scores = [futures[(i, fold)].result() for fold in range(len(folds))]
+                f1s = [score["macro_f1"] for score in scores]
+                round_results.append(
+                    {
+                        "vectorizer": candidates[i][0],
+                        "classifier": candidates[i][1],
+                        "round": round_index,
+                        "train_rows": budget,
+                        "macro_f1": float(np.mean(f1s)),
+                        "macro_f1_std": float(np.std(f1s)),
+                        "fit_seconds": float(np.mean([score["fit_seconds"] for score in scores])),
+                        "predict_ms_per_1k": float(np.mean([score["predict_ms_per_1k"] for score in scores])),
+                        "_index": i,
+                    }
+                )
+            # Ties go to the earlier candidate, never to timing, so reruns
+            # pick the same survivors and the same best model. F1 is rounded
+            # so summation noise does not count as a difference.
+            round_results.sort(key=lambda item: (-round(item["macro_f1"], 9), item["_index"]))
+            results.extend(round_results)
+            best = round_results[0]
+            print(f"  round {round_index}: {len(survivors)} configs on {budget} rows, best macro-F1 {best['macro_f1']:.3f}")
+            survivors = [item["_index"] for item in round_results[: max(1, len(round_results) // factor)]]
+
+    final_round = max(item["round"] for item in results)
+    ranked = [item for item in results if item["round"] == final_round] + [item for item in results if item["round"] != final_round]
+    for item in results:
+        item.pop("_index", None)
+
+    report = {
+        "data_hash": digest,
+        "rows": int(len(df)),
+        "mode": mode,
+        "folds": len(folds),
+        "random_state": RANDOM_STATE,
+        "sklearn_version": sklearn.__version__,
+        "results": ranked,
+    }
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    with open(results_path, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2, default=list)
+    print(f"📝 Search results written to: {results_path}")
+    return ranked
+
+
+def train_best(results, df=None):
+    """
+    Refit the top-ranked config on every row and save it to MODEL_PATH.
+    """
+    best = results[0]
+    df = load_data() if df is None else df
+    model = build_model(best["vectorizer"], best["classifier"])
+    model.fit(df["text_for_model"].values, df["label"].values)
+    os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+    joblib.dump(model, MODEL_PATH)
+    print(f"✅ Best config (macro-F1 {best['macro_f1']:.3f}) saved to: {MODEL_PATH}")
+    export_compact_model(model, list(df["text_for_model"].values[:200]))
+    return model
+
+
+def export_compact_model(model=None, probe_texts=None, path: str = COMPACT_MODEL_PATH):
+    """
+    Write the compact artefact for ``model`` (default: the saved pipeline),
+    checked against the pipeline on ``probe_texts``. A stale artefact is
+    removed if the export fails, so loaders fall back to the joblib file.
+    """
+    model = joblib.load(MODEL_PATH) if model is None else model
+    if probe_texts is None:
+        probe_texts = list(load_data()["text_for_model"].values[:200])
+    if export_compact(model, path, probe_texts) is None:
+        if os.path.exists(path):
+            os.remove(path)
+        print("⚠️ Model could not be exported compactly; the joblib pipeline will be used.")
+        return None
+    print(f"📦 Compact model exported to: {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    return path
 
 
 # --------------------------
 # MAIN
 # --------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the TF-IDF ingredient classifier.")
+    parser.add_argument("--search", choices=["grid", "halving"], help="Run a cross-validated search and save the best model.")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--factor", type=int, default=3, help="Successive halving elimination factor.")
+    parser.add_argument("--export-only", action="store_true", help="Only export the saved model as a compact artefact.")
+    args = parser.parse_args(argv)
+
+    if args.export_only:
+        export_compact_model()
+    elif args.search:
+        results = search(mode=args.search, n_splits=args.folds, workers=args.workers, factor=args.factor)
+        train_best(results)
+    else:
+        train_and_evaluate()
+
+
 if __name__ == "__main__":
-    train_and_evaluate()
+    main()
@@ -0,0 +1,458 @@
+"""
+Pure NumPy vector indexes for cosine-similarity search over product and
+ingredient embeddings.
+
+- ExactIndex: brute force over pre-normalised vectors (the reference result).
+- IVFIndex: inverted-file index. A spherical k-means quantiser splits the
+  vectors into lists and a query only scores the `nprobe` closest lists.
+  Raising nprobe trades latency for recall; nprobe == n_lists is exact.
+- Float16Index / Int8Index: brute force over quantised copies of the
+  vectors (half the memory, or a quarter plus one scale per vector).
+  Candidates are scored on the codes chunk by chunk, then the top
+  ``rerank`` * k are re-scored in float32 against the original matrix when
+  search() is given it (usually memory-mapped, so only the candidate rows
+  are read).
+
+All support incremental add() and save()/load() to a single .npz file.
+benchmark() compares their memory and recall@k with exact search:
+
+    python -m src.vector_index models/ingredient_embeddings.pt
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def normalise(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Row-wise top-k of a 2D score matrix, sorted by descending score.
+    """
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.float32), empty.astype(np.int64)
+    if k < scores.shape[1]:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+    return np.take_along_axis(part_scores, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+
+class ExactIndex:
+    """
+    Brute-force cosine search. Vectors are normalised once on insert so a
+    search is a single matrix product.
+    """
+
+    kind = "exact"
+
+    def __init__(self, dim: int):
+        self.dim = int(dim)
+        self._vectors = np.empty((0, self.dim), dtype=np.float32)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[: self._size]
+
+    def _append_vectors(self, vectors: np.ndarray) -> None:
+        needed = self._size + vectors.shape[0]
+        if needed > self._vectors.shape[0]:
+            grown = np.empty((max(needed, 2 * self._vectors.shape[0], 64), self.dim), dtype=np.float32)
+            grown[: self._size] = self._vectors[: self._size]
+            self._vectors = grown
+        self._vectors[self._size : needed] = vectors
+        self._size = needed
+
+    def add(self, vectors: np.ndarray) -> None:
+        vectors = normalise(vectors)
+        if vectors.size:
+            self._append_vectors(vectors)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (scores, ids), each of shape (Q, min(k, len(self))).
+        """
+        queries = normalise(queries)
+        if self._size == 0:
+            return _top_k(np.empty((queries.shape[0], 0), dtype=np.float32), k)
+        return _top_k(queries @ self.vectors.T, k)
+
+    def _state(self) -> dict:
+        return {"vectors": self.vectors}
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as fh:
+            np.savez(fh, kind=np.array(self.kind), dim=np.array(self.dim), **self._state())
+
+    @classmethod
+    def _from_state(cls, dim: int, state) -> "ExactIndex":
+        index = cls(dim)
+        index._append_vectors(state["vectors"])
+        return index
+
+
+class IVFIndex(ExactIndex):
+    """
+    Inverted-file index over normalised vectors. Call train() (or add() a
+    first batch, which trains on it) before searching.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, dim: int, n_lists: Optional[int] = None, nprobe: int = 8, seed: int = 0):
+        super().__init__(dim)
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._lists: Optional[list] = None
+
+    def train(self, vectors: np.ndarray, iterations: int = 10, sample_size: int = 100_000) -> None:
+        """
+        Fit the coarse quantiser with spherical k-means on (a sample of) vectors.
+        """
+        vectors = normalise(vectors)
+        rng = np.random.default_rng(self.seed)
+        if vectors.shape[0] > sample_size:
+            vectors = vectors[rng.choice(vectors.shape[0], sample_size, replace=False)]
+        n_lists = self.n_lists or max(1, int(np.sqrt(vectors.shape[0])))
+        n_lists = min(n_lists, vectors.shape[0])
+        self.n_lists = n_lists
+
+        centroids = vectors[rng.choice(vectors.shape[0], n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assign = self._assign(vectors, centroids)
+            for c in range(n_lists):
+                members = vectors[assign == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids = normalise(centroids)
+        self.centroids = centroids
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 16_384) -> np.ndarray:
+        out = np.empty(vectors.shape[0], dtype=np.int32)
+        for start in range(0, vectors.shape[0], chunk):
+            out[start : start + chunk] = np.argmax(vectors[start : start + chunk] @ centroids.T, axis=1)
+        return out
+
+    def add(self, vectors: np.ndarray) -> None:
+        vectors = normalise(vectors)
+        if not vectors.size:
+            return
+        if self.centroids is None:
+            self.train(vectors)
+        self._assignments = np.concatenate([self._assignments, self._assign(vectors, self.centroids)])
+        self._append_vectors(vectors)
+        self._lists = None
+
+    def _inverted_lists(self) -> list:
+        if self._lists is None:
+            order = np.argsort(self._assignments, kind="stable")
+            bounds = np.searchsorted(self._assignments[order], np.arange(self.n_lists + 1))
+            self._lists = [order[bounds[c] : bounds[c + 1]] for c in range(self.n_lists)]
+        return self._lists
+
+    def search(self, queries: np.ndarray, k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = normalise(queries)
+        if self._size == 0 or self.centroids is None:
+            return super().search(queries, k)
+
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        lists = self._inverted_lists()
+        _, probes = _top_k(queries @ self.centroids.T, nprobe)
+
+        k_eff = min(k, self._size)
+        scores = np.full((queries.shape[0], k_eff), -np.inf, dtype=np.float32)
+        ids = np.full((queries.shape[0], k_eff), -1, dtype=np.int64)
+        for row, probe in enumerate(probes):
+            candidates = np.concatenate([lists[c] for c in probe])
+            if not len(candidates):
+                continue
+            cand_scores, cand_pos = _top_k((self._vectors[candidates] @ queries[row])[None, :], k_eff)
+            n = cand_scores.shape[1]
+            scores[row, :n] = cand_scores[0]
+            ids[row, :n] = candidates[cand_pos[0]]
+        return scores, ids
+
+    def _state(self) -> dict:
+        return {
+            "vectors": self.vectors,
+            "centroids": self.centroids if self.centroids is not None else np.empty((0, self.dim), dtype=np.float32),
+            "assignments": self._assignments,
+            "params": np.array([self.n_lists or 0, self.nprobe, self.seed]),
+        }
+
+    @classmethod
+    def _from_state(cls, dim: int, state) -> "IVFIndex":
+        n_lists, nprobe, seed = (int(v) for v in state["params"])
+        index = cls(dim, n_lists=n_lists or None, nprobe=nprobe, seed=seed)
+        if state["centroids"].size:
+            index.centroids = state["centroids"]
+        index._assignments = state["assignments"].astype(np.int32)
+        index._append_vectors(state["vectors"])
+        return index
+
+
+class QuantizedIndex(ExactIndex):
+    """
+    Brute-force search over quantised normalised vectors. Subclasses set the
+    code dtype and how rows are encoded. The float32 vectors are not kept.
+    """
+
+    kind = ""
+    code_dtype = np.float16
+    # Per-row float32 scale stored next to the codes (int8 only).
+    scaled = False
+    # Rows are encoded and scored this many at a time, bounding the float32
+    # temporaries of add() and search().
+    chunk_rows = 65_536
+
+    def __init__(self, dim: int, rerank: int = 4):
+        super().__init__(dim)
+        self.rerank = rerank
+        self._vectors = np.empty((0, self.dim), dtype=self.code_dtype)
+        self._scales = np.empty(0, dtype=np.float32) if self.scaled else None
+
+    @property
+    def nbytes(self) -> int:
+        scales = self._scales[: self._size].nbytes if self.scaled else 0
+        return self._vectors[: self._size].nbytes + scales
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        return vectors.astype(self.code_dtype), None
+
+    def _decode(self, start: int, stop: int) -> np.ndarray:
+        rows = self._vectors[start:stop].astype(np.float32)
+        return rows * self._scales[start:stop, None] if self.scaled else rows
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """
+        Dequantised float32 copy of the stored vectors.
+        """
+        return self._decode(0, self._size)
+
+    def _append_codes(self, codes: np.ndarray, scales: Optional[np.ndarray]) -> None:
+        needed = self._size + codes.shape[0]
+        if needed > self._vectors.shape[0]:
+            capacity = max(needed, 2 * self._vectors.shape[0], 64)
+            grown = np.empty((capacity, self.dim), dtype=self.code_dtype)
+            grown[: self._size] = self._vectors[: self._size]
+            self._vectors = grown
+            if self.scaled:
+                grown_scales = np.empty(capacity, dtype=np.float32)
+                grown_scales[: self._size] = self._scales[: self._size]
+                self._scales = grown_scales
+        self._vectors[self._size : needed] = codes
+        if self.scaled:
+            self._scales[self._size : needed] = scales
+        self._size = needed
+
+    def _append_vectors(self, vectors: np.ndarray) -> None:
+        self._append_codes(*self._encode(vectors))
+
+    def add(self, vectors) -> None:
+        """
+        Quantise and append ``vectors`` (any row-sliceable matrix, e.g. a
+        memory map) chunk by chunk, never normalising it all at once.
+        """
+        if isinstance(vectors, np.ndarray) and vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        for start in range(0, len(vectors), self.chunk_rows):
+            super().add(np.asarray(vectors[start : start + self.chunk_rows]))
+
+    def _candidates(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k over the codes, keeping a running top-k per chunk so at most
+        a (Q, chunk_rows) score block exists at a time.
+        """
+        best_scores = np.empty((queries.shape[0], 0), dtype=np.float32)
+        best_ids = np.empty((queries.shape[0], 0), dtype=np.int64)
+        for start in range(0, self._size, self.chunk_rows):
+            stop = min(start + self.chunk_rows, self._size)
+            scores = queries @ self._vectors[start:stop].astype(np.float32).T
+            if self.scaled:
+                scores *= self._scales[start:stop]
+            chunk_scores, chunk_ids = _top_k(scores, k)
+            merged_scores = np.concatenate([best_scores, chunk_scores], axis=1)
+            merged_ids = np.concatenate([best_ids, chunk_ids + start], axis=1)
+            best_scores, pos = _top_k(merged_scores, k)
+            best_ids = np.take_along_axis(merged_ids, pos, axis=1)
+        return best_scores, best_ids
+
+    def search(self, queries: np.ndarray, k: int, source=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (scores, ids) like ExactIndex.search. With ``source`` (the
+        float32 vectors this index was built from, same row order; anything
+        that gathers rows by an id array) the top ``rerank`` * k
+        candidates are re-scored exactly.
+        """
+        queries = normalise(queries)
+        if self._size == 0:
+            return _top_k(np.empty((queries.shape[0], 0), dtype=np.float32), k)
+        if source is None or self.rerank <= 1:
+            return self._candidates(queries, k)
+
+        _, candidates = self._candidates(queries, k * self.rerank)
+        k_eff = min(k, candidates.shape[1])
+        scores = np.empty((queries.shape[0], k_eff), dtype=np.float32)
+        ids = np.empty((queries.shape[0], k_eff), dtype=np.int64)
+        for row, cand in enumerate(candidates):
+            cand = np.sort(cand)  # ascending row order reads a memory map sequentially
+            exact = normalise(np.asarray(source[cand]))
+            row_scores, pos = _top_k((exact @ queries[row])[None, :], k_eff)
+            scores[row], ids[row] = row_scores[0], cand[pos[0]]
+        return scores, ids
+
+    def _state(self) -> dict:
+        state = {"codes": self._vectors[: self._size], "params": np.array([self.rerank])}
+        if self.scaled:
+            state["scales"] = self._scales[: self._size]
+        return state
+
+    @classmethod
+    def _from_state(cls, dim: int, state) -> "QuantizedIndex":
+        index = cls(dim, rerank=int(state["params"][0]))
+        index._append_codes(state["codes"], state["scales"] if cls.scaled else None)
+        return index
+
+
+class Float16Index(QuantizedIndex):
+    """
+    Half-precision codes: 2 bytes per dimension, no scales.
+    """
+
+    kind = "float16"
+    code_dtype = np.float16
+
+
+class Int8Index(QuantizedIndex):
+    """
+    Symmetric per-vector int8: each row is stored as round(v / s) with
+    s = max|v| / 127, so a row costs dim bytes plus one float32 scale.
+    """
+
+    kind = "int8"
+    code_dtype = np.int8
+    scaled = True
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        scales = np.maximum(np.abs(vectors).max(axis=1, initial=0.0), 1e-12).astype(np.float32) / 127.0
+        codes = np.rint(vectors / scales[:, None]).clip(-127, 127).astype(np.int8)
+        return codes, scales
+
+
+INDEX_TYPES = {cls.kind: cls for cls in (ExactIndex, IVFIndex, Float16Index, Int8Index)}
+
+
+def load_index(path: str) -> ExactIndex:
+    with np.load(path, allow_pickle=False) as state:
+        kind = str(state["kind"])
+        if kind not in INDEX_TYPES:
+            raise ValueError(f"Unknown vector index type '{kind}' in {path}.")
+        return INDEX_TYPES[kind]._from_state(int(state["dim"]), state)
+
+
+def build_index(vectors: np.ndarray, backend: str = "exact", **kwargs) -> ExactIndex:
+    """
+    Build an index of the given backend ("exact", "ivf", "float16" or
+    "int8") over vectors.
+    """
+    if backend not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index backend '{backend}'. Choose from {sorted(INDEX_TYPES)}.")
+    vectors = np.asarray(vectors, dtype=np.float32)
+    index = INDEX_TYPES[backend](vectors.shape[1], **kwargs)
+    index.add(vectors)
+    return index
+
+
+def recall_at_k(found: np.ndarray, expected: np.ndarray) -> float:
+    """
+    Mean fraction of each row of ``expected`` ids that appears in ``found``.
+    """
+    if not expected.size:
+        return 1.0
+    hits = [len(np.intersect1d(f, e)) / len(e) for f, e in zip(found, expected)]
+    return float(np.mean(hits))
+
+
+def benchmark(vectors: np.ndarray, queries: np.ndarray, k: int = 5, backends=("float16", "int8")) -> List[Dict[str, object]]:
+    """
+    Memory and recall@k of each quantised backend, with and without float32
+    re-ranking, against exact float32 search over the same vectors.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    exact = build_index(vectors, "exact")
+    start = time.perf_counter()
+    _, truth = exact.search(queries, k)
+    rows = [{"backend": "exact", "bytes": exact.vectors.nbytes, "saved": 0.0, "recall": 1.0, "recall_rerank": 1.0, "ms_per_query": 1000 * (time.perf_counter() - start) / max(len(queries), 1)}]
+    for backend in backends:
+        index = build_index(vectors, backend)
+        _, approx = index.search(queries, k)
+        start = time.perf_counter()
+        _, reranked = index.search(queries, k, source=vectors)
+        elapsed = time.perf_counter() - start
+        rows.append(
+            {
+                "backend": backend,
+                "bytes": index.nbytes,
+                "saved": 1.0 - index.nbytes / max(exact.vectors.nbytes, 1),
+                "recall": recall_at_k(approx, truth),
+                "recall_rerank": recall_at_k(reranked, truth),
+                "ms_per_query": 1000 * elapsed / max(len(queries), 1),
+            }
+        )
+    return rows
+
+
+def _load_matrix(path: str) -> np.ndarray:
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    import torch  # only needed for .pt files
+
+    return torch.load(path, map_location="cpu").float().numpy()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory saved vs recall@k of the quantised indexes.")
+    parser.add_argument("path", nargs="?", default="models/ingredient_embeddings.pt", help="Embedding matrix (.pt or .npy).")
+    parser.add_argument("--queries", type=int, default=500, help="Rows sampled (and perturbed) as queries.")
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    vectors = np.asarray(_load_matrix(args.path), dtype=np.float32)
+    rng = np.random.default_rng(0)
+    picked = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    # Perturbed rows, so the nearest neighbour is not trivially the row itself.
+    queries = normalise(picked) + rng.normal(scale=0.05, size=picked.shape).astype(np.float32)
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {len(queries)} queries, k={args.k}")
+    print(f"{'backend':<10}{'MB':>10}{'saved':>8}{'recall':>9}{'+rerank':>9}{'ms/query':>10}")
+    for row in benchmark(vectors, queries, k=args.k):
+        print(
+            f"{row['backend']:<10}{row['bytes'] / 1e6:>10.2f}{row['saved']:>8.0%}"
+            f"{row['recall']:>9.3f}{row['recall_rerank']:>9.3f}{row['ms_per_query']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Append-only on-disk matrix of fixed-width embedding vectors.
+Rows are written to the end of a single binary file and read back through a
+memory map, so loading is zero-copy and appending never rewrites old rows.
+"""
+from __future__ import annotations
+
+import os
+import struct
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+MAGIC = b"DLVS"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sBBHII")  # magic, version, dtype code, reserved, dim, reserved
+HEADER_SIZE = HEADER.size
+
+DTYPE_CODES = {
+    0: np.dtype("float32"),
+    1: np.dtype("float16"),
+}
+CODE_FOR_DTYPE = {dtype: code for code, dtype in DTYPE_CODES.items()}
+
+
+class VectorStore:
+    """
+    A (rows, dim) matrix stored as a 16-byte header followed by raw rows.
+    Row ids are stable: row i is always the i-th vector ever appended.
+    """
+
+    def __init__(self, path: str, dim: Optional[int] = None, dtype: str = "float32"):
+        self.path = str(path)
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= HEADER_SIZE:
+            with open(self.path, "rb") as fh:
+                magic, version, code, _, stored_dim, _ = HEADER.unpack(fh.read(HEADER_SIZE))
+            if magic != MAGIC or version != FORMAT_VERSION or code not in DTYPE_CODES:
+                raise ValueError(f"{self.path} is not a DermaLens vector store.")
+            if dim is not None and dim != stored_dim:
+                raise ValueError(f"{self.path} holds {stored_dim}-d vectors, expected {dim}.")
+            self.dim = stored_dim
+            self.dtype = DTYPE_CODES[code]
+        else:
+            if dim is None:
+                raise FileNotFoundError(f"No vector store at {self.path} and no dimension given to create one.")
+            self.dim = int(dim)
+            self.dtype = np.dtype(dtype)
+            if self.dtype not in CODE_FOR_DTYPE:
+                raise ValueError(f"Unsupported vector dtype: {dtype}")
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "wb") as fh:
+                fh.write(HEADER.pack(MAGIC, FORMAT_VERSION, CODE_FOR_DTYPE[self.dtype], 0, self.dim, 0))
+        self._row_bytes = self.dim * self.dtype.itemsize
+        self._mmap: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return 0
+        return max(0, size - HEADER_SIZE) // self._row_bytes
+
+    def append(self, rows: np.ndarray) -> int:
+        """
+        Append rows and return the row id of the first one.
+        A partially written trailing row (from an interrupted write) is dropped first.
+        """
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        if rows.ndim == 1:
+            rows = rows.reshape(1, -1)
+        if rows.shape[1] != self.dim:
+            raise ValueError(f"Cannot append {rows.shape[1]}-d vectors to a {self.dim}-d store.")
+        with open(self.path, "r+b") as fh:
+            fh.seek(0, os.SEEK_END)
+            start = (fh.tell() - HEADER_SIZE) // self._row_bytes
+            fh.truncate(HEADER_SIZE + start * self._row_bytes)
+            fh.seek(0, os.SEEK_END)
+            fh.write(rows.tobytes())
+        return start
+
+    def truncate(self, rows: int) -> None:
+        """
+        Drop every row from ``rows`` onwards.
+        """
+        if rows < len(self):
+            self._mmap = None
+            with open(self.path, "r+b") as fh:
+                fh.truncate(HEADER_SIZE + rows * self._row_bytes)
+
+    def matrix(self, copy_on_write: bool = False) -> np.ndarray:
+        """
+        Read-only memory-mapped view over all complete rows. With
+        ``copy_on_write`` the view is writable but writes stay private to
+        this process (useful for handing the pages to torch.from_numpy).
+        """
+        rows = len(self)
+        if rows == 0:
+            return np.empty((0, self.dim), dtype=self.dtype)
+        if copy_on_write:
+            return np.memmap(self.path, dtype=self.dtype, mode="c", offset=HEADER_SIZE, shape=(rows, self.dim))
+        if self._mmap is None or self._mmap.shape[0] != rows:
+            self._mmap = np.memmap(self.path, dtype=self.dtype, mode="r", offset=HEADER_SIZE, shape=(rows, self.dim))
+        return self._mmap
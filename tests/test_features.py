@@ -1,8 +1,11 @@
+import numpy as np
 import torch
 
-from src.preprocessing import split_ingredients, clean_ingredients_text
+from src.preprocessing import split_ingredients, clean_ingredients_text, parse_ingredients, parse_many
 from src.analysis_engine import AnalysisEngine, extract_ingredients_from_image
-from src import embeddings_utils
+from src import embeddings_utils, vector_index
+from src.keyword_matcher import KeywordMatcher
+from src.safety_score import calculate_safety_score
 
 
 def test_split_and_clean():
@@ -13,21 +16,32 @@ def test_split_and_clean():
     assert parts == ["aqua", "glycerin", "niacinamide / tocopherol"]
 
 
+def test_parse_ingredients_once():
+    text = "Aqua,  Glycerin ,Niacinamide / Tocopherol"
+    parsed = parse_ingredients(text)
+    assert parsed.raw == text
+    assert parsed.clean_text == clean_ingredients_text(text)
+    assert list(parsed.ingredients) == split_ingredients(text)
+    assert parse_ingredients(parsed) is parsed
+    batch = parse_many([text, "water", text])
+    assert batch[0] is batch[2]
+
+
 class DummyModel:
-    classes_ = [f"class_{i}" for i in range(10)]
+    classes_ = ["safe"] + [f"class_{i}" for i in range(1, 10)]
 
     def predict(self, X):
-        return ["safe"]
+        return ["safe"] * len(X)
 
     def predict_proba(self, X):
-        return torch.full((1, 10), 0.1).numpy()
+        return torch.full((len(X), 10), 0.1).numpy()
 
 
 class FakeSentenceModel:
     def get_sentence_embedding_dimension(self):
         return 3
 
-    def encode(self, text, convert_to_tensor=True):
+    def encode(self, text, convert_to_tensor=True, **kwargs):
         # simple deterministic embedding
         import numpy as np
 
@@ -47,6 +61,11 @@ def build_fake_engine():
     engine.flat_ingredients = []
     engine.flat_embeddings = torch.empty((0, engine.sentence_model.get_sentence_embedding_dimension()))
     engine.user_entries = []
+    engine._product_rows = embeddings_utils.EmbeddingBuffer(engine.embeddings)
+    engine._flat_rows = embeddings_utils.EmbeddingBuffer(engine.flat_embeddings)
+    engine._flat_seen = set()
+    engine._user_memory_offset = 0
+    engine._memory_keys = set()
     return engine
 
 
@@ -54,10 +73,278 @@ def test_analyze_basic_flow():
     engine = build_fake_engine()
     result = engine.analyze("water, glycerin, niacinamide", product_name="Test", skip_store=True)
     assert result["tfidf"]["label"] == "safe"
+    assert result["ingredients_list"] == ["water", "glycerin", "niacinamide"]
     assert result["safety_score"] >= 0
     assert result["highlight_groups"]["safe"]
 
 
+def test_analyze_many_matches_analyze():
+    engine = build_fake_engine()
+    engine.product_names = ["Product A"]
+    engine.ingredient_lists = ["water, glycerin"]
+    engine.embeddings = torch.tensor([[1.0, 0.0, 0.0]])
+    engine.flat_ingredients = ["water", "glycerin"]
+    engine.flat_embeddings = torch.tensor([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+
+    texts = ["water, glycerin, niacinamide", "aqua, cetyl alcohol"]
+    batch = engine.analyze_many(texts, names=["One", None], skip_store=True)
+    single = [engine.analyze(text, product_name=name, skip_store=True) for text, name in zip(texts, ["One", None])]
+
+    assert [r["product_name"] for r in batch] == ["One", "Untitled Product"]
+    assert list(batch[1]["ingredient_similarities"]) == batch[1]["ingredients_list"]
+    for b, s in zip(batch, single):
+        for key in ["clean_text", "ingredients_list", "tfidf", "safety_score", "highlight_groups", "similar_products", "ingredient_similarities"]:
+            assert b[key] == s[key]
+
+
+def test_stored_results_extend_memory_incrementally(tmp_path, monkeypatch):
+    monkeypatch.setattr(embeddings_utils, "USER_MEMORY_PATH", str(tmp_path / "memory.jsonl"))
+    engine = build_fake_engine()
+
+    engine.analyze("water, glycerin", product_name="First")
+    engine.analyze("water, niacinamide", product_name="Second")
+
+    assert engine.product_names == ["First", "Second"]
+    assert tuple(engine.embeddings.shape) == (2, 3)
+    assert engine.flat_ingredients == ["water", "glycerin", "niacinamide"]
+    assert tuple(engine.flat_embeddings.shape) == (3, 3)
+
+    # Another process appends; only the tail is read.
+    embeddings_utils.append_user_memory({"product_name": "Third", "ingredients": "aqua", "embedding": [0.0, 1.0, 0.0]})
+    assert [e["product_name"] for e in engine.get_previous_results()] == ["First", "Second", "Third"]
+    assert engine.flat_ingredients[-1] == "aqua"
+
+    # Concurrent readers must not append the same tail twice.
+    import threading
+
+    embeddings_utils.append_user_memory({"product_name": "Fourth", "ingredients": "zinc", "embedding": [0.0, 0.0, 1.0]})
+    threads = [threading.Thread(target=engine.get_previous_results) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert engine.product_names == ["First", "Second", "Third", "Fourth"]
+    assert tuple(engine.embeddings.shape) == (4, 3)
+
+
+def test_user_memory_migrates_to_binary_store(tmp_path, monkeypatch):
+    import json
+
+    path = tmp_path / "memory.jsonl"
+    monkeypatch.setattr(embeddings_utils, "USER_MEMORY_PATH", str(path))
+    legacy = [
+        {"product_name": "A", "ingredients": "water", "embedding": [1.0, 0.0, 0.0], "analysis": {"embedding": [1.0, 0.0, 0.0]}},
+        {"product_name": "B", "ingredients": "aqua", "embedding": [0.0, 1.0, 0.0]},
+    ]
+    path.write_text("".join(json.dumps(entry) + "\n" for entry in legacy))
+
+    names, _, tensor, entries = embeddings_utils.load_user_memory()
+    assert names == ["A", "B"]
+    assert [entry["row"] for entry in entries] == [0, 1]
+    assert torch.equal(tensor, torch.tensor([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]))
+    assert "embedding" not in path.read_text()
+    assert (tmp_path / "memory.vec").exists()
+
+    embeddings_utils.append_user_memory({"product_name": "C", "ingredients": "oil", "embedding": [0.0, 0.0, 1.0]})
+    assert json.loads(path.read_text().splitlines()[-1])["row"] == 2
+    assert embeddings_utils.load_user_memory()[2].shape == (3, 3)
+
+
+def test_result_cache_hits_and_invalidation(tmp_path, monkeypatch):
+    from src.result_cache import AnalysisResultCache
+
+    monkeypatch.setattr(embeddings_utils, "USER_MEMORY_PATH", str(tmp_path / "memory.jsonl"))
+    engine = build_fake_engine()
+    engine.result_cache = AnalysisResultCache(max_entries=4, cache_dir=str(tmp_path / "results"))
+    calls = []
+    original_predict = engine._predict
+
+    def counting_predict(clean_texts):
+        calls.extend(clean_texts)
+        return original_predict(clean_texts)
+
+    engine._predict = counting_predict
+
+    first = engine.analyze("Water, Glycerin", product_name="One", skip_store=True)
+    again = engine.analyze("water,  glycerin", product_name="Two", skip_store=True)
+    assert calls == ["water, glycerin"]
+    assert again["product_name"] == "Two" and again["ingredients_raw"] == "water,  glycerin"
+    assert again["tfidf"] == first["tfidf"]
+    assert engine.result_cache.stats()["hits"] == 1
+
+    # Storing a new product changes the memory version and the key.
+    engine.analyze("aqua", product_name="Stored")
+    engine.analyze("water, glycerin", skip_store=True)
+    assert calls == ["water, glycerin", "aqua", "water, glycerin"]
+
+    # A fresh process picks results up from disk; analyze_many only computes misses.
+    engine.result_cache = AnalysisResultCache(cache_dir=str(tmp_path / "results"))
+    batch = engine.analyze_many(["water, glycerin", "niacinamide"], skip_store=True)
+    assert calls[-1:] == ["niacinamide"]
+    assert engine.result_cache.disk_hits == 1
+    assert batch[0]["similar_products"] == engine.analyze("water, glycerin", skip_store=True)["similar_products"]
+
+
+def test_result_cache_returns_shallow_copies(tmp_path):
+    from src.result_cache import AnalysisResultCache
+
+    cache = AnalysisResultCache(cache_dir=str(tmp_path))
+    cache.put("k", {"product_name": "One", "embedding": [1.0, 0.0], "tfidf": {"label": "safe"}})
+    first = cache.get("k", {"product_name": "Two"})
+    second = cache.get("k")
+    assert first["product_name"] == "Two" and second["product_name"] == "One"
+    assert first["embedding"] is second["embedding"]  # nested values are shared, not copied
+    first["product_name"] = "Changed"
+    assert cache.get("k")["product_name"] == "One"
+    assert AnalysisResultCache(cache_dir=str(tmp_path)).get("k")["tfidf"] == {"label": "safe"}
+
+
+def test_ingredient_cache_only_encodes_misses(tmp_path, monkeypatch):
+    monkeypatch.setattr(embeddings_utils, "INGREDIENT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(embeddings_utils, "_INGREDIENT_CACHES", {})
+    model = FakeSentenceModel()
+    model.dermalens_model_name = "fake-encoder"
+    encoded = []
+    original_encode = model.encode
+
+    def counting_encode(text, convert_to_tensor=True, **kwargs):
+        encoded.extend(text)
+        return original_encode(text, convert_to_tensor=convert_to_tensor)
+
+    model.encode = counting_encode
+    first = embeddings_utils.encode_ingredients(["Aqua", "Glycerin", "aqua"], model)
+    assert tuple(first.shape) == (3, 3)
+    assert encoded == ["aqua", "glycerin"]
+
+    # A fresh process (new cache object) reads the vectors back from disk.
+    monkeypatch.setattr(embeddings_utils, "_INGREDIENT_CACHES", {})
+    second = embeddings_utils.encode_ingredients(["GLYCERIN", "niacinamide"], model)
+    assert encoded == ["aqua", "glycerin", "niacinamide"]
+    assert torch.equal(second[0], first[1])
+
+
+def test_most_similar_ingredients_top_k():
+    flat = ["water", "glycerin", "squalane"]
+    flat_embeddings = torch.tensor([[1.0, 0.0, 0.0], [0.6, 0.8, 0.0], [0.0, 0.0, 1.0]])
+    result = embeddings_utils.most_similar_ingredients(
+        "aqua, glycerin", flat, flat_embeddings, FakeSentenceModel(), top_k=2
+    )
+    assert list(result) == ["aqua", "glycerin"]
+    assert result["aqua"]["closest_ingredient"] == "water"
+    assert [m["ingredient"] for m in result["aqua"]["matches"]] == ["water", "glycerin"]
+
+    single = embeddings_utils.most_similar_ingredients("aqua", flat, flat_embeddings, FakeSentenceModel())
+    assert "matches" not in single["aqua"]
+
+
+def test_compiled_scorer_matches_pipeline():
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import Pipeline
+
+    from src.compiled_model import compile_pipeline
+
+    texts = [
+        "aqua, glycerin, niacinamide",
+        "cetyl alcohol, polysorbate 80",
+        "fragrance, linalool, limonene",
+        "aqua, squalane, glycerin",
+        "lauric acid, myristic acid",
+        "dimethicone, fragrance",
+    ]
+    labels = ["safe", "trigger", "fragrance", "safe", "trigger", "fragrance"]
+    pipeline = Pipeline([("tfidf", TfidfVectorizer(ngram_range=(1, 2))), ("clf", LogisticRegression(max_iter=200))])
+    pipeline.fit(texts, labels)
+
+    compiled = compile_pipeline(pipeline, texts[:2])
+    assert compiled is not None
+    queries = ["glycerin, fragrance, unknown thing", "", "cetyl alcohol"]
+    assert np.allclose(compiled.predict_proba(queries), pipeline.predict_proba(queries), atol=1e-9)
+    assert list(compiled.predict(queries)) == list(pipeline.predict(queries))
+
+
+def test_compact_model_artefact_and_singleton(tmp_path):
+    import joblib
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import Pipeline
+
+    from src.compiled_model import CompiledTfidfModel, compact_path, export_compact, load_compact, load_model
+
+    texts = ["aqua, glycerin, niacinamide", "cetyl alcohol, polysorbate 80", "fragrance, linalool", "aqua, squalane"]
+    labels = ["safe", "trigger", "fragrance", "safe"]
+    pipeline = Pipeline([("tfidf", TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True)), ("clf", LogisticRegression(max_iter=200))])
+    pipeline.fit(texts, labels)
+    model_path = str(tmp_path / "model.joblib")
+    joblib.dump(pipeline, model_path)
+    assert load_model(model_path) is load_model(model_path)  # no compact file yet: the pipeline, loaded once
+
+    path = export_compact(pipeline, compact_path(model_path), texts)
+    assert path == str(tmp_path / "model.dlm")
+    compact = load_compact(path)
+    vocabulary = pipeline.named_steps["tfidf"].vocabulary_
+    assert len(compact.vocabulary) == len(vocabulary)
+    assert list(compact.vocabulary) == sorted(vocabulary)
+    assert "cetyl alcohol" in compact.vocabulary and "missing term" not in compact.vocabulary
+    assert compact.terms[compact.vocabulary["glycerin"]] == "glycerin"
+
+    queries = ["glycerin, fragrance, unknown thing", "", "cetyl alcohol"]
+    assert list(compact.predict(queries)) == list(pipeline.predict(queries))
+    assert np.allclose(compact.predict_proba(queries), pipeline.predict_proba(queries), atol=1e-5)
+
+    cached = load_model(model_path)
+    assert isinstance(cached, CompiledTfidfModel) and cached is load_model(model_path)
+    assert load_model(model_path, prefer_compact=False) is not cached
+
+    # Result cache keys name the file actually scored: the compact artefact.
+    import os
+
+    engine = AnalysisEngine(model_path=model_path)
+    assert engine.model_identity.startswith(os.path.abspath(path) + ":")
+    assert AnalysisEngine(model_path=model_path, use_compiled_scorer=False).model_identity.startswith(os.path.abspath(model_path) + ":")
+
+
+def test_linear_explanation_is_exact_and_cached():
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import Pipeline
+
+    from src.compiled_model import CompiledTfidfModel
+    from src.explanations import ExplanationCache, explain_prediction
+
+    texts = ["aqua, glycerin", "cetyl alcohol, polysorbate 80", "fragrance, linalool", "aqua, squalane"]
+    labels = ["safe", "trigger", "fragrance", "safe"]
+    pipeline = Pipeline([("tfidf", TfidfVectorizer()), ("clf", LogisticRegression(max_iter=200))])
+    pipeline.fit(texts, labels)
+    scorer = CompiledTfidfModel.from_pipeline(pipeline)
+
+    cache = ExplanationCache()
+    text = "Aqua, Cetyl Alcohol, Fragrance"
+    explanation = explain_prediction(text, pipeline, scorer=scorer, model_identity="m1", num_features=20, cache=cache)
+    assert explanation.label == pipeline.predict(["aqua, cetyl alcohol, fragrance"])[0]
+    total = sum(weight for _, weight in explanation.features) + scorer.intercept[explanation.label_index]
+    assert np.isclose(total, scorer.decision_function(["aqua, cetyl alcohol, fragrance"])[0, explanation.label_index])
+
+    again = explain_prediction(text, pipeline, scorer=scorer, model_identity="m1", num_features=20, cache=cache)
+    assert again is explanation
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_pdf_reports_are_content_addressed():
+    from src import pdf_report
+
+    result = {"product_name": "A", "tfidf": {"probs": np.array([0.2, 0.8])}, "safety_score": 7}
+    key = pdf_report.report_key([result])
+    assert key == pdf_report.report_key([dict(result)])
+    assert key != pdf_report.report_key([result], lime_image=b"png")
+
+    cache = pdf_report.ReportCache(max_entries=1)
+    builds = []
+    assert cache.get_or_build(key, lambda: builds.append(1) or b"pdf") == b"pdf"
+    assert cache.get_or_build(key, lambda: builds.append(1) or b"pdf") == b"pdf"
+    assert builds == [1] and cache.hits == 1
+
+
 def test_similarity_helpers():
     names = ["Product A", "Product B"]
     ingredients = ["a, b", "c, d"]
@@ -67,6 +354,736 @@ def test_similarity_helpers():
     assert similar[0]["product_name"] == "Product A"
 
 
+def test_ivf_index_matches_exact_search(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(2000, 16)).astype("float32")
+    queries = vectors[:20] + 0.01 * rng.normal(size=(20, 16)).astype("float32")
+
+    exact = vector_index.build_index(vectors, backend="exact")
+    ivf = vector_index.build_index(vectors[:1500], backend="ivf", n_lists=20, nprobe=20)
+    ivf.add(vectors[1500:])  # incremental insert after training
+    _, exact_ids = exact.search(queries, 5)
+    _, ivf_ids = ivf.search(queries, 5)
+    assert (ivf_ids == exact_ids).all()
+
+    path = tmp_path / "index.npz"
+    ivf.save(str(path))
+    loaded = vector_index.load_index(str(path))
+    _, approx_ids = loaded.search(queries, 1, nprobe=4)
+    assert (approx_ids[:, 0] == np.arange(20)).mean() >= 0.9
+
+    names = [f"p{i}" for i in range(2000)]
+    embeddings = torch.from_numpy(vectors)
+    with_index = embeddings_utils.find_similar_products(torch.from_numpy(queries[0]), names, names, embeddings, top_k=3, index=exact)
+    brute = embeddings_utils.find_similar_products(torch.from_numpy(queries[0]), names, names, embeddings, top_k=3)
+    assert [r["product_name"] for r in with_index] == [r["product_name"] for r in brute]
+
+
+def test_quantized_indexes_rerank_to_exact(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(3000, 32)).astype("float32")
+    queries = vectors[:30] + 0.05 * rng.normal(size=(30, 32)).astype("float32")
+    _, exact_ids = vector_index.build_index(vectors, backend="exact").search(queries, 5)
+
+    for backend, max_bytes in (("float16", 3000 * 32 * 2), ("int8", 3000 * (32 + 4))):
+        index = vector_index.build_index(vectors[:2000], backend=backend)
+        index.add(vectors[2000:])
+        assert index.nbytes <= max_bytes
+        _, approx_ids = index.search(queries, 5)
+        assert vector_index.recall_at_k(approx_ids, exact_ids) >= 0.9
+        scores, ids = index.search(queries, 5, source=vectors)
+        assert (ids == exact_ids).all()
+        assert np.allclose(scores[:, 0], (vector_index.normalise(vectors[ids[:, 0]]) * vector_index.normalise(queries)).sum(axis=1), atol=1e-5)
+
+        index.save(str(tmp_path / f"{backend}.npz"))
+        assert (vector_index.load_index(str(tmp_path / f"{backend}.npz")).search(queries, 5, source=vectors)[1] == exact_ids).all()
+
+    # Scores are merged chunk by chunk; small chunks give the same answer.
+    small_chunks = vector_index.build_index(vectors, backend="int8")
+    small_chunks.chunk_rows = 257
+    assert (small_chunks.search(queries, 5, source=vectors)[1] == exact_ids).all()
+
+    # The engine keeps float32 rows as memory-mapped segments, not one tensor.
+    names = [f"p{i}" for i in range(3000)]
+    rows = embeddings_utils.MappedRows([torch.from_numpy(vectors[:1000]), vectors[1000:2500]])
+    rows.append(torch.from_numpy(vectors[2500:]))
+    assert len(rows) == 3000 and np.array_equal(rows[np.array([5, 1500, 2999])], vectors[[5, 1500, 2999]])
+    int8 = embeddings_utils.build_vector_index(rows, "int8")
+    with_index = embeddings_utils.find_similar_products(torch.from_numpy(queries[0]), names, names, rows, top_k=3, index=int8)
+    brute = embeddings_utils.find_similar_products(torch.from_numpy(queries[0]), names, names, torch.from_numpy(vectors), top_k=3)
+    assert [r["product_name"] for r in with_index] == [r["product_name"] for r in brute]
+
+    rows = vector_index.benchmark(vectors, queries, k=5)
+    assert [row["backend"] for row in rows] == ["exact", "float16", "int8"]
+    assert rows[2]["saved"] > 0.7 and rows[2]["recall_rerank"] == 1.0
+
+
+def test_keyword_matcher_matches_substring_semantics():
+    matcher = KeywordMatcher({"unsafe": ["stearic acid", "isostearic acid", "polysorbate"], "mild": ["fragrance"]})
+    hits = matcher.find_all("Aqua, Isostearic Acid, Polysorbate 20, Fragrance")
+    assert [(h.keyword, h.start) for h in hits] == [
+        ("isostearic acid", 6),
+        ("stearic acid", 9),
+        ("polysorbate", 23),
+        ("fragrance", 39),
+    ]
+    assert matcher.present("fragrance, stearic acid", group="unsafe") == ["stearic acid"]
+
+    per_item = matcher.hits_per_item(["polysorb", "ate", "parfum (fragrance)"])
+    assert [[h.keyword for h in item] for item in per_item] == [[], [], ["fragrance"]]
+
+
+def test_safety_score_and_categories_use_keyword_lists(monkeypatch):
+    from src import safety_score
+
+    scans = []
+    scan = safety_score.SAFETY_MATCHER._scan
+    monkeypatch.setattr(safety_score.SAFETY_MATCHER, "_scan", lambda text: scans.append(text) or scan(text))
+    text = "Aqua, Cetyl Alcohol, Polysorbate 80, Dimethicone, Glycerin, Cetyl Alcohol"
+    assert calculate_safety_score(text) == 10 - 4 - 4 - 1
+    assert len(scans) == 1  # both groups from one pass
+    engine = build_fake_engine()
+    groups = engine._categorise_ingredients(["aqua", "cetyl alcohol", "dimethicone", "polysorbate 80"])
+    assert groups == {"safe": ["aqua"], "mild": ["dimethicone"], "unsafe": ["cetyl alcohol", "polysorbate 80"]}
+    del scans[:]
+    explanation = engine.generate_explanation(["cetyl alcohol", "polysorbate 80"], 2)
+    assert "cetyl alcohol, polysorbate" in explanation
+    assert len(scans) == 1
+
+    # One automaton for the scorer, the engine and analytics.
+    from src import analysis_engine
+
+    assert analysis_engine.SAFETY_MATCHER is safety_score.SAFETY_MATCHER
+    assert engine._categorise_ingredients(["cetearyl alcohol"])["unsafe"] == ["cetearyl alcohol"]
+    assert calculate_safety_score("aqua, cetearyl alcohol") == 10 - 4
+
+
+def test_product_catalogue_fuzzy_lookup_and_write_back(tmp_path, monkeypatch):
+    from src import ingredient_lookup, product_catalogue
+
+    dump = tmp_path / "dump.csv"
+    dump.write_text(
+        "code,product_name,ingredients_text\n"
+        "5012345678900,CeraVe Moisturising Lotion 236ml,\"aqua, glycerin, ceramide np\"\n"
+        "4006000000000,Nivea Creme,\n"
+    )
+    path = tmp_path / "catalogue.jsonl"
+    catalogue = product_catalogue.ProductCatalogue(str(path))
+    assert catalogue.import_dump(str(dump)) == 2
+
+    entry, score = catalogue.lookup_ingredients("cerave moisturizing lotion")
+    assert entry.name == "CeraVe Moisturising Lotion 236ml" and score >= product_catalogue.MIN_NAME_SCORE
+    assert catalogue.lookup_ingredients("nivea creme") is None  # known product, no ingredients
+    assert catalogue.lookup_barcode("4006000000000").name == "Nivea Creme"
+
+    # Sibling products share most trigrams but not their ingredient lists.
+    catalogue.add("CeraVe Hydrating Cleanser", ingredients="aqua, glycerin, hyaluronic acid", persist=False)
+    catalogue.add("Effaclar Gel", ingredients="aqua, zinc pca", persist=False)
+    catalogue.add("Nivea Creme 50 ml", ingredients="aqua, paraffinum liquidum", persist=False)
+    assert catalogue.lookup_ingredients("CeraVe Foaming Cleanser") is None
+    assert catalogue.lookup_ingredients("Effaclar Duo") is None
+    assert catalogue.lookup_ingredients("cerave cleanser") is None
+    assert catalogue.lookup_ingredients("nivea creme") is None  # the exact product decides
+    assert catalogue.lookup_ingredients("Nivea Creme 50ml")[0].name == "Nivea Creme 50 ml"
+
+    # Imports and write-backs survive a restart; later fields are merged in.
+    catalogue.add("Nivea Creme", ingredients="aqua, paraffinum liquidum")
+    reloaded = product_catalogue.ProductCatalogue(str(path))
+    assert reloaded.lookup_barcode("4006000000000").ingredients == "aqua, paraffinum liquidum"
+
+    monkeypatch.setattr(product_catalogue, "_CATALOGUE", reloaded)
+
+    def no_web(query):
+        raise AssertionError("catalogue hit should not search the web")
+
+    monkeypatch.setattr(ingredient_lookup, "_fetch_search_page", no_web)
+    found = ingredient_lookup.search_ingredients_by_product_name("Cerave Moisturising Lotion")
+    assert found["status"] == "success" and "ceramide np" in found["ingredients"]
+
+
+def test_catalogue_follows_user_memory_and_guesses_never_override(tmp_path, monkeypatch):
+    import json
+
+    from src import product_catalogue
+
+    user_memory = tmp_path / "user_memory.jsonl"
+    user_memory.write_text(json.dumps({"product_name": "Effaclar Duo", "ingredients": "aqua, niacinamide"}) + "\n")
+    catalogue = product_catalogue.ProductCatalogue(None)
+    catalogue.load_sources(str(tmp_path / "missing.csv"), str(user_memory))
+    monkeypatch.setattr(product_catalogue, "_CATALOGUE", catalogue)
+    assert product_catalogue.get_catalogue().lookup_ingredients("effaclar duo")[0].ingredients == "aqua, niacinamide"
+
+    # Rows saved after start-up are picked up; a half-written line waits.
+    with open(user_memory, "a") as fh:
+        fh.write(json.dumps({"product_name": "Toleriane Cream", "ingredients": "aqua, glycerin"}) + "\n")
+        fh.write('{"product_name": "Half')
+    assert product_catalogue.get_catalogue().lookup_ingredients("toleriane cream") is not None
+    assert len(catalogue) == 2
+
+    # A barcode guessed from a search title cannot move a known barcode,
+    # and a guessed name cannot hide a real entry's ingredients.
+    catalogue.add("Nivea Creme 50 ml", ingredients="aqua, paraffinum liquidum", barcode="4006000000000", source="dump.csv", persist=False)
+    catalogue.add("Nivea Soft", barcode="4006000000000", source=product_catalogue.GUESSED_SOURCE, persist=False)
+    assert catalogue.lookup_barcode("4006000000000").name == "Nivea Creme 50 ml"
+    catalogue.add("Nivea Creme", barcode="4006000000001", source=product_catalogue.GUESSED_SOURCE, persist=False)
+    assert catalogue.lookup_ingredients("Nivea Creme")[0].name == "Nivea Creme 50 ml"
+    # Real data still replaces a guess.
+    catalogue.add("Nivea Creme 50 ml", barcode="4006000000001", source="dump.csv", persist=False)
+    assert catalogue.lookup_barcode("4006000000001").name == "Nivea Creme 50 ml"
+
+
+def test_store_checks_run_concurrently_against_fake_server(tmp_path, monkeypatch):
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from src import http_cache, store_availability
+
+    monkeypatch.setattr(http_cache, "_CACHE", http_cache.HttpResponseCache(str(tmp_path / "http.sqlite")))
+
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            if self.path.startswith("/broken"):
+                self.send_response(500)
+                self.end_headers()
+                return
+            time.sleep(0.3)
+            body = b"<a href='/p/123'>Item</a><span class='price'>Now \xc2\xa34.50</span>"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    class FakeStore(store_availability.Retailer):
+        link_selectors = ("a[href*='/p/']",)
+        price_selectors = (".price",)
+
+        def __init__(self, name, path):
+            self.name = name
+            self.base_url = base
+            self.search_url = base + path + "?q={query}"
+
+    stores = [FakeStore("One", "/one"), FakeStore("Two", "/two"), FakeStore("Broken", "/broken")]
+    try:
+        store_availability.clear_cache()
+        started = time.perf_counter()
+        results = store_availability.check_store_availability("Test Cream", retailers=stores)
+        assert time.perf_counter() - started < 0.55
+        assert [r["store"] for r in results] == ["One", "Two", "Broken"]
+        assert results[0]["available"] and results[0]["link"] == base + "/p/123"
+        assert results[0]["price"] == "\u00a34.50"
+        assert results[2]["error"]
+
+        # Cached (briefly, since one store failed): no new requests.
+        seen = len(requests_seen)
+        assert store_availability.check_store_availability("Test Cream", retailers=stores) == results
+        assert len(requests_seen) == seen
+    finally:
+        server.shutdown()
+        store_availability.clear_cache()
+
+
+def test_http_cache_ttl_revalidation_and_eviction(tmp_path):
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from src.http_cache import HttpResponseCache
+
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            seen.append((self.path, self.headers.get("If-None-Match")))
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = self.path.encode() * 100
+            self.send_response(200)
+            self.send_header("ETag", '"v1"')
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    now = [1000.0]
+    path = str(tmp_path / "http.sqlite")
+    try:
+        cache = HttpResponseCache(path, max_disk_bytes=400, clock=lambda: now[0])
+        first = cache.get_text(base + "/a", source="store", ttl=60)
+        assert cache.get_text(base + "/a", source="store", ttl=60) == first
+        assert len(seen) == 1
+
+        # A new process reads from disk; once stale it revalidates with the ETag.
+        restarted = HttpResponseCache(path, max_disk_bytes=400, clock=lambda: now[0])
+        assert restarted.get_text(base + "/a", source="store", ttl=60) == first
+        now[0] += 120
+        assert restarted.get_text(base + "/a", source="store", ttl=60) == first
+        assert seen[-1] == ("/a", '"v1"')
+        assert restarted.stats()["store"] == {"hits": 1, "revalidated": 1}
+
+        # A 200- and a 300-byte body exceed the 400-byte cap: the older one goes.
+        now[0] += 1
+        restarted.get_text(base + "/bb", source="store")
+        rows = [row[0] for row in restarted._db.execute("SELECT url FROM responses")]
+        assert rows == [base + "/bb"]
+
+        # Hits served from memory still count as accesses for disk eviction.
+        hot = HttpResponseCache(str(tmp_path / "hot.sqlite"), max_disk_bytes=400, clock=lambda: now[0])
+        for url in ("/a", "/c", "/a", "/d"):
+            now[0] += 1
+            hot.get_text(base + url, source="store")
+        rows = {row[0] for row in hot._db.execute("SELECT url FROM responses")}
+        assert rows == {base + "/a", base + "/d"}
+        assert hot.stats()["store"] == {"misses": 3, "hits": 1}
+    finally:
+        server.shutdown()
+
+
+def test_scan_pipeline_overlaps_stages_and_cancels_per_session(monkeypatch):
+    import threading
+    import time
+
+    from src import barcode_scanner, ingredient_lookup, store_availability
+    from src.scan_pipeline import ScanPipeline
+
+    release = threading.Event()
+    store_started = threading.Event()
+
+    def fake_fetch(name):
+        # The store check must already be running while ingredients load.
+        assert store_started.wait(1)
+        release.wait(1)
+        return {"ingredients": "aqua, glycerin"}
+
+    def fake_store(name):
+        store_started.set()
+        return [{"store": "Fake", "available": True}]
+
+    monkeypatch.setattr(barcode_scanner, "decode_barcodes", lambda frame: [frame.decode()])
+    monkeypatch.setattr(barcode_scanner, "lookup_product_from_barcode", lambda code: {"product_name": f"Product {code}"})
+    monkeypatch.setattr(ingredient_lookup, "search_ingredients_by_product_name", fake_fetch)
+    monkeypatch.setattr(store_availability, "check_store_availability", fake_store)
+
+    engine = build_fake_engine()
+    engine._warmed = True
+    monkeypatch.setattr(engine, "analyze", lambda text, name: {"product_name": name, "ingredients_raw": text})
+    pipeline = ScanPipeline(engine)
+
+    first = pipeline.submit(b"111")
+    while first.stage != "ingredients":
+        time.sleep(0.01)
+    # Another session's frame does not cancel this session's scan.
+    other = pipeline.submit(b"333")
+    while other.stage != "ingredients":
+        time.sleep(0.01)
+    assert not first.cancelled
+    # A newer frame in the same session: the session cancels its own job.
+    first.cancel()
+    second = pipeline.submit(b"222")
+    release.set()
+    for job in (first, other, second):
+        job.future.result(2)
+
+    assert first.cancelled and first.result is None and first.stage == "cancelled"
+    assert not other.cancelled and other.result == {"product_name": "Product 333", "ingredients_raw": "aqua, glycerin"}
+    assert second.result == {"product_name": "Product 222", "ingredients_raw": "aqua, glycerin"}
+    assert second.availability_future.result(1)[0]["store"] == "Fake"
+    assert list(second.timings) == ["decode", "lookup", "ingredients", "analyze"]
+
+
+def test_ttl_cache_expires_entries():
+    from src.store_availability import TTLCache
+
+    now = [0.0]
+    cache = TTLCache(maxsize=2, clock=lambda: now[0])
+    cache.set("ok", 1, ttl=100)
+    cache.set("failed", 2, ttl=5)
+    now[0] = 10
+    assert cache.get("failed") is None
+    assert cache.get("ok") == 1
+    cache.set("a", 3, ttl=1)
+    cache.set("b", 4, ttl=200)
+    assert cache.get("b") == 4
+
+
+def test_retailer_link_needs_href_except_boots():
+    from bs4 import BeautifulSoup
+
+    from src.store_availability import BootsRetailer, SuperdrugRetailer, _empty_result
+
+    bare = BeautifulSoup("<a data-test='product-tile'>Tile</a><a data-productid='1'>Tile</a>", "lxml")
+    assert SuperdrugRetailer().parse(bare, _empty_result("Superdrug"))["available"] is False
+    assert BootsRetailer().parse(bare, _empty_result("Boots"))["available"] is True
+    linked = BeautifulSoup("<a data-test='product-tile' href='/p/1'>Tile</a>", "lxml")
+    result = SuperdrugRetailer().parse(linked, _empty_result("Superdrug"))
+    assert result["available"] is True and result["link"] == "https://www.superdrug.com/p/1"
+
+
+def test_fast_barcode_helpers(monkeypatch):
+    from PIL import Image
+
+    from src import barcode_scanner
+
+    assert barcode_scanner.is_valid_retail_code("4006381333931")
+    assert barcode_scanner.is_valid_retail_code("036000291452")
+    assert not barcode_scanner.is_valid_retail_code("4006381333932")
+    assert not barcode_scanner.is_valid_retail_code("ABC-123")
+
+    # Vertical bars on a flat background: the heuristic should box them.
+    pixels = np.full((300, 400), 200, dtype=np.uint8)
+    for x in range(200, 320, 6):
+        pixels[100:180, x : x + 3] = 0
+    regions = barcode_scanner.candidate_regions(Image.fromarray(pixels))
+    left, top, right, bottom = regions[0]
+    assert left <= 0.5 and right >= 0.78 and top <= 0.34 and bottom >= 0.58
+    assert right - left < 0.6
+
+    # A frame that fails to decode at a finer scale keeps coarser finds.
+    def greyscale(data, max_side):
+        if max_side != 480:
+            raise OSError("truncated frame")
+        return Image.fromarray(pixels)
+
+    monkeypatch.setattr(barcode_scanner, "decode", lambda image, symbols=None: [])
+    monkeypatch.setattr(barcode_scanner, "_greyscale", greyscale)
+    monkeypatch.setattr(barcode_scanner, "_decode_image", lambda image, symbols: ["ABC-123"])
+    assert barcode_scanner.decode_fast(b"frame") == ["ABC-123"]
+
+
+def _use_test_snapshot(tmp_path, monkeypatch):
+    from src import memory_snapshot
+
+    path = str(tmp_path / "snapshot.bin")
+    snapshot = memory_snapshot.MemorySnapshot(
+        product_names=["A", "B"],
+        ingredient_lists=["water, glycerin", "aqua"],
+        embeddings=torch.tensor([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]),
+        flat_ingredients=["water", "glycerin", "aqua"],
+        flat_embeddings=torch.eye(3),
+        source="v1",
+    )
+    memory_snapshot.write_snapshot(path, snapshot)
+    monkeypatch.setattr(embeddings_utils, "base_memory_source", lambda: "v1")
+    monkeypatch.setattr(embeddings_utils, "USER_MEMORY_PATH", str(tmp_path / "user.jsonl"))
+    monkeypatch.setattr(embeddings_utils, "load_sentence_model", lambda: FakeSentenceModel())
+    monkeypatch.setattr(embeddings_utils, "load_base_snapshot", lambda loader: memory_snapshot.load_snapshot(path, "v1"))
+    return path, snapshot
+
+
+def test_memory_snapshot_roundtrip_and_lazy_engine(tmp_path, monkeypatch):
+    from src import memory_snapshot
+
+    path, snapshot = _use_test_snapshot(tmp_path, monkeypatch)
+    loaded = memory_snapshot.load_snapshot(path, source="v1")
+    assert loaded.product_names == ["A", "B"]
+    assert loaded.flat_ingredients == ["water", "glycerin", "aqua"]
+    assert torch.equal(loaded.embeddings, snapshot.embeddings)
+    assert torch.equal(loaded.flat_embeddings, snapshot.flat_embeddings)
+    assert memory_snapshot.load_snapshot(path, source="v2") is None
+    assert memory_snapshot.load_snapshot(str(tmp_path / "missing.bin")) is None
+
+    # Construction loads nothing; memory comes from the snapshot on first use.
+    engine = AnalysisEngine(model_path=str(tmp_path / "missing.joblib"))
+    assert engine._model is None and engine._sentence_model is None
+    engine.model = DummyModel()
+    result = engine.analyze("water, glycerin", "Test", skip_store=True)
+    assert engine.product_names == ["A", "B"]
+    assert result["similar_products"][0]["product_name"] == "A"
+
+
+def test_shared_memory_across_workers(tmp_path, monkeypatch):
+    from src.shared_memory import SharedMemory
+
+    _use_test_snapshot(tmp_path, monkeypatch)
+    workers = [
+        AnalysisEngine(model_path=str(tmp_path / "missing.joblib"), shared_memory=SharedMemory(str(tmp_path / "shared")))
+        for _ in range(2)
+    ]
+    for engine in workers:
+        engine.model = DummyModel()
+        assert engine.sync_memory() == 0
+    writer, reader = workers
+    assert reader.shared_memory.version.read() == writer.shared_memory.version.read()
+
+    writer.analyze("water, niacinamide", "New")
+    assert reader.sync_memory() == 1
+    assert reader.sync_memory() == 0  # version unchanged: nothing re-read
+    assert reader.product_names == ["A", "B", "New"]
+    assert reader.flat_ingredients == ["water", "glycerin", "aqua", "niacinamide"]
+    assert tuple(reader.embeddings.shape) == (3, 3)
+    assert tuple(reader.flat_embeddings.shape) == (4, 3)
+    assert reader.memory_version == writer.memory_version
+
+    # A rebuild keeps the generation it replaces for workers still reading it.
+    import os
+
+    shared = writer.shared_memory
+    old = shared.read_state()
+    rows = np.eye(3, dtype=np.float32)
+    newer = shared.reset(old["source"], rows, ["water"], rows[:1], old["user_offset"])
+    assert shared.matrices(old)[0].shape == (3, 3)
+    shared.reset(old["source"], rows, ["water"], rows[:1], old["user_offset"])
+    assert not os.path.exists(shared._path(old["generation"], "products"))
+    assert shared.matrices(newer)[1].shape == (1, 3)
+
+
+def test_inference_service_batches_and_sheds_load():
+    import json
+    import threading
+    import time
+    import urllib.error
+    import urllib.request
+
+    from src.inference_service import InferenceService, MicroBatcher, Overloaded
+
+    class RecordingEngine:
+        def __init__(self):
+            self.batches = []
+
+        def analyze_many(self, texts, names=None, skip_store=False):
+            self.batches.append(list(texts))
+            time.sleep(0.02)
+            return [{"product_name": name or "Untitled Product", "clean_text": text, "embedding": [1.0]} for text, name in zip(texts, names)]
+
+        def similar_products_many(self, texts, top_k=5):
+            return [[{"product_name": "A", "score": 1.0}][:top_k] for _ in texts]
+
+        def ingredient_insights_many(self, texts, top_k=1):
+            return [{"ingredients_list": text.split(", ")} for text in texts]
+
+    engine = RecordingEngine()
+    service = InferenceService(engine, max_batch_size=8, max_wait_ms=50)
+    server = service.make_server("127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def post(path, payload):
+        request = urllib.request.Request(base + path, data=json.dumps(payload).encode(), method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as exc:
+            return exc.code, json.loads(exc.read())
+
+    try:
+        responses = [None] * 6
+        threads = [
+            threading.Thread(target=lambda i=i: responses.__setitem__(i, post("/analyze", {"ingredients": f"water, item {i}", "product_name": f"P{i}"})))
+            for i in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert all(status == 200 for status, _ in responses)
+        assert [body["product_name"] for _, body in responses] == [f"P{i}" for i in range(6)]
+        assert "embedding" not in responses[0][1]
+        assert max(len(batch) for batch in engine.batches) > 1
+
+        assert post("/similar-products", {"ingredients": "water", "top_k": 1})[1]["similar_products"][0]["product_name"] == "A"
+        assert post("/ingredient-insights", {"ingredients": "water, aqua"})[1]["ingredients_list"] == ["water", "aqua"]
+        assert post("/analyze", {"ingredients": ""})[0] == 400
+
+        with urllib.request.urlopen(base + "/metrics", timeout=5) as response:
+            metrics = json.loads(response.read())["endpoints"]
+        assert metrics["/analyze"]["requests"] == 7
+        assert metrics["/analyze"]["errors"] == 1
+        assert metrics["/analyze"]["batch_size"]["max"] > 1
+
+        # A malformed or negative Content-Length gets a 400, not a dead thread.
+        import http.client
+
+        for length in ("abc", "-5"):
+            connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=5)
+            connection.putrequest("POST", "/analyze")
+            connection.putheader("Content-Length", length)
+            connection.endheaders()
+            assert connection.getresponse().status == 400
+            connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+    # Backpressure: a full queue rejects immediately instead of blocking.
+    release = threading.Event()
+    batcher = MicroBatcher(lambda items: release.wait(5) and items, max_batch_size=1, max_wait=0, max_queue=1)
+    try:
+        first = batcher.submit(1)
+        time.sleep(0.2)  # the worker is now blocked on the first item
+        batcher.submit(2)
+        try:
+            batcher.submit(3)
+            raise AssertionError("expected Overloaded")
+        except Overloaded:
+            pass
+        release.set()
+        assert first.result(timeout=5) == 1
+    finally:
+        release.set()
+        batcher.close()
+
+    # Closing fails whatever is still queued instead of leaving it pending.
+    release = threading.Event()
+    batcher = MicroBatcher(lambda items: release.wait(5) and items, max_batch_size=1, max_wait=0)
+    first = batcher.submit(1)
+    time.sleep(0.2)
+    queued = batcher.submit(2)
+    threading.Timer(0.1, release.set).start()
+    batcher.close()
+    assert first.result(timeout=5) == 1
+    try:
+        queued.result(timeout=1)
+        raise AssertionError("expected Overloaded")
+    except Overloaded:
+        pass
+
+
+def test_cached_halving_search(tmp_path, monkeypatch):
+    import json
+
+    from src import train_tfidf
+
+    groups = {
+        "safe": ["aqua", "glycerin", "panthenol", "niacinamide"],
+        "trigger": ["lauric acid", "cetyl alcohol", "polysorbate 80", "isopropyl myristate"],
+        "fragrance": ["parfum", "linalool", "limonene", "citral"],
+    }
+    rows = [
+        {"ingredients": ", ".join(words[i % 4 :] + words[: i % 4]) + f", extra {i}", "label": label}
+        for label, words in groups.items()
+        for i in range(8)
+    ]
+    data_path = tmp_path / "labelled.csv"
+    data_path.write_text("ingredients,label\n" + "".join(f'"{r["ingredients"]}",{r["label"]}\n' for r in rows))
+    monkeypatch.setattr(train_tfidf, "DATA_PATH", str(data_path))
+
+    options = dict(
+        mode="halving",
+        n_splits=2,
+        workers=1,
+        factor=2,
+        vectorizer_grid={"ngram_range": [(1, 1), (1, 2)], "max_features": [1000], "min_df": [1], "max_df": [1.0]},
+        classifier_grid={"C": [0.5, 2.0], "max_iter": [200]},
+        cache_dir=str(tmp_path / "cache"),
+        results_path=str(tmp_path / "results.json"),
+    )
+    results = train_tfidf.search(**options)
+    assert {"macro_f1", "fit_seconds", "predict_ms_per_1k", "vectorizer", "classifier"} <= set(results[0])
+    assert results[0]["macro_f1"] > 0.9
+    cached = sorted(p.name for p in (tmp_path / "cache").iterdir())
+    assert len([name for name in cached if name.startswith("tfidf-")]) == 4
+
+    # A rerun reuses the corpus and fold matrices and ranks the same way.
+    again = train_tfidf.search(**options)
+    assert sorted(p.name for p in (tmp_path / "cache").iterdir()) == cached
+    assert [(r["vectorizer"], r["classifier"], r["round"]) for r in again] == [(r["vectorizer"], r["classifier"], r["round"]) for r in results]
+    assert json.loads((tmp_path / "results.json").read_text())["rows"] == 24
+
+    # Halving rounds train on fold prefixes; every prefix is stratified.
+    from collections import Counter
+
+    labels = np.array(["a"] * 12 + ["b"] * 6 + ["c"] * 3)
+    order = train_tfidf._stratified_order(np.arange(21), labels, np.random.RandomState(0))
+    assert sorted(order) == list(range(21))
+    assert set(labels[order[:3]]) == {"a", "b", "c"}
+    assert Counter(labels[order[:7]]) == {"a": 4, "b": 2, "c": 1}
+
+
+def test_streaming_trainer_shards_and_update(tmp_path):
+    import joblib
+
+    from src import train_streaming
+
+    labels = [f"label_{i}" for i in range(10)]
+
+    def write_shard(name, repeats):
+        lines = ["ingredients,label"]
+        for label_index, label in enumerate(labels):
+            for i in range(repeats):
+                lines.append(f'"marker{label_index}, common base, filler {i}",{label}')
+        path = tmp_path / name
+        path.write_text("\n".join(lines) + "\n")
+        return str(path)
+
+    shards = [write_shard("a.csv", 12), write_shard("b.csv", 12)]
+    output = str(tmp_path / "streaming.joblib")
+    model = train_streaming.train_streaming(shards, output=output, epochs=3, chunk_size=25)
+    assert len(model.classes_) == 10
+    assert model.predict(["marker3, common base"])[0] == "label_3"
+
+    # The artefact passes the engine's 10-class contract.
+    engine = AnalysisEngine.__new__(AnalysisEngine)
+    engine.model_path = output
+    assert list(engine._load_model().classes_) == list(model.classes_)
+
+    updated = train_streaming.train_streaming([write_shard("new.csv", 2)], output=output, update=True)
+    assert updated.named_steps["clf"].t_ > model.named_steps["clf"].t_
+    assert joblib.load(output).named_steps["clf"].t_ == updated.named_steps["clf"].t_
+
+    # Holdout macro-F1 comes from running confusion counts and matches sklearn.
+    from sklearn.metrics import f1_score
+
+    truth, predicted = [0, 1, 2, 2, 3], [0, 2, 2, 2, 1]
+    confusion = np.zeros((5, 5), dtype=np.int64)
+    np.add.at(confusion, (truth, predicted), 1)
+    assert abs(train_streaming.macro_f1(confusion) - f1_score(truth, predicted, average="macro")) < 1e-12
+
+
+def test_embedding_precompute_is_aligned_and_incremental(tmp_path, monkeypatch):
+    import os
+
+    from src import ingredient_embeddings
+
+    class CountingModel(FakeSentenceModel):
+        encoded = []
+
+        def encode(self, texts, **kwargs):
+            self.encoded.extend(texts)
+            return torch.tensor([[float(len(t)), 1.0, 0.0] for t in texts])
+
+    csv_path = tmp_path / "product_memory.csv"
+    csv_path.write_text('product_names,ingredients\nA,"aqua, glycerin"\n,"no name"\nB,\nC," squalane "\nD,"aqua, glycerin"\n')
+    output = str(tmp_path / "embeddings.pt")
+    model = CountingModel()
+
+    stats = ingredient_embeddings.precompute(str(csv_path), output, chunk_size=2, model=model)
+    assert stats == {"rows": 3, "encoded": 3, "reused": 0}
+    monkeypatch.setattr(embeddings_utils, "BASE_PRODUCT_MEMORY_PATH", str(csv_path))
+    monkeypatch.setattr(embeddings_utils, "BASE_EMBEDDINGS_PATH", output)
+    names, ingredients, embeddings = embeddings_utils.load_base_product_memory(model)
+    assert names == ["A", "C", "D"] and ingredients == ["aqua, glycerin", "squalane", "aqua, glycerin"]
+    assert embeddings[:, 0].tolist() == [float(len(text)) for text in ingredients]
+
+    mtime = os.path.getmtime(output)
+    assert ingredient_embeddings.precompute(str(csv_path), output, model=model)["encoded"] == 0
+    assert os.path.getmtime(output) == mtime  # unchanged inputs leave the file alone
+
+    csv_path.write_text('product_names,ingredients\nC,"squalane"\nE,"zinc oxide"\nA,"aqua, glycerin"\n')
+    model.encoded.clear()
+    stats = ingredient_embeddings.precompute(str(csv_path), output, model=model)
+    assert stats == {"rows": 3, "encoded": 1, "reused": 2} and model.encoded == ["zinc oxide"]
+    assert embeddings_utils.load_base_product_memory(model)[2][:, 0].tolist() == [8.0, 10.0, 14.0]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
 def test_ocr_placeholder():
     text = extract_ingredients_from_image(None)
     assert isinstance(text, str)